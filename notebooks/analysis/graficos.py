@@ -1,5 +1,8 @@
 # --- Función para graficar NDVI vs Precipitación normalizados ---
 def graficar_ndvi_vs_precipitacion(df):
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as mticker
+
     # Elimina filas con valores nulos en las columnas clave
     df = df.dropna(subset=['NDVI_promedio', 'Precipitacion_mm'])
 
@@ -37,33 +40,42 @@ def graficar_ndvi_vs_precipitacion(df):
     plt.show()
     
 # --- Función para obtener el rango (mínimo y máximo) de cada banda 'fittedResidual' en los años seleccionados ---
-def obtener_rango_fitted(fitted_stack, years, aoi):
-    import ee
-    rangos = {}
-    for year in years:
-        banda = fitted_stack.select(f'fittedResidual_{year}')  # Selecciona la banda correspondiente al año
-        stats = banda.reduceRegion(
-            reducer=ee.Reducer.minMax(),                       # Calcula mínimo y máximo
+def obtener_rango_fitted(fitted_stack, years, aoi, por_lotes=True, percentiles=None):
+    from utils.cache import info_en_cache
+    from utils.display import reductor_rango      # minMax o percentiles (p. ej. 2/98) con salidas min/max
+
+    def reducir(bandas):
+        return info_en_cache(fitted_stack.select(bandas).reduceRegion(  # Consulta antes la caché en disco
+            reducer=reductor_rango(percentiles),               # Calcula mínimo y máximo
             geometry=aoi.geometry(),                           # Dentro del área de interés
             scale=250,                                         # Resolución de 250 metros
             maxPixels=1e13                                     # Límite de píxeles para evitar errores
-        ).getInfo()
-        rangos[year] = (
-            stats.get(f'fittedResidual_{year}_min'),           # Guarda el mínimo
-            stats.get(f'fittedResidual_{year}_max')            # Guarda el máximo
-        )
-    return rangos  # Devuelve un diccionario con los rangos por año
+        ))
+
+    # Por lotes: una sola llamada reduceRegion para todas las bandas de los años pedidos
+    if por_lotes:
+        stats_lote = reducir([f'fittedResidual_{year}' for year in years])
+
+    rangos = {}
+    for year in years:
+        stats = stats_lote if por_lotes else reducir(f'fittedResidual_{year}')  # Banda del año
+        rangos[year] = {
+            'min': stats.get(f'fittedResidual_{year}_min', -0.2),  # Guarda el mínimo (o el valor por defecto)
+            'max': stats.get(f'fittedResidual_{year}_max', 0.8)    # Guarda el máximo (o el valor por defecto)
+        }
+    return rangos  # Devuelve {year: {'min', 'max'}}, el formato que lee mostrar_landtrendr_fitted
 
 # --- Función para mostrar los mapas 'fitted' de NDVI ajustado por año usando Matplotlib ---
 def mostrar_landtrendr_fitted(fitted_stack, years, aoi, palette=None, rangos=None):
     import matplotlib.pyplot as plt
-    from utils.display import mostrar_imagen_ee  # Función personalizada para mostrar imágenes de EE
+    from utils.display import mostrar_paneles_ee  # Descarga en paralelo las imágenes de EE
 
     # Crea una figura con subplots, uno por cada año
-    fig, axes = plt.subplots(1, len(years), figsize=(6 * len(years), 5))
+    fig, axes = plt.subplots(1, len(years), figsize=(6 * len(years), 5), squeeze=False)
 
-    # Itera por cada año a mostrar
-    for i, year in enumerate(years):
+    # Arma un panel por cada año a mostrar
+    paneles = []
+    for year in years:
         banda = fitted_stack.select(f'fittedResidual_{year}')  # Selecciona la banda para ese año
         
         # Usa rangos personalizados si están definidos, si no usa un rango por defecto
@@ -73,17 +85,16 @@ def mostrar_landtrendr_fitted(fitted_stack, years, aoi, palette=None, rangos=Non
         else:
             min_val, max_val = -0.2, 0.8
 
-        # Visualiza la imagen con los parámetros definidos
-        mostrar_imagen_ee(
-            imagen=banda,
-            region=aoi,
-            titulo=f'Fitted NDVI {year}',           # Título específico para el año
-            min_val=min_val,
-            max_val=max_val,
-            palette=palette or ["ff0000", "ffffff", "00ff00"],  # Paleta por defecto: rojo-blanco-verde
-            ax=axes[i],                             # Dibuja en el subplot correspondiente
-            barra_color=False                       # No mostrar barra de color
-        )
+        paneles.append({
+            'imagen': banda,
+            'titulo': f'Fitted NDVI {year}',           # Título específico para el año
+            'min_val': min_val,
+            'max_val': max_val,
+            'palette': palette or ["ff0000", "ffffff", "00ff00"]  # Paleta por defecto: rojo-blanco-verde
+        })
+
+    # Pide todas las URLs, descarga en paralelo y dibuja cada panel cuando llega
+    mostrar_paneles_ee(paneles, aoi, axes[0])
 
     plt.tight_layout()  # Ajusta espaciado
     plt.show()          # Muestra el conjunto de mapas
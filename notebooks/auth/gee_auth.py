@@ -2,6 +2,8 @@
 
 # Función para autenticar y/o inicializar el entorno de GEE
 def autenticar_gee():
+    import ee
+
     try:
         # Intenta inicializar GEE (si ya fue autenticado previamente, esto funciona directo)
         ee.Initialize()
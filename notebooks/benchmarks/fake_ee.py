@@ -0,0 +1,215 @@
+# --- Módulo 'ee' falso para los benchmarks: arma grafos de expresión sin red y simula la latencia ---
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+
+latencia = 0.0          # Segundos por llamada remota (getInfo, getThumbURL, descarga)
+llamadas = Counter()    # Llamadas remotas simuladas por tipo
+_candado = threading.Lock()
+
+
+def configurar(latencia_remota=0.0):
+    """Fija la latencia simulada y reinicia los contadores."""
+    global latencia
+    latencia = latencia_remota
+    reiniciar()
+
+
+def reiniciar():
+    with _candado:
+        llamadas.clear()
+
+
+def llamadas_remotas():
+    return sum(llamadas.values())
+
+
+def _llamada_remota(tipo):
+    with _candado:
+        llamadas[tipo] += 1
+    if latencia:
+        time.sleep(latencia)
+
+
+def _a_json(valor):
+    if isinstance(valor, ComputedObject):
+        return valor._grafo()
+    if isinstance(valor, dict):
+        return {str(k): _a_json(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_a_json(v) for v in valor]
+    if callable(valor):
+        return getattr(valor, "__name__", "funcion")
+    return valor
+
+
+class _MetaObjeto(type):
+    # Constructores estáticos (ee.Date.fromYMD, ee.Reducer.minMax, ee.Clusterer.wekaKMeans, ...)
+    def __getattr__(cls, nombre):
+        if nombre.startswith("_"):
+            raise AttributeError(nombre)
+        return lambda *args, **kwargs: cls(f"{cls.__name__}.{nombre}", args, kwargs)
+
+
+class ComputedObject(metaclass=_MetaObjeto):
+    """Nodo del grafo: operación, argumentos y objeto de origen. Cualquier método devuelve un nodo nuevo."""
+
+    def __init__(self, operacion=None, args=(), kwargs=None, origen=None, bandas=None, elementos=None):
+        # Llamadas del tipo ee.Image(x) o ee.FeatureCollection(x) envuelven a otro objeto
+        if not isinstance(operacion, str) or operacion.startswith("{"):
+            args, operacion = (operacion,), f"{type(self).__name__}"
+        self.operacion = operacion
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.origen = origen
+        self.bandas = bandas if bandas is not None else getattr(origen, "bandas", None)
+        self.elementos = elementos if elementos is not None else getattr(origen, "elementos", None)
+        if self.elementos is None and args and isinstance(args[0], list):
+            self.elementos = len(args[0])
+
+    def _derivar(self, operacion, args, kwargs, tipo=None, **extra):
+        return (tipo or type(self))(operacion, args, kwargs, origen=self, **extra)
+
+    def __getattr__(self, nombre):
+        if nombre.startswith("_"):
+            raise AttributeError(nombre)
+        return lambda *args, **kwargs: self._derivar(nombre, args, kwargs)
+
+    def _grafo(self):
+        return {"op": self.operacion, "args": _a_json(self.args), "kwargs": _a_json(self.kwargs),
+                "de": None if self.origen is None else self.origen._grafo()}
+
+    def serialize(self):
+        return json.dumps(self._grafo(), sort_keys=True, default=str)
+
+    def getInfo(self):
+        _llamada_remota("getInfo")
+        return self._info()
+
+    def _info(self):
+        return {}
+
+
+class Image(ComputedObject):
+    def select(self, bandas, *args, **kwargs):
+        bandas = [bandas] if isinstance(bandas, str) else list(bandas) if isinstance(bandas, (list, tuple)) else None
+        return self._derivar("select", (bandas,), kwargs, bandas=bandas)
+
+    def reduceRegion(self, *args, **kwargs):
+        return self._derivar("reduceRegion", args, kwargs, tipo=Dictionary)
+
+    def getThumbURL(self, parametros):
+        _llamada_remota("getThumbURL")
+        clave = hashlib.sha1((self.serialize() + json.dumps(parametros, default=str)).encode()).hexdigest()
+        return f"https://fake-ee.invalid/thumb/{clave}?dimensions={parametros.get('dimensions', 512)}"
+
+
+class Dictionary(ComputedObject):
+    def _info(self):
+        # Estadísticas de reduceRegion: {banda_min, banda_max} para las bandas seleccionadas
+        info = {}
+        for banda in self.bandas or ["greenness", "precip"]:
+            info.update({f"{banda}_min": -0.1, f"{banda}_max": 0.3, banda: 0.5})
+        return info
+
+
+class ImageCollection(ComputedObject):
+    def map(self, funcion):
+        # Como en EE, la función se evalúa una vez en el cliente sobre un elemento simbólico
+        resultado = funcion(Image("elemento"))
+        tipo = FeatureCollection if isinstance(resultado, Feature) else ImageCollection
+        return self._derivar("map", (resultado,), {}, tipo=tipo)
+
+
+class FeatureCollection(ComputedObject):
+    def geometry(self, *args):
+        return self._derivar("geometry", args, {}, tipo=Geometry)
+
+    def _info(self):
+        return {"features": [
+            {"properties": {"greenness": 0.5 + 0.01 * i, "precip": 1000.0 + 20 * i, "year": 2001 + i}}
+            for i in range(self.elementos or 0)
+        ]}
+
+
+class Feature(ComputedObject):
+    pass
+
+
+class Geometry(ComputedObject):
+    pass
+
+
+class Date(ComputedObject):
+    pass
+
+
+class Reducer(ComputedObject):
+    pass
+
+
+class Filter(ComputedObject):
+    pass
+
+
+class Clusterer(ComputedObject):
+    pass
+
+
+class Number(ComputedObject):
+    pass
+
+
+class List(ComputedObject):
+    def map(self, funcion):
+        # Igual que ImageCollection.map: la función se evalúa una vez sobre un elemento simbólico
+        return self._derivar("map", (funcion(ComputedObject("elemento")),), {})
+
+
+class Algorithms:
+    @staticmethod
+    def If(condicion, verdadero, falso):
+        return ComputedObject("Algorithms.If", (condicion, verdadero, falso))
+
+    class TemporalSegmentation:
+        @staticmethod
+        def LandTrendr(**parametros):
+            return Image("Algorithms.TemporalSegmentation.LandTrendr", (), parametros)
+
+
+def Initialize(*args, **kwargs):
+    pass
+
+
+def Authenticate(*args, **kwargs):
+    pass
+
+
+class RespuestaFalsa:
+    def __init__(self, contenido):
+        self.content = contenido
+
+
+class SesionFalsa:
+    """Sustituye a la sesión de requests: cada descarga tarda `latencia` y devuelve un PNG válido."""
+
+    def __init__(self):
+        self._png = {}
+
+    def get(self, url, timeout=None):
+        import io
+
+        import numpy as np
+        from PIL import Image as ImagenPIL
+
+        _llamada_remota("descarga")
+        dimensiones = int(url.rsplit("dimensions=", 1)[-1]) if "dimensions=" in url else 512
+        if dimensiones not in self._png:
+            rng = np.random.default_rng(dimensiones)
+            pixeles = rng.integers(0, 255, (dimensiones, dimensiones, 3), dtype=np.uint8)
+            salida = io.BytesIO()
+            ImagenPIL.fromarray(pixeles).save(salida, format="PNG")
+            self._png[dimensiones] = salida.getvalue()
+        return RespuestaFalsa(self._png[dimensiones])
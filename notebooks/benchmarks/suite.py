@@ -0,0 +1,358 @@
+# --- Benchmarks de residuos, segmentación, clustering y visualización ---
+"""
+Uso (desde notebooks/):
+
+    python -m benchmarks.suite --tamanos 64x64x20 256x256x20 --latencia 0.05
+    python -m benchmarks.suite --casos residuos_local kmeans_local --guardar-base
+
+Los casos '*_local' usan cubos NDVI/precipitación sintéticos; los '*_ee' usan benchmarks.fake_ee,
+que arma los grafos de expresión sin red y simula `latencia` segundos por llamada remota.
+Cada caso se ejecuta en un proceso aparte para medir su pico de memoria (RSS). La memoria que se
+compara es el crecimiento del pico sobre el RSS del mismo proceso después de importar y preparar el
+caso, así que no depende de cuánto ocupan el intérprete y las bibliotecas en cada máquina.
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+RUTA_BASE = Path(__file__).with_name("baselines.json")
+
+
+def leer_tamano(texto):
+    """'filas x columnas x años', p. ej. '64x64x20'."""
+    filas, columnas, years = (int(v) for v in texto.lower().split("x"))
+    return filas, columnas, years
+
+
+def cubo_sintetico(filas, columnas, num_years, semilla=0):
+    """ColeccionLocal 'greenness'/'precip' con una relación lineal, ruido y una perturbación a mitad del periodo."""
+    from utils.local import ColeccionLocal
+
+    rng = np.random.default_rng(semilla)
+    forma = (num_years, filas, columnas)
+    precip = rng.uniform(800, 2000, forma).astype(np.float32)
+    ndvi = (0.3 + 0.0002 * precip + rng.normal(0, 0.02, forma)).astype(np.float32)
+    ndvi[num_years // 2:, :filas // 3] -= 0.2
+    return ColeccionLocal(np.stack([ndvi, precip], axis=1), range(2001, 2001 + num_years), ["greenness", "precip"])
+
+
+def _instalar_ee_falso():
+    """Registra benchmarks.fake_ee como 'ee'; los módulos lo importan dentro de cada función."""
+    from benchmarks import fake_ee
+    sys.modules["ee"] = fake_ee
+
+    import utils.display
+    from utils.cache import configurar_cache, configurar_cache_miniaturas
+    utils.display._sesion = fake_ee.SesionFalsa()
+    # Sin caché: cada repetición paga sus llamadas remotas
+    configurar_cache(activa=False)
+    configurar_cache_miniaturas(activa=False)
+    return fake_ee
+
+
+# --- Casos: cada uno prepara sus datos y devuelve la función a medir ---
+
+def caso_residuos_local(filas, columnas, num_years, modo="global"):
+    from utils.processing import calcular_residuos
+
+    coleccion = cubo_sintetico(filas, columnas, num_years)
+    return lambda: calcular_residuos(coleccion, None, modo=modo)
+
+
+def caso_residuos_local_pixel(filas, columnas, num_years):
+    return caso_residuos_local(filas, columnas, num_years, modo="pixel")
+
+
+def caso_landtrendr_local(filas, columnas, num_years):
+    from utils.processing import calcular_residuos, ejecutar_landtrendr, extraer_fitted_stack
+
+    residuos = calcular_residuos(cubo_sintetico(filas, columnas, num_years), None).select("residual")
+    return lambda: extraer_fitted_stack(ejecutar_landtrendr(residuos), 2001, num_years)
+
+
+def caso_kmeans_local(filas, columnas, num_years):
+    from utils.clustering import aplicar_clustering, entrenar_kmeans, sample_training_data
+    from utils.local import ImagenLocal
+
+    rng = np.random.default_rng(0)
+    fitted = ImagenLocal(rng.normal(size=(num_years, filas, columnas)).astype(np.float32),
+                         [f"fittedResidual_{2001 + i}" for i in range(num_years)])
+
+    def ejecutar():
+        modelo = entrenar_kmeans(sample_training_data(fitted, None), num_clusters=10)
+        return aplicar_clustering(fitted, modelo)
+    return ejecutar
+
+
+def _coleccion_ee(ee, num_years):
+    from utils.processing import combinar_ndvi_precip
+
+    aoi = ee.FeatureCollection("projects/benchmark/assets/aoi")
+    return ee.ImageCollection([combinar_ndvi_precip(2001 + i, aoi) for i in range(num_years)]), aoi
+
+
+def caso_composites_ee_por_year(filas, columnas, num_years):
+    from utils.processing import combinar_ndvi_precip
+
+    ee = _instalar_ee_falso()
+    aoi = ee.FeatureCollection("projects/benchmark/assets/aoi")
+    return lambda: ee.ImageCollection([combinar_ndvi_precip(2001 + i, aoi) for i in range(num_years)]).serialize()
+
+
+def caso_composites_ee(filas, columnas, num_years):
+    from utils.processing import coleccion_ndvi_precip
+
+    ee = _instalar_ee_falso()
+    aoi = ee.FeatureCollection("projects/benchmark/assets/aoi")
+    return lambda: coleccion_ndvi_precip(range(2001, 2001 + num_years), aoi).serialize()
+
+
+def caso_residuos_ee(filas, columnas, num_years):
+    from utils.processing import calcular_residuos
+
+    ee = _instalar_ee_falso()
+    coleccion, aoi = _coleccion_ee(ee, num_years)
+    return lambda: calcular_residuos(coleccion, aoi)
+
+
+def caso_landtrendr_ee(filas, columnas, num_years):
+    from utils.processing import ejecutar_landtrendr, extraer_fitted_stack
+
+    ee = _instalar_ee_falso()
+    coleccion, _ = _coleccion_ee(ee, num_years)
+    return lambda: extraer_fitted_stack(ejecutar_landtrendr(coleccion.select("residual")), 2001, num_years)
+
+
+def caso_kmeans_ee(filas, columnas, num_years):
+    from utils.clustering import aplicar_clustering, entrenar_kmeans, sample_training_data
+
+    ee = _instalar_ee_falso()
+    aoi = ee.FeatureCollection("projects/benchmark/assets/aoi")
+    vertices = ee.Image("vertex_stack")
+
+    def ejecutar():
+        modelo = entrenar_kmeans(sample_training_data(vertices, aoi), num_clusters=10)
+        return aplicar_clustering(vertices, modelo).serialize()
+    return ejecutar
+
+
+def caso_rango_fitted_ee(filas, columnas, num_years, por_lotes=True):
+    from utils.display import obtener_rango_fitted
+
+    ee = _instalar_ee_falso()
+    aoi = ee.FeatureCollection("projects/benchmark/assets/aoi")
+    fitted = ee.Image("fitted_stack")
+    years = [2001 + i for i in range(num_years)]
+    return lambda: obtener_rango_fitted(fitted, years, aoi, por_lotes=por_lotes)
+
+
+def caso_rango_fitted_ee_por_banda(filas, columnas, num_years):
+    return caso_rango_fitted_ee(filas, columnas, num_years, por_lotes=False)
+
+
+def caso_mostrar_fitted_ee(filas, columnas, num_years):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from utils.display import mostrar_landtrendr_fitted
+
+    ee = _instalar_ee_falso()
+    aoi = ee.FeatureCollection("projects/benchmark/assets/aoi")
+    fitted = ee.Image("fitted_stack")
+    years = [2001, 2001 + num_years // 2, 2000 + num_years]
+
+    def ejecutar():
+        mostrar_landtrendr_fitted(fitted, years, aoi)
+        plt.close("all")
+    return ejecutar
+
+
+def caso_exportar_fitted_ee(filas, columnas, num_years):
+    """Modo exportación con el servicio simulado: tarea, sondeo, descarga y ensamblado de las teselas."""
+    import tempfile
+
+    from utils.export import ServicioSimulado, exportar_imagen
+    from utils.processing import ejecutar_landtrendr, extraer_fitted_stack
+    from utils.store import AlmacenCubos
+
+    ee = _instalar_ee_falso()
+    coleccion, aoi = _coleccion_ee(ee, num_years)
+    fitted = extraer_fitted_stack(ejecutar_landtrendr(coleccion.select("residual")), 2001, num_years)
+    bandas = [f"fittedResidual_{2001 + i}" for i in range(num_years)]
+    servicio = ServicioSimulado(forma=(filas, columnas), tesela=128, sondeos=3)
+
+    def ejecutar():
+        with tempfile.TemporaryDirectory() as directorio:
+            exportar_imagen(servicio, fitted, aoi.geometry(), AlmacenCubos(directorio), "fitted", bandas,
+                            espera=0.01)
+    return ejecutar
+
+
+CASOS = {
+    "residuos_local": caso_residuos_local,
+    "residuos_local_pixel": caso_residuos_local_pixel,
+    "landtrendr_local": caso_landtrendr_local,
+    "kmeans_local": caso_kmeans_local,
+    "composites_ee_por_year": caso_composites_ee_por_year,
+    "composites_ee": caso_composites_ee,
+    "residuos_ee": caso_residuos_ee,
+    "landtrendr_ee": caso_landtrendr_ee,
+    "kmeans_ee": caso_kmeans_ee,
+    "rango_fitted_ee": caso_rango_fitted_ee,
+    "rango_fitted_ee_por_banda": caso_rango_fitted_ee_por_banda,
+    "mostrar_fitted_ee": caso_mostrar_fitted_ee,
+    "exportar_fitted_ee": caso_exportar_fitted_ee,
+}
+
+
+def _rss_actual_mb():
+    """RSS actual del proceso (Linux, /proc/self/statm), o None si no se puede leer."""
+    import os
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError):
+        return None
+
+
+def _pico_rss_mb():
+    """Pico de RSS (VmHWM; si no está, ru_maxrss, que no se puede reiniciar)."""
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux: KiB
+
+
+def _reiniciar_pico_rss():
+    # Escribir 5 en clear_refs reinicia VmHWM (Linux >= 4.0); sin él, el pico incluye la preparación
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def medir(caso, tamano, latencia=0.05, repeticiones=3):
+    """
+    Prepara el caso y mide su mejor tiempo de `repeticiones`, las llamadas remotas y cuánto crece el
+    pico de RSS por encima del RSS tras la preparación (importaciones, datos del caso y una pasada
+    de calentamiento).
+    """
+    from benchmarks import fake_ee
+
+    filas, columnas, num_years = leer_tamano(tamano)
+    ejecutar = CASOS[caso](filas, columnas, num_years)
+    fake_ee.configurar(latencia)
+    # Una pasada de calentamiento carga los módulos que el caso importa al ejecutarse
+    ejecutar()
+    _reiniciar_pico_rss()
+    rss_inicial = _rss_actual_mb()
+    tiempos = []
+    for _ in range(repeticiones):
+        fake_ee.reiniciar()
+        inicio = time.perf_counter()
+        ejecutar()
+        tiempos.append(time.perf_counter() - inicio)
+
+    segundos = min(tiempos)
+    return {
+        "caso": caso,
+        "tamano": tamano,
+        "segundos": segundos,
+        "pixeles_s": filas * columnas / segundos if segundos > 0 else float("inf"),
+        "rss_mb": max(_pico_rss_mb() - (rss_inicial or 0.0), 0.0),
+        "llamadas_remotas": fake_ee.llamadas_remotas(),
+    }
+
+
+def ejecutar_suite(tamanos=("64x64x20",), casos=None, latencia=0.05, repeticiones=3, aislar=True):
+    """Ejecuta los casos para cada tamaño; con aislar=True cada uno corre en un proceso nuevo (spawn)."""
+    resultados = []
+    for tamano in tamanos:
+        for caso in casos or CASOS:
+            if aislar:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                    resultados.append(pool.submit(medir, caso, tamano, latencia, repeticiones).result())
+            else:
+                resultados.append(medir(caso, tamano, latencia, repeticiones))
+    return resultados
+
+
+def leer_base(ruta=RUTA_BASE):
+    return json.loads(Path(ruta).read_text(encoding="utf-8")) if Path(ruta).exists() else {}
+
+
+def guardar_base(resultados, ruta=RUTA_BASE):
+    """Guarda (o actualiza) la línea base con los resultados indicados."""
+    base = leer_base(ruta)
+    for r in resultados:
+        base[f"{r['caso']}@{r['tamano']}"] = {k: r[k] for k in ("segundos", "pixeles_s", "rss_mb", "llamadas_remotas")}
+    Path(ruta).write_text(json.dumps(base, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+
+
+def comparar(resultados, base, tolerancia=0.25):
+    """
+    Marca como regresión los casos más lentos que la base en más de `tolerancia` (proporción),
+    con más memoria en la misma proporción o con más llamadas remotas. La memoria es el crecimiento
+    sobre el RSS tras preparar el caso; los tiempos sí dependen de la máquina, así que conviene
+    regenerar la base con --guardar-base en la máquina donde se compara.
+    """
+    for r in resultados:
+        referencia = base.get(f"{r['caso']}@{r['tamano']}")
+        if referencia is None:
+            r["comparacion"] = "sin base"
+            continue
+        r["cambio_tiempo"] = r["segundos"] / referencia["segundos"] - 1
+        # Se ignoran diferencias de pocos milisegundos, que son ruido en los casos que solo arman grafos
+        # y de pocos MB de memoria, que es lo que varía el asignador entre corridas
+        regresion = (r["cambio_tiempo"] > tolerancia and r["segundos"] - referencia["segundos"] > 0.005
+                     or r["rss_mb"] > referencia["rss_mb"] * (1 + tolerancia) and r["rss_mb"] - referencia["rss_mb"] > 8
+                     or r["llamadas_remotas"] > referencia["llamadas_remotas"])
+        r["comparacion"] = "REGRESIÓN" if regresion else "ok"
+    return resultados
+
+
+def imprimir(resultados):
+    print(f"{'caso':28} {'tamaño':>12} {'s':>8} {'píxeles/s':>12} {'+RSS MB':>8} {'remotas':>8}  comparación")
+    for r in resultados:
+        cambio = f" ({100 * r['cambio_tiempo']:+.0f} %)" if "cambio_tiempo" in r else ""
+        print(f"{r['caso']:28} {r['tamano']:>12} {r['segundos']:>8.3f} {r['pixeles_s']:>12.0f} "
+              f"{r['rss_mb']:>8.1f} {r['llamadas_remotas']:>8}  {r.get('comparacion', '')}{cambio}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks del flujo de detección de cambios")
+    parser.add_argument("--tamanos", nargs="+", default=["64x64x20"], help="filas x columnas x años")
+    parser.add_argument("--casos", nargs="+", choices=sorted(CASOS), default=None)
+    parser.add_argument("--latencia", type=float, default=0.05, help="segundos por llamada remota simulada")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--tolerancia", type=float, default=0.25)
+    parser.add_argument("--sin-aislar", action="store_true", help="no usar un proceso por caso")
+    parser.add_argument("--guardar-base", action="store_true", help="guarda los resultados como línea base")
+    parser.add_argument("--json", help="ruta donde guardar los resultados")
+    args = parser.parse_args(argv)
+
+    resultados = ejecutar_suite(args.tamanos, args.casos, args.latencia, args.repeticiones, not args.sin_aislar)
+    comparar(resultados, leer_base(), args.tolerancia)
+    imprimir(resultados)
+    if args.json:
+        Path(args.json).write_text(json.dumps(resultados, indent=2, ensure_ascii=False), encoding="utf-8")
+    if args.guardar_base:
+        guardar_base(resultados)
+    return 1 if any(r.get("comparacion") == "REGRESIÓN" for r in resultados) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
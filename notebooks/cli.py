@@ -0,0 +1,341 @@
+# --- Línea de comandos: el flujo de main.ipynb sin Jupyter ---
+"""
+Uso (desde notebooks/):
+
+    python -m cli cluster --salida corrida/ --ndvi "datos/MOD13Q1/*.tif" --precip "datos/CHIRPS/*.tif" --aoi palmira.geojson
+    python -m cli render --backend ee --salida corrida_ee/ --years 2001-2020
+    python -m cli render --backend ee --salida corrida_ee/ --exportar residuals landtrendr cluster --bucket mi-bucket
+    python -m cli select-muni --salida corrida/ --docs docs/
+    python -m cli all --salida corrida/ --ndvi ... --precip ... --docs docs/
+
+Cada subcomando es un nodo del grafo composite -> residuals -> landtrendr -> cluster -> render
+(select-muni es independiente) y ejecuta antes los nodos de los que depende; 'all' pide render y
+select-muni, y las dos ramas corren a la vez. Los resultados se escriben en --salida a medida que cada nodo
+termina (AlmacenCubos con el backend local, grafos serializados con EE). dag.json guarda la huella
+de las entradas de cada nodo: si no cambió y su resultado sigue en el disco, el nodo se salta.
+Con --exportar, los nodos EE indicados sacan su resultado con tareas Export (Cloud Storage en --bucket)
+en lugar de llamadas interactivas y lo ensamblan en --salida; render usa entonces el clustering local.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+# Nodo -> (etapa de utils.batch o None, nodos de los que depende)
+NODOS = {
+    "composite": ("composites", ()),
+    "residuals": ("residuos", ("composite",)),
+    "landtrendr": ("landtrendr", ("residuals",)),
+    "cluster": ("clustering", ("landtrendr",)),
+    "render": (None, ("cluster",)),
+    "select-muni": (None, ()),
+}
+
+
+def leer_years(texto):
+    """'2001-2020' o '2001,2005,2010'."""
+    if "-" in texto:
+        inicio, fin = (int(v) for v in texto.split("-"))
+        return list(range(inicio, fin + 1))
+    return [int(v) for v in texto.split(",")]
+
+
+def expandir_archivos(patrones):
+    """Rutas de los archivos que coinciden con los patrones (o las rutas tal cual, si ya las expandió la shell)."""
+    rutas = set()
+    for patron in patrones or []:
+        rutas.update(glob.glob(patron) or [patron])
+    return sorted(rutas)
+
+
+class Manifiesto:
+    """dag.json en la carpeta de salida: huella de las entradas y duración de cada nodo terminado."""
+
+    def __init__(self, directorio):
+        self.ruta = Path(directorio) / "dag.json"
+        self.nodos = json.loads(self.ruta.read_text(encoding="utf-8")) if self.ruta.exists() else {}
+        self._candado = threading.Lock()
+
+    def vigente(self, nodo, huella):
+        return self.nodos.get(nodo, {}).get("huella") == huella
+
+    def anotar(self, nodo, huella, segundos):
+        with self._candado:
+            self.nodos[nodo] = {"huella": huella, "segundos": round(segundos, 3), "fecha": time.strftime("%Y-%m-%dT%H:%M:%S")}
+            # Se escribe a un temporal y se renombra: una corrida interrumpida no deja un dag.json a medias
+            temporal = self.ruta.with_suffix(".tmp")
+            temporal.write_text(json.dumps(self.nodos, ensure_ascii=False, indent=2), encoding="utf-8")
+            temporal.replace(self.ruta)
+
+
+class Corrida:
+    """Parámetros de una ejecución, backend de utils.batch y resultados de los nodos ya disponibles."""
+
+    def __init__(self, args):
+        from utils.batch import BackendEE, BackendLocal
+
+        self.args = args
+        self.salida = Path(args.salida)
+        self.salida.mkdir(parents=True, exist_ok=True)
+        self.years = args.years
+        if args.backend == "ee":
+            import ee
+
+            if args.proyecto:
+                ee.Initialize(project=args.proyecto)
+            else:
+                ee.Initialize()
+            from utils.export import ServicioTareasEE
+            from utils.helpers import PlanRemuestreo
+
+            # Rejilla MOD13Q1 registrada, no reproyectada: se aplica al reducir y sobre LandTrendr
+            rejilla = ee.ImageCollection('MODIS/061/MOD13Q1').first().select('NDVI').projection()
+            self.backend = BackendEE(self.years, num_clusters=args.clusters, modo_residuos=args.modo_residuos,
+                                     remuestreo=PlanRemuestreo(rejilla),
+                                     exportar=[NODOS[nodo][0] for nodo in args.exportar],
+                                     servicio=ServicioTareasEE(args.bucket) if args.exportar else None)
+        else:
+            self.ndvi, self.precip = expandir_archivos(args.ndvi), expandir_archivos(args.precip)
+            self.backend = BackendLocal(self.ndvi, self.precip, self.years, num_clusters=args.clusters,
+                                        modo_residuos=args.modo_residuos)
+        self._aoi = None
+        self._resultados = {}
+        self._candado = threading.Lock()
+
+    def parametros(self, nodo):
+        """Entradas propias de cada nodo; las de los nodos previos entran a través de sus huellas."""
+        parametros = self._parametros(nodo)
+        # Un nodo exportado deja además su producto en el almacén: activar la exportación lo invalida
+        if nodo in self.args.exportar:
+            parametros["exportar"] = True
+        return parametros
+
+    def _parametros(self, nodo):
+        from utils.batch import huella_archivos
+
+        args = self.args
+        if nodo == "composite":
+            if args.backend == "ee":
+                return {"backend": "ee", "years": self.years, "aoi": args.aoi}
+            return {"backend": "local", "years": self.years, "ndvi": huella_archivos(self.ndvi),
+                    "precip": huella_archivos(self.precip), "aoi": huella_archivos([args.aoi] if args.aoi else [])}
+        if nodo == "residuals":
+            return {"modo": args.modo_residuos}
+        if nodo == "cluster":
+            return {"clusters": args.clusters}
+        if nodo == "render":
+            return {"dimensiones": args.dimensiones}
+        if nodo == "select-muni":
+            from data.select_muni.data_select_muni import definir_rutas
+
+            return {"archivos": huella_archivos(definir_rutas(args.docs).values())}
+        return {}
+
+    def aoi(self):
+        # Solo lo piden los nodos de la cadena raster, que corren uno tras otro
+        if self._aoi is None:
+            if self.args.backend == "ee":
+                import ee
+
+                self._aoi = self.backend.preparar("aoi", ee.FeatureCollection(self.args.aoi))
+            elif self.args.aoi:
+                import geopandas as gpd
+
+                self._aoi = self.backend.preparar("aoi", gpd.read_file(self.args.aoi))
+        return self._aoi
+
+    def _ruta_render(self):
+        return self.salida / "render" / "clusters.png"
+
+    def _rutas_select_muni(self):
+        carpeta = self.salida / "select_muni"
+        return carpeta / "score.csv", carpeta / "top.csv"
+
+    def leer(self, nodo):
+        """Resultado guardado de un nodo en --salida, o None si falta."""
+        etapa = NODOS[nodo][0]
+        if etapa is not None:
+            return self.backend.cargar_etapa(etapa, self.salida)
+        if nodo == "render":
+            return self._ruta_render() if self._ruta_render().exists() else None
+        return self._rutas_select_muni() if all(r.exists() for r in self._rutas_select_muni()) else None
+
+    def cargar(self, nodo):
+        """Resultado de un nodo: de la memoria si se acaba de calcular, si no desde --salida."""
+        with self._candado:
+            if nodo in self._resultados:
+                return self._resultados[nodo]
+        resultado = self.leer(nodo)
+        with self._candado:
+            self._resultados[nodo] = resultado
+        return resultado
+
+    def ejecutar(self, nodo):
+        etapa, dependencias = NODOS[nodo]
+        if etapa is not None:
+            previo = self.cargar(dependencias[0]) if dependencias else None
+            resultado = self.backend.ejecutar_etapa(etapa, self.aoi(), previo, self.salida)
+        elif nodo == "render":
+            from utils.display import guardar_clustering
+
+            self._ruta_render().parent.mkdir(parents=True, exist_ok=True)
+            clusters = self.cargar("cluster")
+            if "cluster" in self.args.exportar:
+                from utils.store import AlmacenCubos
+
+                # El clustering exportado ya está en el almacén: se colorea sin getThumbURL
+                clusters = AlmacenCubos(self.salida).abrir("clusters")
+            resultado = guardar_clustering(clusters, self.aoi(), self._ruta_render(),
+                                           dimensiones=self.args.dimensiones)
+        else:
+            from data.select_muni.data_select_muni import procesar_datos_completos
+
+            df_score, top_validos = procesar_datos_completos(self.args.docs)
+            resultado = self._rutas_select_muni()
+            resultado[0].parent.mkdir(parents=True, exist_ok=True)
+            df_score.to_csv(resultado[0], index=False)
+            top_validos.to_csv(resultado[1], index=False)
+        with self._candado:
+            self._resultados[nodo] = resultado
+        return resultado
+
+
+def nodos_necesarios(objetivos):
+    """Objetivos y todos los nodos de los que dependen, en orden topológico."""
+    orden = []
+
+    def visitar(nodo):
+        if nodo not in orden:
+            for dependencia in NODOS[nodo][1]:
+                visitar(dependencia)
+            orden.append(nodo)
+
+    for objetivo in objetivos:
+        visitar(objetivo)
+    return orden
+
+
+def planificar(corrida, objetivos, forzar=False):
+    """
+    Huella de cada nodo (sus parámetros más las huellas de sus dependencias) y los nodos a ejecutar:
+    los forzados, los que cambiaron de huella y los que ya no tienen su resultado en el disco.
+    """
+    manifiesto = Manifiesto(corrida.salida)
+    huellas, pendientes = {}, []
+    for nodo in nodos_necesarios(objetivos):
+        contenido = {"nodo": nodo, "parametros": corrida.parametros(nodo),
+                     "entradas": [huellas[d] for d in NODOS[nodo][1]]}
+        huellas[nodo] = hashlib.sha1(json.dumps(contenido, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        if forzar or not manifiesto.vigente(nodo, huellas[nodo]) or corrida.leer(nodo) is None:
+            pendientes.append(nodo)
+    return manifiesto, huellas, pendientes
+
+
+def ejecutar_dag(corrida, objetivos, forzar=False, max_trabajadores=2):
+    """
+    Ejecuta los nodos pendientes en cuanto terminan sus dependencias; los nodos sin cambios se
+    saltan y sus resultados se leen del disco al necesitarlos. Devuelve {nodo: estado}.
+    """
+    manifiesto, huellas, pendientes = planificar(corrida, objetivos, forzar)
+    estados = {nodo: "sin cambios" for nodo in huellas if nodo not in pendientes}
+    for nodo in estados:
+        print(f"⏭️ {nodo}: sin cambios")
+
+    def correr(nodo):
+        inicio = time.perf_counter()
+        corrida.ejecutar(nodo)
+        segundos = time.perf_counter() - inicio
+        manifiesto.anotar(nodo, huellas[nodo], segundos)
+        return segundos
+
+    en_curso = {}
+    with ThreadPoolExecutor(max_workers=max_trabajadores) as pool:
+        while pendientes or en_curso:
+            # Se lanzan los nodos cuyas dependencias ya terminaron (o se saltaron)
+            for nodo in [n for n in pendientes if all(estados.get(d) in ("ok", "sin cambios") for d in NODOS[n][1])]:
+                print(f"▶️ {nodo}...")
+                en_curso[pool.submit(correr, nodo)] = nodo
+                pendientes.remove(nodo)
+            # Si falló una dependencia, los nodos que la esperan no se ejecutan
+            for nodo in [n for n in pendientes if any(estados.get(d) in ("error", "omitido") for d in NODOS[n][1])]:
+                estados[nodo] = "omitido"
+                pendientes.remove(nodo)
+                print(f"⚠️ {nodo}: omitido por un error previo")
+            if not en_curso:
+                continue
+            terminados, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in terminados:
+                nodo = en_curso.pop(futuro)
+                try:
+                    print(f"✅ {nodo} ({futuro.result():.1f} s)")
+                    estados[nodo] = "ok"
+                except Exception as error:
+                    print(f"❌ {nodo}: {type(error).__name__}: {error}")
+                    estados[nodo] = "error"
+    return estados
+
+
+def main(argv=None):
+    from data.parametros import aoi_asset_id, years
+
+    comunes = argparse.ArgumentParser(add_help=False)
+    comunes.add_argument("--salida", required=True, help="carpeta de resultados (se reutiliza entre corridas)")
+    comunes.add_argument("--backend", choices=["local", "ee"], default="local")
+    comunes.add_argument("--years", type=leer_years, default=years, help="'2001-2020' o '2001,2005,2010'")
+    comunes.add_argument("--ndvi", nargs="+", help="archivos o patrones MOD13Q1 (backend local)")
+    comunes.add_argument("--precip", nargs="+", help="archivos o patrones CHIRPS (backend local)")
+    comunes.add_argument("--aoi", help="archivo vectorial (local) o asset de EE (por defecto data.parametros)")
+    comunes.add_argument("--proyecto", help="proyecto de Google Cloud para ee.Initialize")
+    comunes.add_argument("--modo-residuos", choices=["global", "pixel"], default="global")
+    comunes.add_argument("--clusters", type=int, default=10)
+    comunes.add_argument("--dimensiones", type=int, default=1024, help="lado del PNG de render (EE)")
+    comunes.add_argument("--exportar", nargs="+", default=[], choices=["residuals", "landtrendr", "cluster"],
+                         help="nodos EE que se exportan con tareas en vez de getInfo/getThumbURL (AOIs grandes)")
+    comunes.add_argument("--bucket", help="bucket de Cloud Storage para --exportar")
+    comunes.add_argument("--docs", help="carpeta con los insumos de select-muni")
+    comunes.add_argument("--forzar", action="store_true", help="ejecuta los nodos aunque sus entradas no cambien")
+    comunes.add_argument("--plan", action="store_true", help="solo muestra qué nodos se ejecutarían")
+
+    parser = argparse.ArgumentParser(description="Flujo de detección de cambios sin Jupyter")
+    subcomandos = parser.add_subparsers(dest="nodo", required=True)
+    ayudas = {
+        "composite": "compuestos anuales NDVI + precipitación (combinar_ndvi_precip)",
+        "residuals": "residuos NDVI ~ precipitación (calcular_residuos)",
+        "landtrendr": "segmentación LandTrendr de los residuos (ejecutar_landtrendr)",
+        "cluster": "k-means de las trayectorias ajustadas (aplicar_clustering)",
+        "render": "PNG del clustering",
+        "select-muni": "puntaje y selección de municipios (procesar_datos_completos)",
+    }
+    for nodo in NODOS:
+        subcomandos.add_parser(nodo, parents=[comunes], help=ayudas[nodo])
+    subcomandos.add_parser("all", parents=[comunes], help="render y select-muni")
+    args = parser.parse_args(argv)
+    objetivos = ["render", "select-muni"] if args.nodo == "all" else [args.nodo]
+
+    if args.backend == "ee":
+        args.aoi = args.aoi or aoi_asset_id
+        if args.exportar and not args.bucket:
+            parser.error("--exportar necesita --bucket")
+    elif args.exportar:
+        parser.error("--exportar solo aplica al backend ee")
+    elif args.nodo != "select-muni" and not (args.ndvi and args.precip):
+        parser.error("el backend local necesita --ndvi y --precip")
+
+    corrida = Corrida(args)
+    if args.plan:
+        _, _, pendientes = planificar(corrida, objetivos, args.forzar)
+        for nodo in nodos_necesarios(objetivos):
+            print(f"{'▶️ ejecutar' if nodo in pendientes else '⏭️ sin cambios'}: {nodo}")
+        return 0
+
+    estados = ejecutar_dag(corrida, objetivos, forzar=args.forzar)
+    return 0 if all(estado in ("ok", "sin cambios") for estado in estados.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
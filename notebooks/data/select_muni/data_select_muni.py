@@ -3,21 +3,23 @@
 # In[1]:
 
 
-import geopandas as gpd      # Para manejar datos espaciales (shapefiles, geometría)
-import pandas as pd          # Para manejar datos tabulares
+# geopandas y pandas se importan dentro de cada función para que el módulo cargue rápido
 
 
 # In[2]:
-def definir_rutas():
+def definir_rutas(raiz=None):
 
     from pathlib import Path 
     """
     Define rutas absolutas a los archivos necesarios.
-    Usa /notebooks/docs si existe, o usa el directorio actual si no.
+    Usa `raiz` si se indica; si no, /notebooks/docs si existe, o el directorio actual.
     Valida existencia de archivos y muestra info útil.
     """
     
-    root = Path("/notebooks/docs") if Path("/notebooks/docs").exists() else Path.cwd()
+    if raiz is not None:
+        root = Path(raiz)
+    else:
+        root = Path("/notebooks/docs") if Path("/notebooks/docs").exists() else Path.cwd()
 
     print(f"📁 Carpeta raíz utilizada: {root.resolve()}")
 
@@ -41,30 +43,171 @@ def definir_rutas():
 # In[3]:
 
 
-def cargar_datos(rutas):
-    print("🔄 Cargando datos...")
+# Versión de la limpieza de las capas: cambiarla invalida lo guardado en la caché
+_VERSION_CAPAS = 1
+
+
+def _directorio_cache_capas():
+    import os
+    from pathlib import Path
+
+    # Misma carpeta base que utils.cache (variable de entorno CAMBIO_COBERTURA_CACHE)
+    base = Path(os.environ.get("CAMBIO_COBERTURA_CACHE", Path.home() / ".cache" / "cambio_cobertura"))
+    return base / "select_muni"
+
+
+def _firma_fuentes(rutas_fuente, anterior=None):
+    """
+    Tamaño, fecha de modificación y SHA-1 de cada archivo de origen (con los complementos de un .shp).
+    El SHA-1 solo se recalcula si el tamaño o la fecha cambiaron respecto de la firma `anterior`.
+    """
+    import hashlib
+    from pathlib import Path
+
+    anterior = anterior or {}
+    firma = {}
+    for ruta in rutas_fuente:
+        ruta = Path(ruta)
+        relacionados = sorted(ruta.parent.glob(ruta.stem + ".*")) if ruta.suffix.lower() == ".shp" else [ruta]
+        for archivo in relacionados:
+            info = archivo.stat()
+            previa = anterior.get(str(archivo), {})
+            if previa.get("tamano") == info.st_size and previa.get("mtime") == info.st_mtime_ns:
+                sha1 = previa["sha1"]
+            else:
+                h = hashlib.sha1()
+                with open(archivo, "rb") as f:
+                    for bloque in iter(lambda: f.read(1 << 20), b""):
+                        h.update(bloque)
+                sha1 = h.hexdigest()
+            firma[str(archivo)] = {"tamano": info.st_size, "mtime": info.st_mtime_ns, "sha1": sha1}
+    return firma
+
+
+def _fuentes_vigentes(ruta_datos, ruta_meta, rutas_fuente):
+    """
+    (vigente, firma, meta): si lo guardado en `ruta_datos` se construyó con la versión actual y con el
+    mismo contenido de las fuentes (aunque cambie su fecha). Si solo cambió la fecha, se anota la nueva
+    firma para no volver a calcular el SHA-1.
+    """
+    import json
+
+    meta = json.loads(ruta_meta.read_text(encoding="utf-8")) if ruta_meta.exists() else {}
+    vigente = meta.get("version") == _VERSION_CAPAS and ruta_datos.exists()
+    firma = _firma_fuentes(rutas_fuente, meta.get("fuentes") if vigente else None)
+    vigente = vigente and {r: f["sha1"] for r, f in firma.items()} == {r: f["sha1"] for r, f in meta["fuentes"].items()}
+    if vigente and firma != meta["fuentes"]:
+        meta["fuentes"] = firma
+        ruta_meta.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    return vigente, firma, meta
+
+
+def _anotar_fuentes(ruta_meta, firma, **extra):
+    import json
+
+    meta = {"version": _VERSION_CAPAS, "fuentes": firma, **extra}
+    ruta_meta.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+
+
+def _capa_en_cache(nombre, rutas_fuente, leer, directorio):
+    """
+    Devuelve la capa limpia `nombre` desde {directorio}/{nombre}.parquet si sus fuentes no cambiaron;
+    si no, la construye con `leer()` y la guarda.
+    """
+    import geopandas as gpd
+    import pandas as pd
+
+    ruta_datos, ruta_meta = directorio / f"{nombre}.parquet", directorio / f"{nombre}.json"
+    vigente, firma, meta = _fuentes_vigentes(ruta_datos, ruta_meta, rutas_fuente)
+    if vigente:
+        return gpd.read_parquet(ruta_datos) if meta["geo"] else pd.read_parquet(ruta_datos)
+
+    capa = leer()
+    directorio.mkdir(parents=True, exist_ok=True)
+    temporal = ruta_datos.with_suffix(".tmp")
+    capa.to_parquet(temporal, index=False)
+    temporal.replace(ruta_datos)
+    _anotar_fuentes(ruta_meta, firma, geo=isinstance(capa, gpd.GeoDataFrame))
+    return capa
 
-    # Usa las rutas pasadas en el diccionario
-    gdf_mun = gpd.read_file(rutas["SHAPE_MUN"]).to_crs(epsg=9377)
 
+def _leer_municipios(ruta):
+    import geopandas as gpd
+
+    gdf_mun = gpd.read_file(ruta).to_crs(epsg=9377)
     codigo_col = "Codigo_Mun" if "Codigo_Mun" in gdf_mun.columns else "MPIO_CCDGO"
     gdf_mun["MPIO_CCDGO"] = gdf_mun[codigo_col].astype(str).str.zfill(5)
+    return gdf_mun[["MPIO_CCDGO", "MPIO_CNMBR", "geometry"]]
+
+
+def _leer_eva(ruta):
+    import pandas as pd
 
-    eva = pd.read_csv(rutas["EVA_CSV"])
+    eva = pd.read_csv(ruta)
     eva.rename(columns=lambda x: x.strip(), inplace=True)
     eva.rename(columns={"CÓD. MUN.": "cod_mun"}, inplace=True)
     eva["cod_mun"] = eva["cod_mun"].astype(str).str.zfill(5)
 
-    df_est = pd.read_csv(rutas["EST_CSV"], sep=";", encoding="latin1")
+    # Solo las columnas que usa el análisis; los cultivos se repiten mucho y van como categoría
+    eva = eva[["cod_mun", "CULTIVO", "AÑO", "Área Sembrada\n(ha)", "Producción\n(t)"]].copy()
+    eva["CULTIVO"] = eva["CULTIVO"].astype("category")
+    for col in ["Área Sembrada\n(ha)", "Producción\n(t)"]:
+        eva[col] = pd.to_numeric(eva[col], errors="coerce")
+    return eva
+
+
+def _leer_estaciones(ruta):
+    import geopandas as gpd
+    import pandas as pd
+
+    df_est = pd.read_csv(ruta, sep=";", encoding="latin1", usecols=["Estado", "Ubicación"])
     df_est = df_est[df_est["Estado"] == "Activa"].copy()
     coords = df_est["Ubicación"].str.strip("()").str.split(",", expand=True).astype(float)
     df_est["lat"], df_est["lon"] = coords[0], coords[1]
 
-    gdf_est = gpd.GeoDataFrame(df_est,
+    return gpd.GeoDataFrame(df_est[["lat", "lon"]],
         geometry=gpd.points_from_xy(df_est["lon"], df_est["lat"]),
         crs="EPSG:4326").to_crs(epsg=9377)
 
-    gdf_runap = gpd.read_file(rutas["RUNAP"]).to_crs(epsg=9377)
+
+def _leer_runap(ruta):
+    import geopandas as gpd
+
+    return gpd.read_file(ruta).to_crs(epsg=9377)[["geometry"]]
+
+
+def cargar_datos(rutas, usar_cache=True, directorio_cache=None):
+    """
+    Carga municipios, EVA, estaciones IDEAM activas y RUNAP ya limpios y en EPSG:9377.
+    Con `usar_cache` cada capa se guarda como (Geo)Parquet en `directorio_cache` y las siguientes
+    cargas la leen de ahí mientras el contenido de sus archivos de origen no cambie.
+    """
+    from pathlib import Path
+
+    print("🔄 Cargando datos...")
+
+    lectores = {
+        "municipios": (rutas["SHAPE_MUN"], _leer_municipios),
+        "eva": (rutas["EVA_CSV"], _leer_eva),
+        "estaciones": (rutas["EST_CSV"], _leer_estaciones),
+        "runap": (rutas["RUNAP"], _leer_runap),
+    }
+
+    if usar_cache:
+        try:
+            import pyarrow  # noqa: F401 (lo usa to_parquet/read_parquet)
+        except ImportError:
+            print("⚠️ pyarrow no está instalado: se leen los archivos de origen sin caché")
+            usar_cache = False
+
+    capas = {}
+    for nombre, (ruta, leer) in lectores.items():
+        if usar_cache:
+            directorio = Path(directorio_cache) if directorio_cache else _directorio_cache_capas()
+            capas[nombre] = _capa_en_cache(nombre, [ruta], lambda: leer(ruta), directorio)
+        else:
+            capas[nombre] = leer(ruta)
+    gdf_mun, eva, gdf_est, gdf_runap = capas["municipios"], capas["eva"], capas["estaciones"], capas["runap"]
 
     print(f"✅ Cargado: {len(gdf_mun):,} municipios • {len(gdf_est):,} estaciones • {len(eva):,} EVA • {len(gdf_runap):,} RUNAP")
     return gdf_mun, eva, gdf_est, gdf_runap
@@ -73,9 +216,176 @@ def cargar_datos(rutas):
 # In[4]:
 
 
+class CuboEVA:
+    """
+    EVA agregada por (cultivo, año, municipio): área sembrada, producción y número de registros
+    válidos (filas con área y producción numéricas). Los cultivos van en mayúsculas y los años son
+    consecutivos, así que cualquier consulta es una indexación del cubo y no un recorrido de la tabla.
+    """
+
+    def __init__(self, cultivos, years, codigos, area, produccion, registros):
+        self.cultivos = cultivos      # (C,) nombres de cultivo en mayúsculas, ordenados
+        self.years = years            # (Y,) años consecutivos
+        self.codigos = codigos        # (M,) MPIO_CCDGO ordenados
+        self.area = area              # (C, Y, M) hectáreas sembradas
+        self.produccion = produccion  # (C, Y, M) toneladas
+        self.registros = registros    # (C, Y, M) filas válidas de la EVA
+
+    def guardar(self, ruta):
+        import numpy as np
+
+        with open(ruta, "wb") as f:
+            np.savez(f, cultivos=self.cultivos, years=self.years, codigos=self.codigos,
+                     area=self.area, produccion=self.produccion, registros=self.registros)
+
+    @classmethod
+    def abrir(cls, ruta):
+        import numpy as np
+
+        with np.load(ruta, allow_pickle=False) as datos:
+            return cls(*(datos[n] for n in ("cultivos", "years", "codigos", "area", "produccion", "registros")))
+
+    def indices_cultivo(self, patron):
+        """Cultivos cuyo nombre contiene `patron` (mismo criterio que str.upper().str.contains)."""
+        import numpy as np
+        import pandas as pd
+
+        return np.flatnonzero(pd.Series(self.cultivos).str.contains(patron.upper(), na=False).to_numpy())
+
+    def indices_year(self, anio=None, estricto=False):
+        """
+        Posiciones de `anio` (un año o una lista) en el eje de años; None o 0 son todos los años.
+        Los años fuera del cubo se ignoran (sin ninguno queda una selección vacía); con
+        estricto=True se lanza ValueError si el cubo está vacío o no tiene ninguno de los años.
+        """
+        import numpy as np
+
+        if len(self.years) == 0:
+            if estricto:
+                raise ValueError("El cubo EVA está vacío: no tiene años")
+            return np.arange(0)
+        if not anio:
+            return np.arange(len(self.years))
+        pedidos = np.atleast_1d(anio)
+        anios = pedidos[(pedidos >= self.years[0]) & (pedidos <= self.years[-1])]
+        if len(anios) == 0 and estricto:
+            raise ValueError(f"Ninguno de los años {pedidos.tolist()} está en el cubo EVA "
+                             f"({self.years[0]}-{self.years[-1]})")
+        return (anios - self.years[0]).astype(int)
+
+    def consultar(self, patron, anio=None, estricto=False):
+        """
+        Área, producción y rendimiento por municipio, como calcular_produccion_avocado. Un año que no
+        está en el cubo da una tabla vacía; con estricto=True lanza ValueError (ver indices_year).
+        """
+        import numpy as np
+        import pandas as pd
+
+        seleccion = np.ix_(self.indices_cultivo(patron), self.indices_year(anio, estricto))
+        area = self.area[seleccion].sum(axis=(0, 1))
+        produccion = self.produccion[seleccion].sum(axis=(0, 1))
+        con_datos = self.registros[seleccion].sum(axis=(0, 1)) > 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rendimiento = produccion / area
+        return pd.DataFrame({
+            "MPIO_CCDGO": self.codigos[con_datos],
+            "area_ha": area[con_datos],
+            "produccion_t": produccion[con_datos],
+            "rendimiento_t_ha": rendimiento[con_datos],
+        })
+
+    def promedio_movil(self, patron, ventana=3, variable="produccion"):
+        """
+        Media de `variable` ('produccion' o 'area') en los últimos `ventana` años, para cada año y
+        municipio: DataFrame (años x MPIO_CCDGO). Los años sin registros cuentan como 0; los primeros
+        ventana - 1 años quedan en NaN.
+        """
+        import numpy as np
+        import pandas as pd
+
+        anual = getattr(self, variable)[self.indices_cultivo(patron)].sum(axis=0)
+        acumulado = np.cumsum(np.vstack([np.zeros((1, anual.shape[1])), anual]), axis=0)
+        media = np.full(anual.shape, np.nan)
+        media[ventana - 1:] = (acumulado[ventana:] - acumulado[:-ventana]) / ventana
+        return pd.DataFrame(media, index=pd.Index(self.years, name="anio"), columns=self.codigos)
+
+    def barrido(self):
+        """Tabla larga de todas las combinaciones (cultivo, año, municipio) con registros."""
+        import numpy as np
+        import pandas as pd
+
+        c, y, m = np.nonzero(self.registros)
+        return pd.DataFrame({
+            "cultivo": self.cultivos[c],
+            "anio": self.years[y],
+            "MPIO_CCDGO": self.codigos[m],
+            "area_ha": self.area[c, y, m],
+            "produccion_t": self.produccion[c, y, m],
+        })
+
+
+def construir_cubo_eva(eva):
+    """Agrega la EVA (de cargar_datos) en un CuboEVA con una sola pasada por la tabla."""
+    import numpy as np
+    import pandas as pd
+
+    area = pd.to_numeric(eva["Área Sembrada\n(ha)"], errors="coerce").to_numpy(float)
+    produccion = pd.to_numeric(eva["Producción\n(t)"], errors="coerce").to_numpy(float)
+    anio = pd.to_numeric(eva["AÑO"], errors="coerce").to_numpy(float)
+    id_cultivo, cultivos = pd.factorize(eva["CULTIVO"].astype(object).str.upper(), sort=True)
+    id_mun, codigos = pd.factorize(eva["cod_mun"].astype(str).str.zfill(5), sort=True)
+    valido = ~np.isnan(area) & ~np.isnan(produccion) & ~np.isnan(anio) & (id_cultivo >= 0)
+
+    anio = anio[valido].astype(int)
+    years = np.arange(anio.min(), anio.max() + 1) if len(anio) else np.zeros(0, dtype=int)
+    forma = (len(cultivos), len(years), len(codigos))
+    plano = np.ravel_multi_index((id_cultivo[valido], anio - (years[0] if len(years) else 0), id_mun[valido]), forma)
+    total = int(np.prod(forma))
+
+    def agregar(pesos=None):
+        return np.bincount(plano, weights=pesos, minlength=total).reshape(forma)
+
+    return CuboEVA(np.asarray(cultivos, dtype=str), years, np.asarray(codigos, dtype=str),
+                   agregar(area[valido]), agregar(produccion[valido]), agregar().astype(np.int32))
+
+
+def cargar_cubo_eva(ruta_eva, eva=None, directorio_cache=None):
+    """
+    CuboEVA guardado junto a las capas de cargar_datos; se reconstruye (desde `eva` si se pasa, o
+    desde la capa EVA) solo cuando cambia el contenido del CSV de origen.
+    """
+    from pathlib import Path
+
+    directorio = Path(directorio_cache) if directorio_cache else _directorio_cache_capas()
+    ruta_cubo, ruta_meta = directorio / "eva_cubo.npz", directorio / "eva_cubo.json"
+    vigente, firma, _ = _fuentes_vigentes(ruta_cubo, ruta_meta, [ruta_eva])
+    if vigente:
+        return CuboEVA.abrir(ruta_cubo)
+
+    if eva is None:
+        eva = _capa_en_cache("eva", [ruta_eva], lambda: _leer_eva(ruta_eva), directorio)
+    cubo = construir_cubo_eva(eva)
+    directorio.mkdir(parents=True, exist_ok=True)
+    temporal = ruta_cubo.with_suffix(".tmp")
+    cubo.guardar(temporal)
+    temporal.replace(ruta_cubo)
+    _anotar_fuentes(ruta_meta, firma)
+    return cubo
+
+
 def calcular_produccion_avocado(eva, anio=2018):
+    import pandas as pd
+
     print("📊 Procesando producción de aguacate...")
 
+    # Con un CuboEVA la consulta es una indexación del cubo
+    if isinstance(eva, CuboEVA):
+        if anio:
+            print(f"📆 Filtrando por año: {anio}")
+        resumen = eva.consultar("AGUACATE", anio)
+        print(f"✅ {len(resumen)} municipios con producción registrada")
+        return resumen
+
     # Filtramos cultivos relacionados con "AGUACATE" sin importar mayúsculas/minúsculas
     df = eva[eva["CULTIVO"].str.upper().str.contains("AGUACATE", na=False)].copy()
 
@@ -112,13 +422,20 @@ def calcular_produccion_avocado(eva, anio=2018):
 
 
 def contar_estaciones_activas(gdf_est, gdf_mun):
+    import numpy as np
+    import pandas as pd
+    import shapely
+
     print("📡 Procesando estaciones IDEAM...")
 
-    # Unimos estaciones con municipios para saber en qué municipio está cada estación
-    join = gpd.sjoin(gdf_est, gdf_mun[["MPIO_CCDGO", "geometry"]], predicate="within", how="inner")
+    # Índice STRtree de municipios: cada estación se prueba solo contra los municipios cuyo rectángulo la contiene
+    arbol = shapely.STRtree(gdf_mun.geometry.values)
+    _, idx_mun = arbol.query(gdf_est.geometry.values, predicate="within")
 
     # Contamos el número de estaciones por municipio
-    conteo = join.groupby("MPIO_CCDGO").size().reset_index(name="num_estaciones")
+    conteo = pd.DataFrame({
+        "MPIO_CCDGO": gdf_mun["MPIO_CCDGO"].values[idx_mun],
+    }).groupby("MPIO_CCDGO").size().reset_index(name="num_estaciones")
 
     print(f"✅ {len(conteo)} municipios con estaciones IDEAM")
     return conteo
@@ -127,19 +444,62 @@ def contar_estaciones_activas(gdf_est, gdf_mun):
 # In[6]:
 
 
+def areas_interseccion(geometrias_a, geometrias_b, bloque=5000, max_trabajadores=None):
+    """
+    Área de la intersección de cada par (a, b) de geometrías que se cruzan, sin armar un GeoDataFrame
+    con las geometrías intersecadas. Devuelve (índices en a, índices en b, áreas).
+
+    Los pares candidatos salen de un STRtree sobre `geometrias_b`. Si a está dentro de b (o b dentro
+    de a) el área es la de la geometría menor y no se calcula la intersección; el resto se interseca
+    en bloques de `bloque` pares repartidos entre hilos (shapely libera el GIL en estas operaciones).
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+
+    import numpy as np
+    import shapely
+
+    # Igual que gpd.overlay: las geometrías inválidas se corrigen antes de intersecar (sobre una copia)
+    geometrias_a, geometrias_b = np.array(geometrias_a, dtype=object), np.array(geometrias_b, dtype=object)
+    for geometrias in (geometrias_a, geometrias_b):
+        invalidas = ~shapely.is_valid(geometrias)
+        geometrias[invalidas] = shapely.make_valid(geometrias[invalidas])
+
+    arbol = shapely.STRtree(geometrias_b)
+    idx_a, idx_b = arbol.query(geometrias_a, predicate="intersects")
+    a, b = geometrias_a[idx_a], geometrias_b[idx_b]
+
+    # Contención: el área de la intersección es directamente la de la geometría contenida
+    shapely.prepare(geometrias_a)
+    shapely.prepare(geometrias_b)
+    dentro_de_b = shapely.contains(b, a)
+    contiene_a_b = ~dentro_de_b & shapely.contains(a, b)
+    areas = np.where(dentro_de_b, shapely.area(a), np.where(contiene_a_b, shapely.area(b), np.nan))
+
+    # Solo los pares que cruzan un borde necesitan la intersección
+    cruzan = np.flatnonzero(np.isnan(areas))
+
+    def areas_bloque(posiciones):
+        return shapely.area(shapely.intersection(a[posiciones], b[posiciones]))
+
+    bloques = [cruzan[i:i + bloque] for i in range(0, len(cruzan), bloque)]
+    max_trabajadores = max_trabajadores or min(len(bloques), os.cpu_count() or 1) or 1
+    with ThreadPoolExecutor(max_workers=max_trabajadores) as pool:
+        for posiciones, valores in zip(bloques, pool.map(areas_bloque, bloques)):
+            areas[posiciones] = valores
+    return idx_a, idx_b, areas
+
+
 def evaluar_superposicion_runap(gdf_runap, gdf_mun):
+    import pandas as pd
+
     print("🌱 Procesando áreas RUNAP...")
 
-    # Intersecamos polígonos de RUNAP con municipios para ver qué tanto se superponen
-    inter = gpd.overlay(
-        gdf_runap,
-        gdf_mun[["MPIO_CCDGO", "geometry"]],
-        how="intersection",
-        keep_geom_type=False  # Permitimos geometrías mixtas para no perder información
-    )
+    # Área de cada par (RUNAP, municipio) que se superpone, sin construir las geometrías del overlay
+    _, idx_mun, areas = areas_interseccion(gdf_runap.geometry.values, gdf_mun.geometry.values)
 
     # Calculamos área protegida en m² por municipio
-    inter["area_runap_m2"] = inter.area
+    inter = pd.DataFrame({"MPIO_CCDGO": gdf_mun["MPIO_CCDGO"].values[idx_mun], "area_runap_m2": areas})
     resumen = inter.groupby("MPIO_CCDGO")["area_runap_m2"].sum().reset_index()
 
     print(f"✅ {len(resumen)} municipios con presencia RUNAP")
@@ -149,7 +509,7 @@ def evaluar_superposicion_runap(gdf_runap, gdf_mun):
 # In[7]:
 
 
-def calcular_score_final(gdf_mun, df_prod, df_est, df_runap):
+def calcular_score_final(gdf_mun, df_prod, df_est, df_runap, pesos=(0.8, 0.15, 0.05)):
     print("🧮 Calculando SCORE final...")
 
     # Partimos del listado de municipios únicos
@@ -170,11 +530,11 @@ def calcular_score_final(gdf_mun, df_prod, df_est, df_runap):
         max_val = merged[col].max()
         merged[f"norm_{col}"] = merged[col] / max_val if max_val else 0
 
-    # Calculamos un puntaje compuesto con pesos: 80% producción, 15% estaciones, 5% áreas protegidas
+    # Calculamos un puntaje compuesto con pesos: por defecto 80% producción, 15% estaciones, 5% áreas protegidas
     merged["SCORE"] = (
-        0.8 * merged["norm_produccion_t"] +
-        0.15 * merged["norm_num_estaciones"] +
-        0.05 * merged["norm_area_runap_m2"]
+        pesos[0] * merged["norm_produccion_t"] +
+        pesos[1] * merged["norm_num_estaciones"] +
+        pesos[2] * merged["norm_area_runap_m2"]
     )
 
     print("✅ SCORE calculado")
@@ -184,12 +544,143 @@ def calcular_score_final(gdf_mun, df_prod, df_est, df_runap):
 # In[8]:
 
 
+# Variables del puntaje, en el orden de las columnas de la matriz y de los vectores de pesos
+VARIABLES_SCORE = ["produccion_t", "num_estaciones", "area_runap_m2"]
+
+
+class MatrizEscenarios:
+    """
+    Variables normalizadas (0 a 1) de cada municipio para cada combinación (cultivo, año):
+    `variables` tiene forma (combinaciones, municipios, 3) en el orden de VARIABLES_SCORE.
+    Las estaciones y el RUNAP no dependen de la combinación; solo cambia la producción.
+    """
+
+    def __init__(self, municipios, combinaciones, variables):
+        self.municipios = municipios        # MPIO_CCDGO y MPIO_CNMBR, ordenados por código
+        self.combinaciones = combinaciones  # cultivo y anio de cada combinación
+        self.variables = variables
+
+
+def preparar_escenarios(gdf_mun, eva, df_est, df_runap, cultivos=("AGUACATE",), years=(2018,)):
+    """
+    Calcula una sola vez las variables normalizadas de calcular_score_final para todas las
+    combinaciones de `cultivos` (texto buscado en CULTIVO, como en calcular_produccion_avocado)
+    y `years` (None, o un None dentro de la lista, suma todos los años). `eva` es la tabla de cargar_datos o un CuboEVA;
+    `df_est` y `df_runap` salen de contar_estaciones_activas y evaluar_superposicion_runap.
+    """
+    import numpy as np
+    import pandas as pd
+
+    municipios = (gdf_mun[["MPIO_CCDGO", "MPIO_CNMBR"]].drop_duplicates()
+                  .sort_values("MPIO_CCDGO", kind="stable").reset_index(drop=True))
+    codigos, fila_a_codigo = np.unique(municipios["MPIO_CCDGO"].to_numpy(str), return_inverse=True)
+
+    def normalizar(valores):
+        maximo = valores.max(axis=-1, keepdims=True)
+        return np.divide(valores, maximo, out=np.zeros_like(valores), where=maximo > 0)
+
+    def por_municipio(df, col):
+        return municipios["MPIO_CCDGO"].map(df.set_index("MPIO_CCDGO")[col]).fillna(0).to_numpy(float)
+
+    # Producción de cada combinación: una indexación del CuboEVA por cultivo y año
+    cubo = eva if isinstance(eva, CuboEVA) else construir_cubo_eva(eva)
+    posicion = np.searchsorted(cubo.codigos, codigos).clip(max=max(len(cubo.codigos) - 1, 0))
+    en_eva = cubo.codigos[posicion] == codigos if len(cubo.codigos) else np.zeros(len(codigos), bool)
+
+    years = (None,) if years is None else years
+    combinaciones = pd.DataFrame({"cultivo": [c for c in cultivos for _ in years],
+                                  "anio": pd.array([y for _ in cultivos for y in years], dtype="Int64")})
+    produccion = np.zeros((len(combinaciones), len(codigos)))
+    for i, (cultivo, year) in enumerate(combinaciones.itertuples(index=False)):
+        year = None if pd.isna(year) else int(year)  # <NA>: todos los años
+        total = cubo.produccion[np.ix_(cubo.indices_cultivo(cultivo), cubo.indices_year(year))].sum(axis=(0, 1))
+        produccion[i, en_eva] = total[posicion[en_eva]]
+
+    variables = np.empty((len(combinaciones), len(municipios), 3))
+    variables[..., 0] = normalizar(produccion[:, fila_a_codigo])
+    variables[..., 1] = normalizar(por_municipio(df_est, "num_estaciones"))
+    variables[..., 2] = normalizar(por_municipio(df_runap, "area_runap_m2"))
+    return MatrizEscenarios(municipios, combinaciones, variables)
+
+
+def _top_estable(puntajes, k):
+    """
+    Índices de los k mayores puntajes del último eje, de mayor a menor. Los empates se resuelven
+    por índice (código de municipio) también en el corte, así que el resultado no depende del orden
+    interno de np.partition.
+    """
+    import numpy as np
+
+    n = puntajes.shape[-1]
+    corte = np.partition(puntajes, n - k, axis=-1)[..., n - k:n - k + 1]  # k-ésimo mayor de cada fila
+    elegidos = puntajes >= corte
+    # Si hay empates en el corte sobran elegidos: entre los empatados se quedan los de menor índice
+    sobran = elegidos.sum(axis=-1) > k
+    if sobran.any():
+        filas, corte_filas = puntajes[sobran], corte[sobran]
+        mayores, empates = filas > corte_filas, filas == corte_filas
+        faltan = k - mayores.sum(axis=-1, keepdims=True)
+        elegidos[sobran] = mayores | (empates & (np.cumsum(empates, axis=-1) <= faltan))
+    # Cada fila tiene exactamente k elegidos; nonzero los devuelve por fila y en orden de índice
+    indices = np.nonzero(elegidos)[-1].reshape(puntajes.shape[:-1] + (k,))
+    orden = np.argsort(-np.take_along_axis(puntajes, indices, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(indices, orden, axis=-1)
+
+
+def puntuar_escenarios(matriz, pesos, top=10, bloque=256, max_trabajadores=None):
+    """
+    Puntúa todas las combinaciones de `matriz` (preparar_escenarios) con cada vector de `pesos`
+    (escenarios x 3, en el orden de VARIABLES_SCORE) como un producto de matrices, por bloques de
+    escenarios repartidos entre hilos. Devuelve una tabla larga con los `top` municipios de cada
+    (escenario, cultivo, anio); los empates se ordenan por MPIO_CCDGO.
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+
+    import numpy as np
+    import pandas as pd
+
+    pesos = np.atleast_2d(np.asarray(pesos, dtype=float))
+    num_combinaciones, num_municipios, _ = matriz.variables.shape
+    k = min(top, num_municipios)
+
+    def puntuar_bloque(inicio):
+        w = pesos[inicio:inicio + bloque]
+        puntajes = w @ matriz.variables.transpose(0, 2, 1)  # (combinaciones, escenarios, municipios)
+        indices = _top_estable(puntajes, k)
+        return inicio, indices, np.take_along_axis(puntajes, indices, axis=-1)
+
+    inicios = range(0, len(pesos), bloque)
+    max_trabajadores = max_trabajadores or min(len(inicios), os.cpu_count() or 1) or 1
+    partes = []
+    with ThreadPoolExecutor(max_workers=max_trabajadores) as pool:
+        for inicio, indices, valores in pool.map(puntuar_bloque, inicios):
+            c, e, p = np.meshgrid(np.arange(num_combinaciones), np.arange(indices.shape[1]), np.arange(k), indexing="ij")
+            escenario = inicio + e.ravel()
+            partes.append(pd.DataFrame({
+                "escenario": escenario,
+                "cultivo": matriz.combinaciones["cultivo"].to_numpy()[c.ravel()],
+                "anio": matriz.combinaciones["anio"].array[c.ravel()],
+                **{f"peso_{v}": pesos[escenario, j] for j, v in enumerate(VARIABLES_SCORE)},
+                "puesto": p.ravel() + 1,
+                "MPIO_CCDGO": matriz.municipios["MPIO_CCDGO"].to_numpy()[indices.ravel()],
+                "MPIO_CNMBR": matriz.municipios["MPIO_CNMBR"].to_numpy()[indices.ravel()],
+                "SCORE": valores.ravel(),
+            }))
+
+    resultado = pd.concat(partes, ignore_index=True)
+    return resultado.sort_values(["escenario", "cultivo", "anio", "puesto"], kind="stable").reset_index(drop=True)
+
+
+# In[9]:
+
+
 # --- FUNCIONES DE EJECUCIÓN ---
-def procesar_datos_completos():
-    rutas = definir_rutas()
+def procesar_datos_completos(raiz=None):
+    rutas = definir_rutas(raiz)
     gdf_mun, eva, gdf_est, gdf_runap = cargar_datos(rutas)
     
-    df_prod = calcular_produccion_avocado(eva)
+    df_prod = calcular_produccion_avocado(cargar_cubo_eva(rutas["EVA_CSV"], eva))
     df_est = contar_estaciones_activas(gdf_est, gdf_mun)
     df_runap = evaluar_superposicion_runap(gdf_runap, gdf_mun)
     df_score = calcular_score_final(gdf_mun, df_prod, df_est, df_runap)
@@ -0,0 +1,51 @@
+# --- Paquete utils: las funciones se importan bajo demanda ---
+# `from utils import calcular_residuos` solo carga utils.processing; ee, matplotlib, PIL,
+# requests y geopandas se importan dentro de las funciones que los usan, de modo que las
+# etapas locales (NumPy) arrancan sin cargar esas dependencias.
+import importlib
+
+_EXPORTES = {
+    "batch": ("ETAPAS", "BackendEE", "BackendLocal", "BackendSimulado", "Limitador",
+              "aois_desde_municipios", "ejecutar_lote", "huella_aoi", "huella_archivos"),
+    "cache": ("configurar_cache", "obtener_cache", "info_en_cache",
+              "configurar_cache_miniaturas", "obtener_cache_miniaturas"),
+    "clustering": ("sample_training_data", "entrenar_kmeans", "aplicar_clustering"),
+    "display": ("mostrar_imagen_ee", "mostrar_paneles_ee", "mostrar_landtrendr_fitted",
+                "mostrar_clustering", "guardar_clustering", "obtener_rango_fitted", "reductor_rango"),
+    "dtw": ("ModeloFormas", "entrenar_formas_local", "aplicar_formas_local"),
+    "export": ("ServicioTareasEE", "ServicioSimulado", "esperar_tareas", "exportar_imagen",
+               "info_por_exportacion", "ensamblar_teselas"),
+    "helpers": ("listar_bandas", "PlanRemuestreo", "reproyectar_imagenes"),
+    "incremental": ("iniciar_incremental", "agregar_year_incremental"),
+    "ingest": ("annual_max_ndvi_local", "annual_precip_local", "combinar_ndvi_precip_local",
+               "combinar_year_local", "mascara_aoi", "rejilla_referencia"),
+    "kmeans": ("KMeansLocal", "entrenar_kmeans_local", "aplicar_clustering_local"),
+    "landtrendr": ("segmentar_landtrendr",),
+    "local": ("ImagenLocal", "ArregloLocal", "ColeccionLocal"),
+    "processing": ("annual_precip", "annual_max_ndvi", "combinar_ndvi_precip", "coleccion_ndvi_precip",
+                   "ejecutar_landtrendr",
+                   "extraer_fitted_stack", "calcular_residuos", "calcular_residuos_local",
+                   "ajustar_ndvi_precip"),
+    "profiler": ("perfilar", "instrumentar"),
+    "regression": ("ajustar_por_pixel",),
+    "sampling": ("estratos_cobertura", "estratos_residuo", "muestreo_reservorio"),
+    "store": ("AlmacenCubos",),
+    "tiling": ("dividir_en_teselas", "ejecutar_por_teselas"),
+}
+_MODULO_DE = {nombre: modulo for modulo, nombres in _EXPORTES.items() for nombre in nombres}
+
+__all__ = sorted(_MODULO_DE)
+
+
+def __getattr__(nombre):
+    # PEP 562: el submódulo se importa la primera vez que se pide uno de sus nombres
+    modulo = _MODULO_DE.get(nombre)
+    if modulo is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
+    valor = getattr(importlib.import_module(f"{__name__}.{modulo}"), nombre)
+    globals()[nombre] = valor
+    return valor
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
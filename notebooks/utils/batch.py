@@ -0,0 +1,385 @@
+# --- Ejecución por lotes del flujo completo sobre muchas AOIs ---
+import hashlib
+import json
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+# Etapas del flujo en orden; cada una recibe el resultado de la anterior
+ETAPAS = ("composites", "residuos", "landtrendr", "clustering")
+
+
+class Limitador:
+    """
+    Limita las etapas remotas en curso (`max_concurrentes`) y el ritmo al que empiezan
+    (`min_intervalo` segundos entre dos inicios), para no superar las cuotas de Earth Engine.
+    """
+
+    def __init__(self, max_concurrentes=2, min_intervalo=0.0):
+        self._semaforo = threading.BoundedSemaphore(max_concurrentes)
+        self._candado = threading.Lock()
+        self._ultimo_inicio = 0.0
+        self.min_intervalo = min_intervalo
+
+    def __enter__(self):
+        self._semaforo.acquire()
+        with self._candado:
+            espera = self._ultimo_inicio + self.min_intervalo - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            self._ultimo_inicio = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self._semaforo.release()
+        return False
+
+
+class BackendEE:
+    """
+    Etapas con Earth Engine. Los puntos de control son los grafos de expresión serializados: al
+    reanudar, los residuos se recuperan con los coeficientes ya calculados, sin repetir el getInfo.
+    Con `remuestreo` (PlanRemuestreo) la rejilla de destino se fija al reducir y sobre el resultado
+    de LandTrendr, y la lluvia se interpola desde la rejilla nativa de CHIRPS.
+
+    `exportar` elige las etapas ('residuos', 'landtrendr', 'clustering') cuyo resultado se exporta con
+    tareas de `servicio` (utils.export) y se ensambla en el AlmacenCubos de la AOI con los mismos
+    productos que BackendLocal; en 'residuos' la tabla de medias también sale por Export.table en vez
+    de getInfo. `sondeo` son los parámetros de espera de utils.export.esperar_tareas.
+    """
+
+    remoto = True
+    EXPORTABLES = ("residuos", "landtrendr", "clustering")
+
+    def __init__(self, years, num_clusters=10, modo_residuos="global", remuestreo=None, exportar=(),
+                 servicio=None, sondeo=None):
+        self.years = list(years)
+        self.num_clusters = num_clusters
+        self.modo_residuos = modo_residuos
+        self.remuestreo = remuestreo
+        self.exportar = set(exportar)
+        desconocidas = self.exportar - set(self.EXPORTABLES)
+        if desconocidas:
+            raise ValueError(f"Etapas no exportables: {sorted(desconocidas)}; use {self.EXPORTABLES}.")
+        if self.exportar and servicio is None:
+            raise ValueError("El modo exportación necesita un `servicio` de tareas (utils.export).")
+        self.servicio = servicio
+        self.sondeo = dict(sondeo or {})
+
+    def parametros(self):
+        """Ajustes que cambian los resultados; entran en la huella de los puntos de control."""
+        remuestreo = None
+        if self.remuestreo is not None:
+            remuestreo = [self.remuestreo.proyeccion.serialize(), self.remuestreo.metodo, self.remuestreo.escala]
+        return {"years": self.years, "num_clusters": self.num_clusters, "modo_residuos": self.modo_residuos,
+                "remuestreo": remuestreo, "exportar": sorted(self.exportar)}
+
+    def preparar(self, clave, geometria):
+        import ee
+
+        if isinstance(geometria, (ee.FeatureCollection, ee.Feature, ee.Geometry)):
+            return ee.FeatureCollection(geometria)
+        # Geometría shapely (EPSG:4326), p. ej. de aois_desde_municipios
+        return ee.FeatureCollection([ee.Feature(ee.Geometry(geometria.__geo_interface__), {'aoi': str(clave)})])
+
+    def ejecutar_etapa(self, etapa, aoi, previo, carpeta):
+        from utils.clustering import aplicar_clustering, entrenar_kmeans, sample_training_data
+        from utils.processing import calcular_residuos, coleccion_ndvi_precip, ejecutar_landtrendr, extraer_fitted_stack
+
+        if etapa == "composites":
+            resultado = coleccion_ndvi_precip(self.years, aoi, remuestreo=self.remuestreo)
+        elif etapa == "residuos":
+            obtener_info = None
+            if "residuos" in self.exportar:
+                from utils.export import info_por_exportacion
+                from utils.store import AlmacenCubos
+
+                obtener_info = partial(info_por_exportacion, self.servicio, almacen=AlmacenCubos(carpeta),
+                                       nombre="medias", **self.sondeo)
+            resultado = calcular_residuos(previo, aoi, modo=self.modo_residuos, remuestreo=self.remuestreo,
+                                          obtener_info=obtener_info)
+        elif etapa == "landtrendr":
+            lt = ejecutar_landtrendr(previo.select('residual'), remuestreo=self.remuestreo)
+            resultado = extraer_fitted_stack(lt, self.years[0], len(self.years))
+        else:
+            modelo = entrenar_kmeans(sample_training_data(previo, aoi), num_clusters=self.num_clusters)
+            resultado = aplicar_clustering(previo, modelo, num_clusters=self.num_clusters)
+
+        carpeta.mkdir(parents=True, exist_ok=True)
+        (carpeta / f"{etapa}.json").write_text(resultado.serialize(), encoding="utf-8")
+        if etapa in self.exportar:
+            self._exportar(etapa, resultado, aoi, carpeta)
+        return resultado
+
+    def _exportar(self, etapa, resultado, aoi, carpeta):
+        """Exporta el resultado de la etapa y lo ensambla en el almacén como el producto de BackendLocal."""
+        from utils.export import exportar_imagen
+        from utils.store import AlmacenCubos
+
+        if etapa == "residuos":
+            imagen, bandas, years = resultado.select('residual').toBands(), ['residual'], self.years
+        elif etapa == "landtrendr":
+            imagen, bandas, years = resultado, [f'fittedResidual_{year}' for year in self.years], None
+        else:
+            imagen, bandas, years = resultado, ['cluster'], None
+        return exportar_imagen(self.servicio, imagen, aoi.geometry(), AlmacenCubos(carpeta),
+                               BackendLocal._PRODUCTOS[etapa], bandas, years=years, **self.sondeo)
+
+    def cargar_etapa(self, etapa, carpeta):
+        import ee
+
+        ruta = carpeta / f"{etapa}.json"
+        if not ruta.exists():
+            return None
+        return ee.deserializer.fromJSON(ruta.read_text(encoding="utf-8"))
+
+
+class BackendLocal:
+    """
+    Etapas locales (NumPy) a partir de archivos MOD13Q1/CHIRPS. Cada AOI tiene su AlmacenCubos
+    y los puntos de control son sus productos: 'coleccion', 'residuos', 'fitted' y 'clusters'.
+    """
+
+    remoto = False
+    _PRODUCTOS = {"composites": "coleccion", "residuos": "residuos", "landtrendr": "fitted", "clustering": "clusters"}
+
+    def __init__(self, archivos_ndvi, archivos_precip, years, num_clusters=10, modo_residuos="global"):
+        self.archivos_ndvi = archivos_ndvi
+        self.archivos_precip = archivos_precip
+        self.years = list(years)
+        self.num_clusters = num_clusters
+        self.modo_residuos = modo_residuos
+
+    def parametros(self):
+        """Ajustes que cambian los resultados; entran en la huella de los puntos de control."""
+        # Tamaño y fecha de modificación: reemplazar un archivo en su sitio invalida los puntos de control
+        return {"ndvi": huella_archivos(self.archivos_ndvi or []),
+                "precip": huella_archivos(self.archivos_precip or []),
+                "years": self.years, "num_clusters": self.num_clusters, "modo_residuos": self.modo_residuos}
+
+    def preparar(self, clave, geometria):
+        import geopandas as gpd
+
+        if isinstance(geometria, (gpd.GeoDataFrame, gpd.GeoSeries)):
+            return geometria
+        return gpd.GeoSeries([geometria], crs="EPSG:4326")
+
+    def _composites(self, aoi, almacen):
+        from utils.ingest import combinar_ndvi_precip_local
+
+        return combinar_ndvi_precip_local(self.archivos_ndvi, self.archivos_precip, self.years, aoi=aoi,
+                                          almacen=almacen, nombre="coleccion")
+
+    def ejecutar_etapa(self, etapa, aoi, previo, carpeta):
+        from utils.clustering import aplicar_clustering, entrenar_kmeans, sample_training_data
+        from utils.processing import calcular_residuos_local, ejecutar_landtrendr, extraer_fitted_stack
+        from utils.store import AlmacenCubos
+
+        almacen = AlmacenCubos(carpeta)
+        if etapa == "composites":
+            return self._composites(aoi, almacen)
+        if etapa == "residuos":
+            # Dentro del AOI hay dato en algún año; fuera todo es NaN desde la ingesta
+            mascara = ~np.isnan(previo.banda('greenness')).all(axis=0)
+            return calcular_residuos_local(previo, mascara, modo=self.modo_residuos, almacen=almacen, nombre="residuos")
+        if etapa == "landtrendr":
+            lt = ejecutar_landtrendr(previo.select('residual'))
+            return extraer_fitted_stack(lt, previo.years[0], len(previo.years), almacen=almacen, nombre="fitted")
+        modelo = entrenar_kmeans(sample_training_data(previo, None), num_clusters=self.num_clusters)
+        return almacen.guardar("clusters", aplicar_clustering(previo, modelo, num_clusters=self.num_clusters))
+
+    def cargar_etapa(self, etapa, carpeta):
+        from utils.store import AlmacenCubos
+
+        if not carpeta.exists():
+            return None
+        almacen = AlmacenCubos(carpeta)
+        nombre = self._PRODUCTOS[etapa]
+        return almacen.abrir(nombre) if almacen.existe(nombre) else None
+
+
+class BackendSimulado(BackendLocal):
+    """
+    Backend falso para pruebas: cubos NDVI/precipitación sintéticos (deterministas por AOI) que
+    pasan por las mismas etapas locales. `latencia` simula el tiempo de respuesta remoto de cada
+    etapa y `fallos` ({(clave, etapa): n}) hace fallar n veces una etapa para probar los reintentos.
+    """
+
+    remoto = True
+
+    def __init__(self, years, forma=(64, 64), num_clusters=4, latencia=0.0, fallos=None):
+        super().__init__(None, None, years, num_clusters=num_clusters)
+        self.forma = tuple(forma)
+        self.latencia = latencia
+        self.fallos = dict(fallos or {})
+        self._candado = threading.Lock()
+
+    def parametros(self):
+        return dict(super().parametros(), forma=list(self.forma))
+
+    def preparar(self, clave, geometria):
+        return str(clave)
+
+    def _composites(self, aoi, almacen):
+        from utils.local import ColeccionLocal
+
+        rng = np.random.default_rng(zlib.crc32(aoi.encode("utf-8")))
+        forma = (len(self.years),) + self.forma
+        precip = rng.uniform(800, 2000, forma)
+        ndvi = 0.3 + 0.0002 * precip + rng.normal(0, 0.02, forma)
+        # Una perturbación a mitad del periodo en parte del AOI
+        ndvi[len(self.years) // 2:, :self.forma[0] // 3] -= 0.2
+        datos = np.stack([ndvi, precip], axis=1).astype(np.float32)
+        return almacen.guardar("coleccion", ColeccionLocal(datos, self.years, ['greenness', 'precip']))
+
+    def ejecutar_etapa(self, etapa, aoi, previo, carpeta):
+        time.sleep(self.latencia)
+        with self._candado:
+            pendientes = self.fallos.get((aoi, etapa), 0)
+            if pendientes:
+                self.fallos[(aoi, etapa)] = pendientes - 1
+                raise RuntimeError(f"Fallo simulado en {etapa} para {aoi}")
+        return super().ejecutar_etapa(etapa, aoi, previo, carpeta)
+
+
+def aois_desde_municipios(gdf_mun, codigos=None, top=None):
+    """
+    Geometrías (EPSG:4326) de los municipios a procesar, por MPIO_CCDGO. `gdf_mun` es p. ej. el
+    df_score de procesar_datos_completos; sin `codigos` se toman los `top` de mayor SCORE.
+    """
+    if codigos is not None:
+        codigos = [str(c).zfill(5) for c in codigos]
+        faltantes = sorted(set(codigos) - set(gdf_mun["MPIO_CCDGO"]))
+        if faltantes:
+            raise ValueError(f"Códigos MPIO_CCDGO que no están en los municipios: {faltantes}")
+        gdf_mun = gdf_mun[gdf_mun["MPIO_CCDGO"].isin(codigos)]
+    elif top is not None:
+        gdf_mun = gdf_mun.sort_values("SCORE", ascending=False).head(top)
+    gdf_mun = gdf_mun.to_crs(epsg=4326)
+    return dict(zip(gdf_mun["MPIO_CCDGO"], gdf_mun.geometry))
+
+
+def huella_archivos(rutas):
+    """Ruta, tamaño y fecha de modificación de cada archivo (y de los complementos de un .shp)."""
+    estado = []
+    for ruta in rutas:
+        ruta = Path(ruta)
+        relacionados = sorted(ruta.parent.glob(ruta.stem + ".*")) if ruta.suffix.lower() == ".shp" else [ruta]
+        for archivo in relacionados:
+            info = archivo.stat() if archivo.exists() else None
+            estado.append([str(archivo.resolve()), info and info.st_size, info and info.st_mtime_ns])
+    return estado
+
+
+def huella_aoi(geometria, backend):
+    """
+    Resumen de la geometría (WKB, o el grafo serializado de un objeto EE) y de los parámetros del
+    backend. Si cambia, los puntos de control de la carpeta de la AOI ya no sirven.
+    """
+    if hasattr(geometria, "serialize"):
+        datos = geometria.serialize().encode("utf-8")
+    elif hasattr(geometria, "crs") and hasattr(geometria, "geometry"):
+        # GeoDataFrame / GeoSeries
+        datos = str(geometria.crs).encode("utf-8") + b"".join(g.wkb for g in geometria.geometry)
+    elif hasattr(geometria, "wkb"):
+        datos = geometria.wkb
+    else:
+        datos = str(geometria).encode("utf-8")
+    parametros = json.dumps({"backend": type(backend).__name__, **backend.parametros()}, sort_keys=True, default=str)
+    return hashlib.sha1(datos + parametros.encode("utf-8")).hexdigest()
+
+
+def _procesar_aoi(clave, geometria, backend, carpeta, limitador, reintentos, espera):
+    """Ejecuta las etapas pendientes de una AOI; las que ya tienen punto de control se reutilizan."""
+    estado = {"aoi": str(clave), "ejecutadas": [], "reanudadas": [], "intentos": 0, "error": None}
+    inicio = time.perf_counter()
+    # Solo cuentan como terminadas las etapas anotadas después de guardarse por completo, y solo si
+    # fueron calculadas con la misma geometría y los mismos parámetros (años, backend, ...)
+    ruta_terminadas = carpeta / "terminadas.json"
+    huella = huella_aoi(geometria, backend)
+    anotadas = json.loads(ruta_terminadas.read_text(encoding="utf-8")) if ruta_terminadas.exists() else {}
+    terminadas = anotadas["etapas"] if isinstance(anotadas, dict) and anotadas.get("huella") == huella else []
+    if ruta_terminadas.exists() and not terminadas:
+        print(f"♻️ {clave}: la geometría o los parámetros cambiaron; se recalculan sus etapas")
+    try:
+        aoi = backend.preparar(clave, geometria)
+        previo = None
+        for etapa in ETAPAS:
+            guardado = backend.cargar_etapa(etapa, carpeta) if etapa in terminadas else None
+            if guardado is not None:
+                previo = guardado
+                estado["reanudadas"].append(etapa)
+                continue
+
+            for intento in range(reintentos + 1):
+                estado["intentos"] += 1
+                try:
+                    if limitador is not None and backend.remoto:
+                        with limitador:
+                            previo = backend.ejecutar_etapa(etapa, aoi, previo, carpeta)
+                    else:
+                        previo = backend.ejecutar_etapa(etapa, aoi, previo, carpeta)
+                    break
+                except Exception:
+                    if intento == reintentos:
+                        raise
+                    time.sleep(espera * 2 ** intento)  # Espera exponencial entre reintentos
+            estado["ejecutadas"].append(etapa)
+            terminadas.append(etapa)
+            ruta_terminadas.write_text(json.dumps({"huella": huella, "etapas": terminadas}), encoding="utf-8")
+        estado["estado"] = "ok"
+    except Exception as error:
+        estado["estado"] = "error"
+        estado["error"] = f"{type(error).__name__}: {error}"
+
+    estado["segundos"] = round(time.perf_counter() - inicio, 3)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    (carpeta / "estado.json").write_text(json.dumps(estado, ensure_ascii=False, indent=2), encoding="utf-8")
+    return estado
+
+
+def ejecutar_lote(aois, backend, directorio, municipios=None, max_trabajadores=4, max_remotas=2,
+                  min_intervalo=0.0, reintentos=2, espera=1.0):
+    """
+    Ejecuta composites -> residuos -> LandTrendr -> clustering para cada AOI con un pool acotado de hilos.
+
+    `aois` puede ser un diccionario {clave: geometría}, una lista de geometrías o una lista de códigos
+    MPIO_CCDGO (que se buscan en `municipios`, p. ej. el df_score de procesar_datos_completos).
+    Cada AOI guarda sus puntos de control en `directorio/<clave>`; si el lote se interrumpe o una
+    AOI falla, volver a llamar a ejecutar_lote retoma desde la última etapa terminada, siempre que la
+    geometría y los parámetros del backend sean los mismos (huella_aoi); si no, la AOI se recalcula. Las etapas
+    remotas pasan por un Limitador compartido (`max_remotas`, `min_intervalo`) y se reintentan con
+    espera exponencial.
+
+    Devuelve un DataFrame con el estado de cada AOI.
+    """
+    import pandas as pd
+
+    if not isinstance(aois, dict):
+        aois = list(aois)
+        if aois and isinstance(aois[0], (str, int, np.integer)):
+            if municipios is None:
+                raise ValueError("Para procesar códigos MPIO_CCDGO hay que indicar `municipios`.")
+            aois = aois_desde_municipios(municipios, codigos=aois)
+        else:
+            aois = {f"aoi_{i:03d}": geometria for i, geometria in enumerate(aois)}
+
+    directorio = Path(directorio)
+    limitador = Limitador(max_remotas, min_intervalo)
+    resultados = []
+    with ThreadPoolExecutor(max_workers=max_trabajadores) as pool:
+        futuros = [pool.submit(_procesar_aoi, clave, geometria, backend, directorio / str(clave),
+                               limitador, reintentos, espera)
+                   for clave, geometria in aois.items()]
+        for futuro in as_completed(futuros):
+            estado = futuro.result()
+            icono = "✅" if estado["estado"] == "ok" else "⚠️"
+            print(f"{icono} {estado['aoi']}: {estado['estado']} ({estado['segundos']} s)")
+            resultados.append(estado)
+
+    return pd.DataFrame(resultados).sort_values("aoi").reset_index(drop=True)
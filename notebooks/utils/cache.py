@@ -0,0 +1,188 @@
+# --- Caché en disco para resultados de Earth Engine ---
+import hashlib
+import json
+import os
+import struct
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from utils.profiler import contar, instrumentar, sumar_bytes
+
+# Carpeta por defecto; se puede cambiar con la variable de entorno CAMBIO_COBERTURA_CACHE
+DIRECTORIO_CACHE = Path(os.environ.get("CAMBIO_COBERTURA_CACHE", Path.home() / ".cache" / "cambio_cobertura"))
+
+_CABECERA = struct.Struct("<d")  # Marca de tiempo de creación al inicio de cada archivo
+
+
+class CacheDisco:
+    """
+    Caché en disco direccionada por contenido: cada entrada es un archivo con el hash de su clave.
+    La fecha de modificación del archivo marca el último uso; al superar `max_bytes` se eliminan
+    las entradas usadas hace más tiempo (LRU) y las de más de `ttl` segundos se consideran vencidas.
+    """
+
+    def __init__(self, directorio, max_bytes=512 * 1024 ** 2, ttl=30 * 24 * 3600):
+        self.directorio = Path(directorio)
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    @staticmethod
+    def clave(*partes):
+        """Hash SHA-256 de las partes de la clave serializadas como JSON."""
+        texto = json.dumps(partes, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+    def _ruta(self, clave):
+        return self.directorio / clave[:2] / f"{clave}.bin"
+
+    def leer(self, clave):
+        """Devuelve los bytes guardados o None si no existen o están vencidos."""
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, "rb") as f:
+                creado, = _CABECERA.unpack(f.read(_CABECERA.size))
+                datos = f.read()
+        except (FileNotFoundError, struct.error):
+            return None
+
+        if self.ttl is not None and time.time() - creado > self.ttl:
+            ruta.unlink(missing_ok=True)
+            return None
+
+        os.utime(ruta)  # Actualiza el último uso para la expulsión LRU
+        return datos
+
+    def escribir(self, clave, datos):
+        ruta = self._ruta(clave)
+        ruta.parent.mkdir(exist_ok=True)
+        # Se escribe en un temporal y se renombra para no dejar entradas a medias
+        temporal = ruta.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporal, "wb") as f:
+            f.write(_CABECERA.pack(time.time()))
+            f.write(datos)
+        os.replace(temporal, ruta)
+        self._podar()
+
+    def _podar(self):
+        if self.max_bytes is None:
+            return
+        entradas = [(r.stat(), r) for r in self.directorio.glob("*/*.bin")]
+        total = sum(s.st_size for s, _ in entradas)
+        for estado, ruta in sorted(entradas, key=lambda e: e[0].st_mtime):
+            if total <= self.max_bytes:
+                break
+            ruta.unlink(missing_ok=True)
+            total -= estado.st_size
+
+    def limpiar(self):
+        """Elimina todas las entradas."""
+        for ruta in self.directorio.glob("*/*.bin"):
+            ruta.unlink(missing_ok=True)
+
+
+class CacheMiniaturas:
+    """
+    Caché de miniaturas de EE: los PNG se guardan en disco (LRU por bytes totales) y, si
+    `max_en_memoria` es mayor que cero, las últimas imágenes decodificadas se guardan como arreglos.
+    La clave combina la expresión de la imagen, la región, las dimensiones, el formato,
+    min, max y la paleta, así que cambiar cualquier parámetro de visualización pide una nueva.
+    """
+
+    def __init__(self, directorio, max_bytes=1024 ** 3, ttl=None, max_en_memoria=64):
+        self.disco = CacheDisco(directorio, max_bytes=max_bytes, ttl=ttl)
+        self.max_en_memoria = max_en_memoria
+        self._arreglos = OrderedDict()
+
+    @staticmethod
+    def clave(imagen, region, dimensiones, formato, min_val, max_val, palette):
+        return CacheDisco.clave("thumb", imagen.serialize(), region.serialize(), dimensiones, formato,
+                                float(min_val), float(max_val), list(palette or []))
+
+    def leer(self, clave):
+        return self.disco.leer(clave)
+
+    def escribir(self, clave, contenido):
+        self.disco.escribir(clave, contenido)
+
+    def arreglo(self, clave):
+        """Imagen ya decodificada en memoria, o None."""
+        arreglo = self._arreglos.get(clave)
+        if arreglo is not None:
+            self._arreglos.move_to_end(clave)
+        return arreglo
+
+    def guardar_arreglo(self, clave, arreglo):
+        if self.max_en_memoria <= 0:
+            return
+        self._arreglos[clave] = arreglo
+        self._arreglos.move_to_end(clave)
+        while len(self._arreglos) > self.max_en_memoria:
+            self._arreglos.popitem(last=False)
+
+
+_cache_ee = None
+_cache_activa = True
+_cache_miniaturas = None
+_miniaturas_activa = True
+
+
+def configurar_cache(directorio=None, max_bytes=512 * 1024 ** 2, ttl=30 * 24 * 3600, activa=True):
+    """Configura (o desactiva con activa=False) la caché usada por info_en_cache."""
+    global _cache_ee, _cache_activa
+    _cache_activa = activa
+    _cache_ee = CacheDisco(Path(directorio or DIRECTORIO_CACHE) / "ee", max_bytes=max_bytes, ttl=ttl) if activa else None
+    return _cache_ee
+
+
+def obtener_cache():
+    """Caché de resultados de EE en uso; se crea con los valores por defecto la primera vez."""
+    if _cache_ee is None and _cache_activa:
+        configurar_cache()
+    return _cache_ee
+
+
+@instrumentar
+def info_en_cache(objeto, cache=None):
+    """
+    Equivalente a objeto.getInfo() que consulta antes la caché en disco.
+    La clave es el grafo de expresión serializado del objeto EE, que ya incluye el reductor,
+    la escala y la geometría de un reduceRegion, así que un cambio en cualquiera invalida la entrada.
+    """
+    cache = cache or obtener_cache()
+    if cache is None:
+        contar("getInfo")
+        return objeto.getInfo()
+
+    clave = cache.clave("getInfo", objeto.serialize())
+    datos = cache.leer(clave)
+    if datos is not None:
+        contar("cache_ee.aciertos")
+        sumar_bytes(len(datos))
+        return json.loads(datos)
+
+    contar("getInfo")
+    info = objeto.getInfo()
+    datos = json.dumps(info).encode("utf-8")
+    sumar_bytes(len(datos))
+    cache.escribir(clave, datos)
+    return info
+
+
+def configurar_cache_miniaturas(directorio=None, max_bytes=1024 ** 3, ttl=None, max_en_memoria=64, activa=True):
+    """Configura (o desactiva con activa=False) la caché de miniaturas usada por utils.display."""
+    global _cache_miniaturas, _miniaturas_activa
+    _miniaturas_activa = activa
+    _cache_miniaturas = CacheMiniaturas(
+        Path(directorio or DIRECTORIO_CACHE) / "miniaturas",
+        max_bytes=max_bytes, ttl=ttl, max_en_memoria=max_en_memoria
+    ) if activa else None
+    return _cache_miniaturas
+
+
+def obtener_cache_miniaturas():
+    """Caché de miniaturas en uso; se crea con los valores por defecto la primera vez."""
+    if _cache_miniaturas is None and _miniaturas_activa:
+        configurar_cache_miniaturas()
+    return _cache_miniaturas
@@ -1,13 +1,38 @@
 # --- Funciones para clustering temporal con Earth Engine ---
+from utils.profiler import instrumentar
 
-def sample_training_data(vertex_stack, aoi, scale=60, num_pixels=5000):
+
+@instrumentar
+def sample_training_data(vertex_stack, aoi, scale=60, num_pixels=5000, estratos=None):
     """
-    Muestra datos desde los rasters de vértices para entrenamiento.
+    Muestra datos desde los rasters de vértices para entrenamiento, solo dentro de la geometría del AOI.
+    Con `estratos` (imagen con banda 'estrato', p. ej. estratos_cobertura o estratos_residuo de
+    utils.sampling) se toman num_pixels por estrato para que las clases raras queden representadas.
+    Con una ImagenLocal se usa muestreo de reservorio en una pasada; `aoi` es entonces una máscara
+    booleana o None y `estratos` un arreglo (filas, columnas).
     """
-    region = aoi.geometry().bounds()
+    from utils.local import ImagenLocal
+
+    if isinstance(vertex_stack, ImagenLocal):
+        from utils.sampling import muestreo_reservorio
+        return muestreo_reservorio(vertex_stack, num_pixels, mascara=aoi, estratos=estratos)[0]
+
+    region = aoi.geometry()
+
+    if estratos is not None:
+        muestra = vertex_stack.addBands(estratos.select('estrato')).stratifiedSample(
+            numPoints=num_pixels,
+            classBand='estrato',
+            region=region,
+            scale=scale,
+            seed=42,
+            geometries=False
+        )
+        # El estrato no debe entrar como variable del k-means
+        return muestra.select(vertex_stack.bandNames())
 
     return vertex_stack.sample(
-        region=region,         
+        region=region,
         scale=scale,
         numPixels=num_pixels,
         seed=42
@@ -15,12 +40,46 @@ def sample_training_data(vertex_stack, aoi, scale=60, num_pixels=5000):
 
 
 
-def entrenar_kmeans(training_data, num_clusters=10):
-    """Entrena un cluster k-means con Weka."""
+@instrumentar
+def entrenar_kmeans(training_data, num_clusters=10, metrica="euclidea"):
+    """
+    Entrena un cluster k-means con Weka.
+    Con datos locales (ImagenLocal o arreglo NumPy) entrena k-means por mini-lotes en la máquina.
+    Con metrica="dtw" (solo local) agrupa las trayectorias por su forma: series z-normalizadas y DTW.
+    """
+    import numpy as np
+    from utils.local import ImagenLocal
+
+    local = isinstance(training_data, (ImagenLocal, np.ndarray))
+    if metrica == "dtw":
+        if not local:
+            raise ValueError("El clustering por forma (metrica='dtw') solo funciona con datos locales "
+                             "(ImagenLocal o arreglo NumPy), no con una FeatureCollection de Earth Engine.")
+        from utils.dtw import entrenar_formas_local
+        return entrenar_formas_local(training_data, num_clusters=num_clusters)
+
+    if local:
+        from utils.kmeans import entrenar_kmeans_local
+        return entrenar_kmeans_local(training_data, num_clusters=num_clusters)
+
+    import ee
     return ee.Clusterer.wekaKMeans(num_clusters).train(training_data)
 
+@instrumentar
 def aplicar_clustering(vertex_stack, clusterer, num_clusters=10):
     """Aplica el modelo entrenado a todos los píxeles."""
+    from utils.dtw import ModeloFormas
+    from utils.local import ImagenLocal
+
+    if isinstance(clusterer, ModeloFormas):
+        from utils.dtw import aplicar_formas_local
+        return aplicar_formas_local(vertex_stack, clusterer)
+
+    # Pila local: asignación por bloques con la misma numeración 1-10
+    if isinstance(vertex_stack, ImagenLocal):
+        from utils.kmeans import aplicar_clustering_local
+        return aplicar_clustering_local(vertex_stack, clusterer)
+
     resultado = vertex_stack.cluster(clusterer)
     # Remapea clase 0 a 10 si deseas evitar el valor 0
     return resultado.remap(
@@ -1,11 +1,45 @@
-# --- Función para mostrar una imagen de Earth Engine con matplotlib ---
-def mostrar_imagen_ee(imagen, region, titulo="Imagen EE", min_val=0, max_val=255, palette=None, dimensiones=512, formato="png", ax=None, barra_color=True):
-    # Si la región es una colección de features, se obtiene la geometría directamente
-    if isinstance(region, ee.FeatureCollection):
-        region = region.geometry()
+import threading
+
+from utils.profiler import contar, instrumentar
 
-    # Solicita una URL de miniatura para la imagen desde EE
-    url = imagen.getThumbURL({
+# --- Sesión HTTP compartida con pool de conexiones, reintentos y tiempos límite ---
+_sesion = None
+_candado_sesion = threading.Lock()  # mostrar_paneles_ee la pide desde varios hilos a la vez
+
+@instrumentar
+def sesion_http(max_conexiones=16, reintentos=3):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    global _sesion
+
+    # Se crea una sola vez y se reutiliza para mantener abiertas las conexiones con EE
+    if _sesion is None:
+        with _candado_sesion:
+            if _sesion is None:
+                sesion = requests.Session()
+                adaptador = HTTPAdapter(
+                    pool_connections=max_conexiones,
+                    pool_maxsize=max_conexiones,
+                    max_retries=Retry(total=reintentos, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+                )
+                sesion.mount("https://", adaptador)
+                sesion.mount("http://", adaptador)
+                _sesion = sesion
+    return _sesion
+
+# --- Función para descargar el contenido de una miniatura ---
+@instrumentar
+def descargar_miniatura(url, timeout=(10, 120)):
+    # timeout = (conexión, lectura) en segundos
+    contar("descargas")
+    return sesion_http().get(url, timeout=timeout).content
+
+# --- Función para pedir a EE la URL de miniatura de una imagen ---
+@instrumentar
+def url_miniatura(imagen, region, min_val=0, max_val=255, palette=None, dimensiones=512, formato="png"):
+    contar("getThumbURL")
+    return imagen.getThumbURL({
         'region': region.bounds(),      # Región a visualizar
         'dimensions': dimensiones,      # Tamaño de la imagen (píxeles)
         'format': formato,              # Formato de imagen (por defecto PNG)
@@ -14,16 +48,84 @@ def mostrar_imagen_ee(imagen, region, titulo="Imagen EE", min_val=0, max_val=255
         'palette': palette or ['000000', 'FFFFFF']  # Paleta de color por defecto
     })
 
-    # Descarga la imagen desde la URL
-    response = requests.get(url)
+# --- Funciones para leer y guardar miniaturas en la caché (clave = imagen + parámetros de visualización) ---
+@instrumentar
+def clave_miniatura(imagen, region, min_val=0, max_val=255, palette=None, dimensiones=512, formato="png"):
+    from utils.cache import obtener_cache_miniaturas
+
+    cache = obtener_cache_miniaturas()
+    if cache is None:
+        return None
+    return cache.clave(imagen, region.bounds(), dimensiones, formato, min_val, max_val, palette or ['000000', 'FFFFFF'])
+
+@instrumentar
+def guardar_miniatura(clave, contenido):
+    from utils.cache import obtener_cache_miniaturas
+
+    cache = obtener_cache_miniaturas()
+    # Solo se guardan respuestas válidas, con el mismo criterio que al mostrarlas
+    if cache is not None and clave is not None and len(contenido) >= 1000:
+        cache.escribir(clave, contenido)
+
+@instrumentar
+def leer_miniatura(clave):
+    from utils.cache import obtener_cache_miniaturas
+
+    cache = obtener_cache_miniaturas()
+    contenido = cache.leer(clave) if cache is not None and clave is not None else None
+    contar("cache_miniaturas.aciertos" if contenido is not None else "cache_miniaturas.fallos")
+    return contenido
+
+# --- Función para decodificar una miniatura (reutiliza el arreglo ya decodificado si está en memoria) ---
+@instrumentar
+def decodificar_miniatura(contenido, clave=None):
+    import numpy as np
+    from io import BytesIO
+    from PIL import Image
+    from utils.cache import obtener_cache_miniaturas
+
+    cache = obtener_cache_miniaturas()
+    if cache is not None and clave is not None:
+        arreglo = cache.arreglo(clave)
+        if arreglo is not None:
+            return arreglo
+
+    arreglo = np.asarray(Image.open(BytesIO(contenido)))
+    if cache is not None and clave is not None:
+        cache.guardar_arreglo(clave, arreglo)
+    return arreglo
+
+# --- Función para mostrar una imagen de Earth Engine con matplotlib ---
+@instrumentar
+def mostrar_imagen_ee(imagen, region, titulo="Imagen EE", min_val=0, max_val=255, palette=None, dimensiones=512, formato="png", ax=None, barra_color=True):
+    import ee
+    import matplotlib.colors as mcolors
+    import matplotlib.pyplot as plt
+    from matplotlib.colorbar import ColorbarBase
+
+    # Si la región es una colección de features, se obtiene la geometría directamente
+    if isinstance(region, ee.FeatureCollection):
+        region = region.geometry()
+
+    # Busca primero la miniatura en la caché (misma imagen, región y parámetros de visualización)
+    clave = clave_miniatura(imagen, region, min_val, max_val, palette, dimensiones, formato)
+    contenido = leer_miniatura(clave)
+
+    if contenido is None:
+        # Solicita una URL de miniatura para la imagen desde EE
+        url = url_miniatura(imagen, region, min_val, max_val, palette, dimensiones, formato)
+
+        # Descarga la imagen desde la URL usando la sesión compartida y la guarda en la caché
+        contenido = descargar_miniatura(url)
+        guardar_miniatura(clave, contenido)
 
     # Si la imagen no se generó correctamente, se avisa y no se muestra
-    if len(response.content) < 1000:
+    if len(contenido) < 1000:
         print(f"No se obtuvo imagen válida desde Earth Engine, se omite: {titulo}")
         return
 
     # Convierte la respuesta a imagen
-    img = Image.open(BytesIO(response.content))
+    img = decodificar_miniatura(contenido, clave)
 
     # Si no se proporcionó un eje, se crea una nueva figura y eje
     if ax is None:
@@ -49,25 +151,121 @@ def mostrar_imagen_ee(imagen, region, titulo="Imagen EE", min_val=0, max_val=255
         ax.set_title(titulo, fontsize=12)
         ax.axis("off")
 
+# --- Función para mostrar varias imágenes de EE descargándolas en paralelo ---
+@instrumentar
+def mostrar_paneles_ee(paneles, region, axes, dimensiones=512, formato="png", max_hilos=8):
+    """
+    Dibuja varias imágenes de EE, una por eje. Las que ya están en la caché de miniaturas se dibujan
+    sin red; para el resto se piden primero todas las URLs y luego se descargan en paralelo con la
+    sesión compartida, dibujando cada panel en cuanto llega. Si falla la URL o la descarga de un
+    panel, ese panel muestra un aviso y los demás se dibujan igual.
+    `paneles` es una lista de diccionarios con imagen, titulo, min_val, max_val y palette.
+    """
+    import ee
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    # Si la región es una colección de features, se obtiene la geometría directamente
+    if isinstance(region, ee.FeatureCollection):
+        region = region.geometry()
+
+    def parametros(p):
+        return (p["min_val"], p["max_val"], p.get("palette"), dimensiones, formato)
+
+    def dibujar(i, contenido):
+        axes[i].axis("off")
+        # Si la imagen no se generó correctamente, se avisa y el panel queda vacío
+        if len(contenido) < 1000:
+            print(f"No se obtuvo imagen válida desde Earth Engine, se omite: {paneles[i]['titulo']}")
+            return
+        axes[i].imshow(decodificar_miniatura(contenido, claves[i]))
+        axes[i].set_title(paneles[i]["titulo"], fontsize=12)
+
+    def sin_imagen(i, error):
+        print(f"⚠️ No se pudo obtener {paneles[i]['titulo']}: {type(error).__name__}: {error}")
+        axes[i].axis("off")
+        axes[i].text(0.5, 0.5, "Sin imagen", ha="center", va="center", transform=axes[i].transAxes, color="gray")
+        axes[i].set_title(paneles[i]["titulo"], fontsize=12)
+
+    def url_o_error(i):
+        try:
+            return url_miniatura(paneles[i]["imagen"], region, *parametros(paneles[i]))
+        except Exception as error:
+            return error
+
+    claves = [clave_miniatura(p["imagen"], region, *parametros(p)) for p in paneles]
+    en_cache = {i: leer_miniatura(clave) for i, clave in enumerate(claves)}
+    faltan = [i for i, contenido in en_cache.items() if contenido is None]
+
+    if faltan:
+        sesion_http()  # se crea antes de repartir las descargas entre los hilos
+    with ThreadPoolExecutor(max_workers=max_hilos) as pool:
+        # 1. Genera las URLs que faltan (cada getThumbURL es una llamada al servidor, también en paralelo)
+        urls = list(pool.map(url_o_error, faltan))
+
+        # 2. Descarga concurrente mientras se dibujan los paneles que ya estaban en la caché;
+        #    el dibujo se hace en este hilo porque matplotlib no es seguro entre hilos
+        futuros = {pool.submit(descargar_miniatura, url): i for i, url in zip(faltan, urls)
+                   if not isinstance(url, Exception)}
+        for i, url in zip(faltan, urls):
+            if isinstance(url, Exception):
+                sin_imagen(i, url)
+        for i, contenido in en_cache.items():
+            if contenido is not None:
+                dibujar(i, contenido)
+
+        for futuro in as_completed(futuros):
+            i = futuros[futuro]
+            try:
+                contenido = futuro.result()
+            except Exception as error:
+                sin_imagen(i, error)
+                continue
+            guardar_miniatura(claves[i], contenido)
+            dibujar(i, contenido)
+
+# --- Reductor para los rangos de visualización: minMax o percentiles robustos ---
+@instrumentar
+def reductor_rango(percentiles=None):
+    import ee
+
+    if percentiles is None:
+        return ee.Reducer.minMax()
+
+    # Se nombran las salidas 'min' y 'max' para leerlas igual que con minMax
+    return ee.Reducer.percentile(list(percentiles), outputNames=["min", "max"])
+
 # --- Función para obtener rangos (mínimo y máximo) de los fitted por año ---
-def obtener_rango_fitted(fitted_stack, years, aoi):
+@instrumentar
+def obtener_rango_fitted(fitted_stack, years, aoi, por_lotes=True, percentiles=None):
+    """
+    Devuelve {year: {"min", "max"}} para las bandas fittedResidual_{year}.
+    Con por_lotes=True se reducen todas las bandas en una sola llamada reduceRegion;
+    percentiles=(2, 98) usa percentiles en lugar de mínimo y máximo para un estiramiento robusto.
+    """
     import ee
+    from utils.cache import info_en_cache
     rangos = {}
 
     # Si el AOI es un FeatureCollection, se obtiene su geometría
     if isinstance(aoi, ee.FeatureCollection):
         aoi = aoi.geometry()
 
-    for year in years:
-        banda = f"fittedResidual_{year}"  # Nombre de la banda del año correspondiente
-
-        # Reduce la región para obtener valores mínimo y máximo
-        stats = fitted_stack.select(banda).reduceRegion(
-            reducer=ee.Reducer.minMax(),  # Calcula min y max
+    def reducir(bandas):
+        # Reduce la región para obtener valores mínimo y máximo (consulta antes la caché en disco)
+        return info_en_cache(fitted_stack.select(bandas).reduceRegion(
+            reducer=reductor_rango(percentiles),  # Calcula min y max (o percentiles)
             geometry=aoi,                 # Sobre el área de interés
             scale=250,                    # Escala de resolución (250m)
             bestEffort=True               # Ajusta automáticamente si hay muchos píxeles
-        ).getInfo()
+        ))
+
+    # En modo por lotes, una sola llamada devuelve las estadísticas de todos los años
+    if por_lotes:
+        stats_lote = reducir([f"fittedResidual_{year}" for year in years])
+
+    for year in years:
+        banda = f"fittedResidual_{year}"  # Nombre de la banda del año correspondiente
+        stats = stats_lote if por_lotes else reducir(banda)
 
         # Intenta convertir los valores; si falla, usa valores por defecto
         try:
@@ -83,48 +281,106 @@ def obtener_rango_fitted(fitted_stack, years, aoi):
     return rangos  # Devuelve un diccionario con los rangos para cada año
 
 # --- Función para mostrar varias imágenes fitted (una por año) ---
+@instrumentar
 def mostrar_landtrendr_fitted(fitted_stack, years, aoi, palette=None, rangos=None):
     import matplotlib.pyplot as plt
-    from utils.display import mostrar_imagen_ee
 
     # Crea una figura con subplots horizontales, uno por cada año
-    fig, axes = plt.subplots(1, len(years), figsize=(6 * len(years), 5))
+    fig, axes = plt.subplots(1, len(years), figsize=(6 * len(years), 5), squeeze=False)
 
-    for i, year in enumerate(years):
+    paneles = []
+    for year in years:
         banda = fitted_stack.select(f'fittedResidual_{year}')  # Selecciona la banda del año actual
 
         # Usa el rango si está definido, si no usa valores por defecto
         rango = rangos.get(year, {"min": -0.2, "max": 0.8}) if rangos else {"min": -0.2, "max": 0.8}
 
-        # Muestra la imagen ajustada para ese año
-        mostrar_imagen_ee(
-            imagen=banda,
-            region=aoi,
-            titulo=f'Fitted NDVI {year}',
-            min_val=rango["min"],
-            max_val=rango["max"],
-            palette=palette or ["ff0000", "ffffff", "00ff00"],  # Paleta por defecto: rojo-blanco-verde
-            ax=axes[i],
-            barra_color=False  # No mostrar barra de color en este caso
-        )
+        paneles.append({
+            "imagen": banda,
+            "titulo": f'Fitted NDVI {year}',
+            "min_val": rango["min"],
+            "max_val": rango["max"],
+            "palette": palette or ["ff0000", "ffffff", "00ff00"]  # Paleta por defecto: rojo-blanco-verde
+        })
+
+    # Descarga todas las imágenes en paralelo y las dibuja a medida que llegan
+    mostrar_paneles_ee(paneles, aoi, axes[0])
 
     plt.tight_layout()
     plt.show()  # Muestra todas las imágenes juntas
 
+# --- Paleta de 10 colores distintos para las clases de clustering (0 a 9) ---
+PALETA_CLUSTERS = [
+    "e6194b", "3cb44b", "ffe119", "4363d8", "f58231",
+    "911eb4", "46f0f0", "f032e6", "bcf60c", "fabebe"
+]
+
+def _clusters_locales(imagen_cluster, palette=None):
+    """
+    Etiquetas locales (1 a k, 0 sin dato) enmascaradas en 0, con un mapa de colores de k colores.
+    La clase k es la 0 de EE, así que cada clase conserva el color que tiene en la miniatura.
+    """
+    import matplotlib.colors as mcolors
+    import numpy as np
+
+    etiquetas = imagen_cluster.banda('cluster')
+    num_clusters = int(imagen_cluster.propiedades.get("num_clusters") or max(int(etiquetas.max()), 1))
+    paleta = palette or PALETA_CLUSTERS
+    cmap = mcolors.ListedColormap([f"#{paleta[i % len(paleta)]}" for i in range(1, num_clusters + 1)])
+    return np.ma.masked_equal(etiquetas, 0), cmap, num_clusters
+
 # --- Función para mostrar una imagen de clustering como imagen estática ---
+@instrumentar
 def mostrar_clustering(imagen_cluster, region, titulo="Clustering", palette=None):
     """
     Muestra el raster de clustering como imagen estática con matplotlib.
+    También acepta el resultado local (ImagenLocal 'cluster'); en ese caso no se usa la región.
     """
+    from utils.local import ImagenLocal
+
+    if isinstance(imagen_cluster, ImagenLocal):
+        import matplotlib.pyplot as plt
+
+        # Los píxeles sin dato (0) quedan transparentes; cada clase con su color de la miniatura de EE
+        etiquetas, cmap, num_clusters = _clusters_locales(imagen_cluster, palette)
+        fig, ax = plt.subplots(figsize=(8, 8))
+        ax.imshow(etiquetas, cmap=cmap, vmin=0.5, vmax=num_clusters + 0.5, interpolation='nearest')
+        ax.set_title(titulo, fontsize=14)
+        ax.axis("off")
+        plt.show()
+        return
+
     mostrar_imagen_ee(
         imagen=imagen_cluster,
         region=region,
         titulo=titulo,
         min_val=0,
         max_val=9,  # Rango de clases esperadas (si se usaron 10 clusters: 0 a 9)
-        palette=palette or [  # Paleta por defecto de 10 colores distintos
-            "e6194b", "3cb44b", "ffe119", "4363d8", "f58231",
-            "911eb4", "46f0f0", "f032e6", "bcf60c", "fabebe"
-        ]
+        palette=palette or PALETA_CLUSTERS
     )
 
+# --- Función para guardar el clustering como PNG, sin mostrarlo (ejecuciones sin Jupyter) ---
+@instrumentar
+def guardar_clustering(imagen_cluster, region, ruta, palette=None, dimensiones=1024):
+    """
+    Escribe el raster de clustering en `ruta` (PNG) con la misma paleta que mostrar_clustering.
+    Con una ImagenLocal se colorea en la máquina; con una imagen de EE se descarga su miniatura.
+    """
+    from utils.local import ImagenLocal
+
+    if isinstance(imagen_cluster, ImagenLocal):
+        from matplotlib.image import imsave
+
+        etiquetas, cmap, num_clusters = _clusters_locales(imagen_cluster, palette)
+        imsave(ruta, etiquetas, cmap=cmap, vmin=0.5, vmax=num_clusters + 0.5, format="png")
+        return ruta
+
+    import ee
+
+    if isinstance(region, ee.FeatureCollection):
+        region = region.geometry()
+    url = url_miniatura(imagen_cluster, region, 0, 9, palette or PALETA_CLUSTERS, dimensiones)
+    with open(ruta, "wb") as f:
+        f.write(descargar_miniatura(url))
+    return ruta
+
@@ -0,0 +1,229 @@
+# --- Clustering por forma de las trayectorias de residuos (DTW con banda de Sakoe-Chiba) ---
+import os
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+
+class ModeloFormas:
+    """
+    Modelo de clustering por forma: centros (k, años) z-normalizados, ancho de la banda de
+    Sakoe-Chiba (en años) e inercia DTW sobre la muestra de entrenamiento.
+    """
+
+    def __init__(self, centros, ventana, inercia, bandas=None):
+        self.centros = centros
+        self.ventana = ventana
+        self.inercia = inercia
+        self.bandas = bandas
+
+    @property
+    def num_clusters(self):
+        return self.centros.shape[0]
+
+
+def znormalizar(series):
+    """
+    Resta la media y divide por la desviación de cada serie (filas) para comparar solo la forma.
+    Las series planas quedan en cero.
+    """
+    series = np.asarray(series, dtype=np.float64)
+    centradas = series - series.mean(axis=1, keepdims=True)
+    desviacion = centradas.std(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(desviacion > 1e-12, centradas / desviacion, 0.0)
+
+
+def ventana_por_defecto(num_years):
+    """Banda de Sakoe-Chiba del 10 % de la serie, al menos un año."""
+    return max(1, int(round(0.1 * num_years)))
+
+
+def distancia_dtw(x, centro, ventana):
+    """
+    DTW (suma de diferencias al cuadrado) entre cada serie de x (n, años) y un centro (años,),
+    restringida a |i - j| <= ventana. Se vectoriza sobre las series y solo guarda dos filas de la matriz.
+    """
+    n, t = x.shape
+    anterior = np.full((n, t + 1), np.inf)
+    anterior[:, 0] = 0.0
+    for i in range(1, t + 1):
+        actual = np.full((n, t + 1), np.inf)
+        for j in range(max(1, i - ventana), min(t, i + ventana) + 1):
+            coste = (x[:, i - 1] - centro[j - 1]) ** 2
+            actual[:, j] = coste + np.minimum(np.minimum(anterior[:, j], actual[:, j - 1]), anterior[:, j - 1])
+        anterior = actual
+    return anterior[:, t]
+
+
+def envolvente(centro, ventana):
+    """Envolvente superior e inferior del centro para LB_Keogh."""
+    t = len(centro)
+    superior = np.array([centro[max(0, i - ventana):i + ventana + 1].max() for i in range(t)])
+    inferior = np.array([centro[max(0, i - ventana):i + ventana + 1].min() for i in range(t)])
+    return superior, inferior
+
+
+def lb_keogh(x, superior, inferior):
+    """Cota inferior de la DTW con la misma banda: lo que cada serie sale de la envolvente, al cuadrado."""
+    exceso = np.where(x > superior, x - superior, np.where(x < inferior, inferior - x, 0.0))
+    return (exceso * exceso).sum(axis=1)
+
+
+def asignar_por_forma(x, centros, ventana):
+    """
+    Centro más cercano por DTW para series ya z-normalizadas.
+    Primero se calcula la DTW exacta con el centro de menor LB_Keogh; después, para cada centro,
+    solo con las series cuya cota inferior todavía puede mejorar la mejor distancia encontrada.
+    Devuelve (etiquetas, distancias).
+    """
+    cotas = np.stack([lb_keogh(x, *envolvente(c, ventana)) for c in centros], axis=1)
+    etiquetas = cotas.argmin(axis=1)
+    distancias = np.empty(len(x))
+    calculado = np.zeros(cotas.shape, dtype=bool)
+    for k, centro in enumerate(centros):
+        filas = np.flatnonzero(etiquetas == k)
+        distancias[filas] = distancia_dtw(x[filas], centro, ventana)
+        calculado[filas, k] = True
+
+    for k in np.argsort(cotas.mean(axis=0)):
+        filas = np.flatnonzero(~calculado[:, k] & (cotas[:, k] < distancias))
+        if len(filas) == 0:
+            continue
+        d = distancia_dtw(x[filas], centros[k], ventana)
+        mejora = d < distancias[filas]
+        distancias[filas[mejora]] = d[mejora]
+        etiquetas[filas[mejora]] = k
+    return etiquetas, distancias
+
+
+def _promedio_dba(x, centro, ventana):
+    """
+    Un paso de DBA (DTW Barycenter Averaging): cada punto del centro pasa a ser la media de los
+    puntos de las series alineados con él por el camino DTW óptimo.
+    """
+    n, t = x.shape
+    costes = np.full((n, t + 1, t + 1), np.inf)
+    costes[:, 0, 0] = 0.0
+    for i in range(1, t + 1):
+        for j in range(max(1, i - ventana), min(t, i + ventana) + 1):
+            costes[:, i, j] = (x[:, i - 1] - centro[j - 1]) ** 2 + np.minimum(
+                np.minimum(costes[:, i - 1, j], costes[:, i, j - 1]), costes[:, i - 1, j - 1])
+
+    # Recorre hacia atrás los n caminos a la vez
+    sumas = np.zeros(t)
+    conteos = np.zeros(t)
+    i = np.full(n, t)
+    j = np.full(n, t)
+    filas = np.arange(n)
+    activos = np.ones(n, dtype=bool)
+    while activos.any():
+        np.add.at(sumas, j[activos] - 1, x[filas[activos], i[activos] - 1])
+        np.add.at(conteos, j[activos] - 1, 1)
+        opciones = np.stack([costes[filas, i - 1, j - 1], costes[filas, i - 1, j], costes[filas, i, j - 1]])
+        paso = opciones.argmin(axis=0)
+        i = np.where(activos, i - (paso != 2), i)
+        j = np.where(activos, j - (paso != 1), j)
+        activos &= (i > 0) & (j > 0)
+    return np.where(conteos > 0, sumas / np.maximum(conteos, 1), centro)
+
+
+def _inicializar(x, k, ventana, rng):
+    """Inicialización tipo k-means++ con distancias DTW."""
+    centros = [x[rng.integers(len(x))]]
+    minimas = distancia_dtw(x, centros[0], ventana)
+    for _ in range(1, k):
+        total = minimas.sum()
+        elegido = rng.choice(len(x), p=minimas / total) if total > 0 else rng.integers(len(x))
+        centros.append(x[elegido])
+        np.minimum(minimas, distancia_dtw(x, centros[-1], ventana), out=minimas)
+    return np.array(centros)
+
+
+def entrenar_formas_local(imagen, num_clusters=10, ventana=None, tamano_muestra=5000, iteraciones=20,
+                          semilla=42):
+    """
+    Agrupa las trayectorias por su forma: k-means con DTW (banda de Sakoe-Chiba) sobre series
+    z-normalizadas y centros promediados con DBA. `imagen` es una ImagenLocal con una banda por año
+    (fittedResidual_* o los residuos), un cubo (años, filas, columnas) o una matriz (series, años).
+    Se entrena con una muestra de `tamano_muestra` píxeles sin NaN.
+    """
+    from utils.kmeans import matriz_pixeles
+    from utils.local import ImagenLocal
+
+    datos, validos = matriz_pixeles(imagen)
+    indices_validos = np.flatnonzero(validos)
+    if len(indices_validos) < num_clusters:
+        raise ValueError(f"Hay {len(indices_validos)} píxeles válidos, menos que {num_clusters} clusters.")
+    ventana = ventana_por_defecto(datos.shape[1]) if ventana is None else ventana
+
+    rng = np.random.default_rng(semilla)
+    muestra = np.sort(rng.choice(indices_validos, size=min(tamano_muestra, len(indices_validos)), replace=False))
+    x = znormalizar(datos[muestra])
+    centros = _inicializar(x, num_clusters, ventana, rng)
+
+    etiquetas = None
+    for _ in range(iteraciones):
+        nuevas, distancias = asignar_por_forma(x, centros, ventana)
+        if etiquetas is not None and np.array_equal(nuevas, etiquetas):
+            break
+        etiquetas = nuevas
+        for k in range(num_clusters):
+            miembros = x[etiquetas == k]
+            if len(miembros) == 0:
+                # Cluster vacío: se reinicia con la serie peor representada
+                centros[k] = x[distancias.argmax()]
+                distancias[distancias.argmax()] = 0
+            else:
+                centros[k] = _promedio_dba(miembros, centros[k], ventana)
+
+    _, distancias = asignar_por_forma(x, centros, ventana)
+    bandas = imagen.bandNames() if isinstance(imagen, ImagenLocal) else None
+    return ModeloFormas(centros, ventana, float(distancias.sum()), bandas)
+
+
+def _asignar_bloque(series, centros, ventana):
+    """Etiquetas de un bloque de series (se ejecuta en un proceso hijo)."""
+    return asignar_por_forma(znormalizar(series), centros, ventana)[0]
+
+
+def aplicar_formas_local(imagen, modelo, bloque=50000, procesos=None):
+    """
+    Asigna cada píxel al centro de forma más cercano, por bloques repartidos entre procesos.
+    Devuelve una ImagenLocal 'cluster' (uint8) con la misma numeración que aplicar_clustering
+    (la clase 0 pasa a ser la última) y 0 en los píxeles con NaN, lista para mostrar_clustering.
+    """
+    from utils.kmeans import matriz_pixeles
+    from utils.local import ImagenLocal
+
+    filas, columnas = imagen.datos.shape[-2:]
+    datos, validos = matriz_pixeles(imagen)
+    indices = np.flatnonzero(validos)
+    etiquetas = np.zeros(datos.shape[0], dtype=np.uint8)
+    bloques = [indices[i:i + bloque] for i in range(0, len(indices), bloque)]
+
+    def escribir(posiciones, resultado):
+        etiquetas[posiciones] = np.where(resultado == 0, modelo.num_clusters, resultado)
+
+    procesos = procesos or os.cpu_count() or 1
+    if procesos == 1:
+        for posiciones in bloques:
+            escribir(posiciones, _asignar_bloque(datos[posiciones], modelo.centros, modelo.ventana))
+    else:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            pendientes = {}
+            for posiciones in bloques:
+                # Como en ejecutar_por_teselas, se acota el número de bloques en vuelo
+                if len(pendientes) >= 2 * procesos:
+                    terminadas, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                    for futuro in terminadas:
+                        escribir(pendientes.pop(futuro), futuro.result())
+                futuro = pool.submit(_asignar_bloque, np.ascontiguousarray(datos[posiciones]),
+                                     modelo.centros, modelo.ventana)
+                pendientes[futuro] = posiciones
+            terminadas, _ = wait(pendientes, return_when=ALL_COMPLETED)
+            for futuro in terminadas:
+                escribir(pendientes.pop(futuro), futuro.result())
+
+    return ImagenLocal(etiquetas.reshape(1, filas, columnas), ['cluster'],
+                       dict(imagen.propiedades, num_clusters=modelo.num_clusters))
@@ -0,0 +1,333 @@
+# --- Modo exportación: tareas Export de EE, sondeo asíncrono y ensamblado en el almacén de cubos ---
+import asyncio
+import hashlib
+import json
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# Estados de las tareas de EE (ee.data.getTaskStatus) que ya no cambian
+ESTADOS_FINALES = ("COMPLETED", "FAILED", "CANCELLED")
+
+
+class ServicioTareasEE:
+    """
+    Tareas reales de Earth Engine: Export.image / Export.table a Cloud Storage (`bucket`, bajo
+    `prefijo`) y descarga de los archivos resultantes con google-cloud-storage. Sirve para AOIs
+    grandes, donde getInfo y getThumbURL agotan el tiempo o la memoria de las llamadas interactivas.
+    """
+
+    def __init__(self, bucket, prefijo="cambio_cobertura", escala=250, crs=None, max_pixeles=1e13,
+                 dimensiones_archivo=None):
+        self.bucket = bucket
+        self.prefijo = prefijo
+        self.escala = escala
+        self.crs = crs
+        self.max_pixeles = max_pixeles
+        self.dimensiones_archivo = dimensiones_archivo
+
+    def exportar_imagen(self, imagen, descripcion, region, num_bandas=None):
+        """Lanza un Export.image (GeoTIFF, dividido en teselas por EE si es grande) y devuelve su id."""
+        import ee
+
+        parametros = {"image": imagen, "description": descripcion, "bucket": self.bucket,
+                      "fileNamePrefix": f"{self.prefijo}/{descripcion}", "region": region,
+                      "scale": self.escala, "maxPixels": self.max_pixeles, "fileFormat": "GeoTIFF"}
+        if self.crs is not None:
+            parametros["crs"] = self.crs
+        if self.dimensiones_archivo is not None:
+            parametros["fileDimensions"] = self.dimensiones_archivo
+        tarea = ee.batch.Export.image.toCloudStorage(**parametros)
+        tarea.start()
+        return tarea.id
+
+    def exportar_tabla(self, coleccion, descripcion):
+        """Lanza un Export.table (GeoJSON, con la misma estructura que getInfo) y devuelve su id."""
+        import ee
+
+        tarea = ee.batch.Export.table.toCloudStorage(
+            collection=coleccion, description=descripcion, bucket=self.bucket,
+            fileNamePrefix=f"{self.prefijo}/{descripcion}", fileFormat="GeoJSON")
+        tarea.start()
+        return tarea.id
+
+    def estado(self, id_tarea):
+        import ee
+
+        return ee.data.getTaskStatus(id_tarea)[0]
+
+    def descargar(self, descripcion, destino):
+        """Descarga los archivos de una tarea terminada a `destino` y devuelve sus rutas."""
+        from google.cloud import storage
+
+        destino = Path(destino)
+        destino.mkdir(parents=True, exist_ok=True)
+        rutas = []
+        for blob in storage.Client().list_blobs(self.bucket, prefix=f"{self.prefijo}/{descripcion}"):
+            ruta = destino / Path(blob.name).name
+            blob.download_to_filename(ruta)
+            rutas.append(ruta)
+        return sorted(rutas)
+
+
+class ServicioSimulado:
+    """
+    Servicio de tareas falso para pruebas, con la misma interfaz que ServicioTareasEE. Cada tarea
+    pasa por READY y RUNNING y termina tras `sondeos` consultas de estado; `fallos` ({descripcion: n})
+    hace fallar las n primeras tareas con esa descripción y `latencia` simula el tiempo de cada consulta.
+    Las imágenes se escriben como GeoTIFF partidos en teselas de `tesela` píxeles, igual que un
+    Export.image grande; sus datos salen de `generador(descripcion, num_bandas)` o, por defecto, de
+    números aleatorios deterministas por descripción. Las tablas son el getInfo de la colección.
+    """
+
+    def __init__(self, forma=(64, 64), tesela=32, sondeos=3, fallos=None, latencia=0.0, generador=None,
+                 directorio=None):
+        self.forma = tuple(forma)
+        self.tesela = tesela
+        self.sondeos = sondeos
+        self.fallos = dict(fallos or {})
+        self.latencia = latencia
+        self.generador = generador
+        self.directorio = Path(directorio or tempfile.mkdtemp(prefix="tareas_simuladas_"))
+        self.tareas = {}
+        self.consultas = 0
+        self._candado = threading.Lock()
+
+    def _registrar(self, descripcion, escribir):
+        with self._candado:
+            id_tarea = f"SIM{len(self.tareas):06d}"
+            fallar = self.fallos.get(descripcion, 0) > 0
+            if fallar:
+                self.fallos[descripcion] -= 1
+            self.tareas[id_tarea] = {"descripcion": descripcion, "consultas": 0, "fallar": fallar,
+                                     "escribir": escribir}
+        return id_tarea
+
+    def exportar_imagen(self, imagen, descripcion, region, num_bandas=1):
+        return self._registrar(descripcion, lambda carpeta: self._escribir_teselas(descripcion, num_bandas, carpeta))
+
+    def exportar_tabla(self, coleccion, descripcion):
+        def escribir(carpeta):
+            (carpeta / f"{descripcion}.geojson").write_text(json.dumps(coleccion.getInfo()), encoding="utf-8")
+        return self._registrar(descripcion, escribir)
+
+    def estado(self, id_tarea):
+        time.sleep(self.latencia)
+        with self._candado:
+            self.consultas += 1
+            tarea = self.tareas[id_tarea]
+            tarea["consultas"] += 1
+            if tarea["consultas"] < self.sondeos:
+                return {"id": id_tarea, "state": "READY" if tarea["consultas"] == 1 else "RUNNING"}
+            if tarea["fallar"]:
+                return {"id": id_tarea, "state": "FAILED", "error_message": "Fallo simulado"}
+            escribir, tarea["escribir"] = tarea["escribir"], None
+        if escribir is not None:
+            carpeta = self.directorio / tarea["descripcion"]
+            carpeta.mkdir(parents=True, exist_ok=True)
+            escribir(carpeta)
+        return {"id": id_tarea, "state": "COMPLETED"}
+
+    def descargar(self, descripcion, destino):
+        destino = Path(destino)
+        destino.mkdir(parents=True, exist_ok=True)
+        rutas = []
+        for ruta in sorted((self.directorio / descripcion).iterdir()):
+            shutil.copy(ruta, destino / ruta.name)
+            rutas.append(destino / ruta.name)
+        return rutas
+
+    def _escribir_teselas(self, descripcion, num_bandas, carpeta):
+        import rasterio
+        from rasterio.transform import from_origin
+        from rasterio.windows import Window, transform as transform_ventana
+
+        if self.generador is not None:
+            datos = np.asarray(self.generador(descripcion, num_bandas), dtype=np.float32)
+        else:
+            rng = np.random.default_rng(zlib.crc32(descripcion.encode("utf-8")))
+            datos = rng.normal(0, 0.1, (num_bandas,) + self.forma).astype(np.float32)
+        transform = from_origin(-75.0, 5.0, 0.0025, 0.0025)
+        filas, columnas = datos.shape[1:]
+        # Mismo nombre que las teselas de EE: <prefijo>-<fila inicial>-<columna inicial>.tif
+        for f0 in range(0, filas, self.tesela):
+            for c0 in range(0, columnas, self.tesela):
+                ventana = Window(c0, f0, min(self.tesela, columnas - c0), min(self.tesela, filas - f0))
+                bloque = datos[:, f0:f0 + ventana.height, c0:c0 + ventana.width]
+                with rasterio.open(carpeta / f"{descripcion}-{f0:010d}-{c0:010d}.tif", "w", driver="GTiff",
+                                   height=bloque.shape[1], width=bloque.shape[2], count=num_bandas,
+                                   dtype="float32", crs="EPSG:4326", nodata=np.nan,
+                                   transform=transform_ventana(ventana, transform)) as dst:
+                    dst.write(bloque)
+
+
+def descripcion_tarea(nombre, *objetos):
+    """
+    Descripción de una tarea: el nombre del producto y un resumen del grafo de los objetos EE. La
+    misma expresión (imagen, región) da la misma descripción, así que una tarea se reconoce al reanudar.
+    """
+    resumen = hashlib.sha1("".join(objeto.serialize() for objeto in objetos).encode("utf-8")).hexdigest()[:16]
+    return f"{nombre}_{resumen}"
+
+
+async def _seguir_tarea(servicio, id_tarea, espera, espera_max, factor, limite):
+    """Consulta una tarea hasta que termina, con espera exponencial entre consultas."""
+    inicio = time.monotonic()
+    pausa = espera
+    while True:
+        # La consulta de estado es bloqueante (HTTP); corre en un hilo para no frenar a las demás
+        estado = await asyncio.to_thread(servicio.estado, id_tarea)
+        if estado["state"] in ESTADOS_FINALES:
+            return estado
+        if limite is not None and time.monotonic() - inicio + pausa > limite:
+            raise TimeoutError(f"La tarea {id_tarea} sigue en {estado['state']} tras {limite} s")
+        await asyncio.sleep(pausa)
+        pausa = min(pausa * factor, espera_max)
+
+
+async def esperar_tareas(servicio, ids, espera=2.0, espera_max=60.0, factor=2.0, limite=None):
+    """Sigue varias tareas a la vez sin bloquear el bucle de eventos. Devuelve {id: estado final}."""
+    estados = await asyncio.gather(*(_seguir_tarea(servicio, id_tarea, espera, espera_max, factor, limite)
+                                     for id_tarea in ids))
+    return dict(zip(ids, estados))
+
+
+def esperar(servicio, ids, **sondeo):
+    """
+    Versión síncrona de esperar_tareas. Dentro de Jupyter ya hay un bucle de eventos en marcha, así
+    que en ese caso el sondeo corre en un hilo aparte con su propio bucle.
+    """
+    corrutina = esperar_tareas(servicio, list(ids), **sondeo)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(corrutina)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, corrutina).result()
+
+
+def _completar_tarea(servicio, almacen, clave, descripcion, enviar, sondeo):
+    """
+    Lanza (o retoma) la tarea `descripcion` y espera a que termine. El id queda anotado en el estado
+    `clave` del almacén, así que si el proceso se interrumpe la siguiente llamada sigue esperando la
+    misma tarea en lugar de lanzarla otra vez. Una tarea fallida o cancelada se vuelve a lanzar.
+    """
+    estado = almacen.leer_estado(clave) or {}
+    if estado.get("descripcion") != descripcion or estado.get("state") in ("FAILED", "CANCELLED"):
+        estado = {"descripcion": descripcion, "id": enviar(), "state": "READY", "ensamblado": False}
+        almacen.guardar_estado(clave, estado)
+    if estado["state"] != "COMPLETED":
+        final = esperar(servicio, [estado["id"]], **sondeo)[estado["id"]]
+        estado["state"] = final["state"]
+        almacen.guardar_estado(clave, estado)
+        if final["state"] != "COMPLETED":
+            raise RuntimeError(f"La tarea {descripcion} terminó en {final['state']}: "
+                               f"{final.get('error_message', 'sin detalle')}")
+    return estado
+
+
+def _borrar_descargas(descargas):
+    shutil.rmtree(descargas, ignore_errors=True)
+    if descargas.parent.exists() and not any(descargas.parent.iterdir()):
+        descargas.parent.rmdir()
+
+
+def exportar_imagen(servicio, imagen, region, almacen, nombre, bandas, years=None, descripcion=None, **sondeo):
+    """
+    Exporta una imagen de EE y la guarda en el almacén como el producto `nombre`. Con `years` la
+    imagen trae len(years) × len(bandas) bandas en orden año-banda (p. ej. coleccion.toBands()) y se
+    guarda como colección; sin ellos, como imagen con `bandas`. `sondeo` son los parámetros de
+    esperar_tareas (espera, espera_max, factor, limite). Si el producto ya se ensambló con la misma
+    descripción, se devuelve sin tocar EE.
+    """
+    descripcion = descripcion or descripcion_tarea(nombre, imagen, region)
+    clave = f"exportacion_{nombre}"
+    estado = almacen.leer_estado(clave) or {}
+    if estado.get("descripcion") == descripcion and estado.get("ensamblado") and almacen.existe(nombre):
+        return almacen.abrir(nombre)
+
+    num_bandas = len(bandas) * (len(years) if years is not None else 1)
+    estado = _completar_tarea(servicio, almacen, clave, descripcion,
+                              lambda: servicio.exportar_imagen(imagen, descripcion, region, num_bandas), sondeo)
+    descargas = almacen.directorio / "descargas" / descripcion
+    producto = ensamblar_teselas(servicio.descargar(descripcion, descargas), almacen, nombre, bandas, years)
+    _borrar_descargas(descargas)
+    estado["ensamblado"] = True
+    almacen.guardar_estado(clave, estado)
+    return producto
+
+
+def info_por_exportacion(servicio, coleccion, almacen, nombre="tabla", descripcion=None, **sondeo):
+    """
+    Equivalente a coleccion.getInfo() por medio de un Export.table en GeoJSON. El resultado queda
+    en el almacén (`nombre`.geojson) y se reutiliza mientras la expresión no cambie.
+    """
+    descripcion = descripcion or descripcion_tarea(nombre, coleccion)
+    clave = f"exportacion_{nombre}"
+    ruta = almacen.directorio / f"{nombre}.geojson"
+    estado = almacen.leer_estado(clave) or {}
+    if estado.get("descripcion") == descripcion and estado.get("ensamblado") and ruta.exists():
+        return json.loads(ruta.read_text(encoding="utf-8"))
+
+    estado = _completar_tarea(servicio, almacen, clave, descripcion,
+                              lambda: servicio.exportar_tabla(coleccion, descripcion), sondeo)
+    descargas = almacen.directorio / "descargas" / descripcion
+    features = []
+    for archivo in servicio.descargar(descripcion, descargas):
+        features.extend(json.loads(Path(archivo).read_text(encoding="utf-8")).get("features", []))
+    _borrar_descargas(descargas)
+    info = {"type": "FeatureCollection", "features": features}
+    ruta.write_text(json.dumps(info), encoding="utf-8")
+    estado["ensamblado"] = True
+    almacen.guardar_estado(clave, estado)
+    return info
+
+
+def ensamblar_teselas(rutas, almacen, nombre, bandas, years=None):
+    """
+    Une las teselas GeoTIFF de una exportación en el producto `nombre` del almacén. La posición de
+    cada tesela sale de su transform; se copia banda a banda, así que en memoria solo hay una banda
+    de una tesela a la vez. Devuelve el producto abierto (ColeccionLocal con `years`, si no ImagenLocal).
+    """
+    import rasterio
+    from affine import Affine
+
+    if not rutas:
+        raise ValueError(f"La exportación de '{nombre}' no produjo archivos.")
+    perfiles = []
+    for ruta in rutas:
+        with rasterio.open(ruta) as src:
+            perfiles.append((ruta, src.transform, src.height, src.width, src.count, src.crs))
+
+    referencia, crs = perfiles[0][1], perfiles[0][5]
+    x0 = min(t.c for _, t, *_ in perfiles)
+    y0 = max(t.f for _, t, *_ in perfiles)
+    posiciones = [(int(round((t.f - y0) / referencia.e)), int(round((t.c - x0) / referencia.a)))
+                  for _, t, *_ in perfiles]
+    filas = max(f0 + alto for (f0, _), (_, _, alto, *_) in zip(posiciones, perfiles))
+    columnas = max(c0 + ancho for (_, c0), (_, _, _, ancho, *_) in zip(posiciones, perfiles))
+
+    num_bandas = len(bandas) * (len(years) if years is not None else 1)
+    for ruta, _, _, _, cuenta, _ in perfiles:
+        if cuenta != num_bandas:
+            raise ValueError(f"{Path(ruta).name} tiene {cuenta} bandas y se esperaban {num_bandas}.")
+
+    transform = Affine(referencia.a, 0.0, x0, 0.0, referencia.e, y0)
+    georef = {"crs": crs.to_wkt(), "transform": list(transform)[:6]}
+    forma = ((len(years), len(bandas)) if years is not None else (len(bandas),)) + (filas, columnas)
+    datos = almacen.crear(nombre, forma, bandas, years, georef)
+    for (ruta, _, alto, ancho, _, _), (f0, c0) in zip(perfiles, posiciones):
+        with rasterio.open(ruta) as src:
+            for indice in range(num_bandas):
+                bloque = src.read(indice + 1, masked=True).astype(np.float32).filled(np.nan)
+                destino = datos[divmod(indice, len(bandas))] if years is not None else datos[indice]
+                destino[f0:f0 + alto, c0:c0 + ancho] = bloque
+    datos.flush()
+    del datos
+    return almacen.abrir(nombre)
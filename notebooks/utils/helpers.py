@@ -1,4 +1,6 @@
 def listar_bandas(coleccion_id):
+    import ee
+
     # Obtiene la primera imagen de la colección especificada por ID
     img = ee.ImageCollection(coleccion_id).first()
 
@@ -11,7 +13,42 @@ def listar_bandas(coleccion_id):
     print('-' * 50)
 
 
+class PlanRemuestreo:
+    """
+    Rejilla de destino de una colección, sin reproject por imagen. La proyección queda registrada y
+    se aplica una sola vez donde se reduce o exporta (aplicar / argumentos); así EE calcula en la
+    rejilla pedida en vez de forzar cada imagen a la escala MODIS. Las bandas gruesas (CHIRPS,
+    ~5 km) se dejan en su rejilla nativa y se interpolan con `metodo` al leerlas en la de destino.
+    """
+
+    def __init__(self, proyeccion, metodo='bilinear', escala=None):
+        self.proyeccion = proyeccion
+        self.metodo = metodo
+        self.escala = escala
+
+    def aplicar(self, imagen):
+        """Fija la rejilla de destino (setDefaultProjection, sin recalcular píxeles)."""
+        import ee
+        return ee.Image(imagen).setDefaultProjection(self.proyeccion)
+
+    def interpolar(self, imagen, proyeccion_nativa):
+        """Banda gruesa: se calcula en su rejilla nativa y se remuestrea al pedirla en otra."""
+        import ee
+        return ee.Image(imagen).setDefaultProjection(proyeccion_nativa).resample(self.metodo)
+
+    def argumentos(self):
+        """crs (y scale, si se indicó) para reduceRegion, sample o las exportaciones."""
+        argumentos = {'crs': self.proyeccion}
+        if self.escala is not None:
+            argumentos['scale'] = self.escala
+        return argumentos
+
+
 def reproyectar_imagenes(coleccion, proyeccion):
-    # Aplica reproyección a cada imagen de la colección usando la proyección proporcionada
+    """
+    Reproyecta cada imagen de la colección a `proyeccion` (reproject por imagen). Para la colección
+    NDVI + precipitación es más barato coleccion_ndvi_precip(years, aoi, remuestreo=PlanRemuestreo(...)),
+    que no fuerza cada imagen a la rejilla y aplica la proyección solo al reducir o exportar.
+    """
     return coleccion.map(lambda img: img.reproject(proyeccion))
 
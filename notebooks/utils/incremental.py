@@ -0,0 +1,245 @@
+# --- Actualización incremental año a año sobre el almacén de cubos ---
+from pathlib import Path
+
+import numpy as np
+
+ESTADO = "incremental"
+PENDIENTE = "incremental_pendiente"   # Año que se está agregando, hasta que se confirma en ESTADO
+
+
+def _ya_guardado(datos, almacen, nombre):
+    """True si `datos` es el memmap del producto `nombre` de este almacén (no hace falta volver a guardarlo)."""
+    archivo = getattr(datos, "filename", None)
+    return archivo is not None and Path(archivo).resolve() == (almacen.directorio / f"{nombre}.npy").resolve()
+
+
+def _bloques_de_pixeles(num_pixeles, bloque_pixeles):
+    for inicio in range(0, num_pixeles, bloque_pixeles):
+        yield slice(inicio, min(inicio + bloque_pixeles, num_pixeles))
+
+
+def _ruta_diario(almacen):
+    # Columnas de 'fitted' (años anteriores) de los píxeles que se re-segmentan, para poder restaurarlas
+    return almacen.directorio / f"{PENDIENTE}.npz"
+
+
+def _deshacer_parcial(almacen, estado):
+    """
+    Deja el almacén como lo describe `estado` si un agregar_year_incremental anterior se interrumpió:
+    restaura las columnas de 'fitted' ya re-segmentadas, corta los años agregados a 'coleccion' y
+    'fitted' y borra las sumas a medio escribir. Si el año sí llegó a confirmarse, solo limpia.
+    """
+    pendiente = almacen.leer_estado(PENDIENTE)
+    longitud = len(estado["years"])
+    confirmado = pendiente is not None and pendiente["year"] in estado["years"]
+    diario = _ruta_diario(almacen)
+
+    if pendiente is not None and not confirmado:
+        if diario.exists() and almacen.existe("fitted"):
+            with np.load(diario) as guardado:
+                fitted = almacen.abrir("fitted", modo="r+").datos
+                plano = fitted.reshape(fitted.shape[0], -1)
+                plano[:longitud, guardado["indices"]] = guardado["columnas"]
+                fitted.flush()
+                del fitted, plano
+        if pendiente.get("sumas"):
+            almacen.borrar(pendiente["sumas"])
+        print(f"↩️ Se deshizo el agregado incompleto de {pendiente['year']}")
+    elif confirmado and pendiente.get("sumas_previas"):
+        almacen.borrar(pendiente["sumas_previas"])
+
+    # Un año agregado sin confirmar (también de versiones sin PENDIENTE) se corta por el final
+    for nombre in ("coleccion", "fitted"):
+        if almacen.existe(nombre) and almacen.metadatos(nombre)["forma"][0] > longitud:
+            almacen.truncar(nombre, longitud)
+    diario.unlink(missing_ok=True)
+    almacen.borrar_estado(PENDIENTE)
+
+
+def iniciar_incremental(coleccion, almacen, mascara=None, modo="global", tamano_tesela=256, procesos=None,
+                        bloque_pixeles=250000, **parametros_landtrendr):
+    """
+    Prepara el almacén para actualizarlo año a año. Guarda la colección ('coleccion'), la máscara,
+    las sumas suficientes de la regresión NDVI ~ precipitación y la pila fitted completa ('fitted',
+    calculada con ejecutar_por_teselas). Con modo="global" las sumas son las del AOI por año;
+    con modo="pixel", las de utils.regression.SUMAS para cada píxel (producto 'sumas').
+    """
+    from utils.processing import ajustar_ndvi_precip, sumas_anuales_local, valores_desde_sumas
+    from utils.regression import SUMAS, sumas_regresion
+    from utils.tiling import dividir_en_teselas, ejecutar_por_teselas
+
+    # Un agregado pendiente de un estado anterior no aplica al que se va a crear
+    _ruta_diario(almacen).unlink(missing_ok=True)
+    almacen.borrar_estado(PENDIENTE)
+    if not _ya_guardado(coleccion.datos, almacen, "coleccion"):
+        coleccion = almacen.guardar("coleccion", coleccion)
+    if mascara is not None:
+        guardada = almacen.crear("mascara", (1,) + tuple(coleccion.forma), ["mascara"], georef=coleccion.georef,
+                                 dtype=np.uint8, relleno=None)
+        guardada[0] = mascara
+        guardada.flush()
+        del guardada
+
+    estado = {"modo": modo, "years": coleccion.years, "parametros_landtrendr": parametros_landtrendr}
+    filas, columnas = coleccion.forma
+    if modo == "global":
+        sumas = np.zeros((2, 2, len(coleccion.years)))
+        for fs, cs in dividir_en_teselas(filas, columnas, tamano_tesela):
+            sumas += sumas_anuales_local(coleccion.ventana(fs, cs), None if mascara is None else mascara[fs, cs])
+        pendiente, intercepto = ajustar_ndvi_precip(valores_desde_sumas(coleccion.years, sumas))
+        estado.update(sumas_aoi=sumas.tolist(), pendiente=float(pendiente), intercepto=float(intercepto))
+    else:
+        sumas = almacen.crear("sumas", (len(SUMAS), filas, columnas), SUMAS, georef=coleccion.georef,
+                              dtype=np.float64, relleno=None)
+        x = coleccion.banda("precip").reshape(len(coleccion.years), -1)
+        y = coleccion.banda("greenness").reshape(len(coleccion.years), -1)
+        plano = sumas.reshape(len(SUMAS), -1)
+        fuera = None if mascara is None else ~np.asarray(mascara).reshape(-1)
+        for bloque in _bloques_de_pixeles(x.shape[1], bloque_pixeles):
+            xb = x[:, bloque].astype(np.float64)
+            if fuera is not None:
+                xb[:, fuera[bloque]] = np.nan
+            plano[:, bloque] = sumas_regresion(xb, y[:, bloque])
+        sumas.flush()
+        del sumas, plano
+
+    ejecutar_por_teselas(coleccion, mascara, tamano_tesela=tamano_tesela, procesos=procesos, modo=modo,
+                         almacen=almacen, nombre="fitted", **parametros_landtrendr)
+    almacen.guardar_estado(ESTADO, estado)
+    return almacen.abrir("fitted")
+
+
+def agregar_year_incremental(almacen, composicion, year=None, tolerancia=0.02, bloque_pixeles=250000):
+    """
+    Agrega un año nuevo sin recalcular los anteriores. `composicion` es la ImagenLocal
+    ['greenness', 'precip'] del año (p. ej. de utils.ingest.combinar_year_local) en la rejilla del almacén.
+
+    1. El compuesto se añade al final de 'coleccion' (solo se escriben los bytes del año nuevo).
+    2. Las sumas suficientes se actualizan sumando las del año: O(1) por píxel (o por año en modo global).
+    3. Un píxel se vuelve a segmentar con LandTrendr solo si el nuevo ajuste mueve alguno de sus residuos
+       más de `tolerancia` o si el residuo del año nuevo se aparta más de `tolerancia` de la prolongación
+       de su último segmento. Para el resto, el fitted del año nuevo es esa prolongación y se conserva su
+       segmentación anterior (una aproximación: con tolerancia=0 se re-segmenta casi todo y el resultado
+       coincide con el cálculo completo).
+
+    El año solo cuenta como agregado cuando se guarda el estado al final: si el proceso se corta antes,
+    la siguiente llamada deshace lo que quedó a medias (_deshacer_parcial) y lo vuelve a agregar.
+
+    Devuelve la pila 'fitted' actualizada (propiedad 'reprocesados' = píxeles re-segmentados).
+    """
+    from utils.local import ColeccionLocal
+    from utils.processing import ajustar_ndvi_precip, ejecutar_landtrendr, sumas_anuales_local, valores_desde_sumas
+    from utils.regression import coeficientes_desde_sumas, sumas_regresion
+
+    estado = almacen.leer_estado(ESTADO)
+    if estado is None:
+        raise ValueError("El almacén no tiene estado incremental; ejecute antes iniciar_incremental.")
+    _deshacer_parcial(almacen, estado)
+    year = int(composicion.propiedades["year"] if year is None else year)
+    anteriores = estado["years"]
+    if year <= anteriores[-1]:
+        raise ValueError(f"El año {year} no es posterior al último procesado ({anteriores[-1]}).")
+    if len(anteriores) < 2:
+        raise ValueError("Se necesitan al menos dos años procesados para prolongar el último segmento.")
+
+    mascara = almacen.abrir("mascara").datos[0].astype(bool) if almacen.existe("mascara") else None
+    nuevo = np.asarray(composicion.select(["greenness", "precip"]).datos, dtype=np.float32)
+    if mascara is not None:
+        nuevo = np.where(mascara, nuevo, np.nan)
+    pixel = estado["modo"] == "pixel"
+    # Las sumas nuevas van a otro producto; el estado apunta a él solo cuando el año se confirma
+    sumas_previas = estado.get("sumas", "sumas")
+    pendiente_estado = {"year": year, "sumas": f"sumas_{year}" if pixel else None,
+                        "sumas_previas": sumas_previas if pixel else None}
+    almacen.guardar_estado(PENDIENTE, pendiente_estado)
+    almacen.agregar("coleccion", nuevo, year=year)
+    years = anteriores + [year]
+
+    # Coeficientes antes y después de sumar el año
+    if pixel:
+        from utils.regression import SUMAS
+
+        previas_todas = almacen.abrir(sumas_previas).datos
+        nuevas = almacen.crear(pendiente_estado["sumas"], previas_todas.shape, SUMAS,
+                               georef=almacen.metadatos(sumas_previas)["georef"], dtype=np.float64, relleno=None)
+        previas_todas = previas_todas.reshape(len(SUMAS), -1)
+        sumas = nuevas.reshape(len(SUMAS), -1)
+    else:
+        sumas_year = sumas_anuales_local(ColeccionLocal(nuevo[None], [year], ["greenness", "precip"]))
+        sumas_aoi = np.concatenate([np.asarray(estado["sumas_aoi"]), sumas_year], axis=2)
+        pendiente, intercepto = ajustar_ndvi_precip(valores_desde_sumas(years, sumas_aoi))
+        delta_pendiente = pendiente - estado["pendiente"]
+        delta_intercepto = intercepto - estado["intercepto"]
+
+    coleccion = almacen.abrir("coleccion")
+    x = coleccion.banda("precip").reshape(len(years), -1)
+    y = coleccion.banda("greenness").reshape(len(years), -1)
+    fitted = almacen.abrir("fitted").datos.reshape(len(anteriores), -1)
+    prolongacion = np.empty(x.shape[1], dtype=np.float32)
+    afectados = []
+
+    for bloque in _bloques_de_pixeles(x.shape[1], bloque_pixeles):
+        xb = x[:, bloque].astype(np.float64)
+        yb = y[:, bloque].astype(np.float64)
+        if pixel:
+            previas = np.array(previas_todas[:, bloque])
+            p0, i0, _ = coeficientes_desde_sumas(previas)
+            sumas[:, bloque] = previas + sumas_regresion(xb[-1:], yb[-1:])
+            pendiente, intercepto, _ = coeficientes_desde_sumas(sumas[:, bloque])
+            delta_pendiente, delta_intercepto = pendiente - p0, intercepto - i0
+
+        # Cambio de los residuos ya segmentados por el nuevo ajuste
+        with np.errstate(invalid="ignore"):
+            cambio = np.abs(delta_pendiente * xb[:-1] + delta_intercepto)
+        cambio = np.where(np.isnan(cambio), 0, cambio).max(axis=0)
+
+        # Prolongación del último segmento hasta el año nuevo
+        ultimo, penultimo = fitted[-1, bloque], fitted[-2, bloque]
+        paso = (year - anteriores[-1]) / (anteriores[-1] - anteriores[-2])
+        prolongacion[bloque] = ultimo + (ultimo - penultimo) * paso
+        residual_nuevo = yb[-1] - (pendiente * xb[-1] + intercepto)
+        with np.errstate(invalid="ignore"):
+            aparte = np.abs(residual_nuevo - prolongacion[bloque]) > tolerancia
+        aparte |= np.isnan(prolongacion[bloque]) & ~np.isnan(residual_nuevo)
+        afectado = (cambio > tolerancia) | aparte
+        if mascara is not None:
+            afectado &= mascara.reshape(-1)[bloque]
+        afectados.append(np.flatnonzero(afectado) + bloque.start)
+
+    afectados = np.concatenate(afectados)
+    # Diario: lo que se va a sobrescribir en los años anteriores, por si hay que deshacerlo
+    np.savez(_ruta_diario(almacen), indices=afectados, columnas=np.asarray(fitted[:, afectados]))
+    del fitted
+    almacen.agregar("fitted", prolongacion.reshape(coleccion.forma), banda=f"fittedResidual_{year}")
+
+    # Re-segmentación de los píxeles afectados con la serie completa
+    fitted = almacen.abrir("fitted", modo="r+").datos.reshape(len(years), -1)
+    for inicio in range(0, len(afectados), bloque_pixeles):
+        indices = afectados[inicio:inicio + bloque_pixeles]
+        xb = x[:, indices].astype(np.float64)
+        yb = y[:, indices].astype(np.float64)
+        if pixel:
+            pendiente_b, intercepto_b, _ = coeficientes_desde_sumas(sumas[:, indices])
+        else:
+            pendiente_b, intercepto_b = pendiente, intercepto
+        residual = (yb - (pendiente_b * xb + intercepto_b)).astype(np.float32)
+        lt = ejecutar_landtrendr(residual[:, :, None], years=years, **estado["parametros_landtrendr"])
+        fitted[:, indices] = lt.datos[2, :, :, 0]
+    fitted.flush()
+    del fitted
+    if pixel:
+        nuevas.flush()
+        del sumas, nuevas, previas_todas
+        estado["sumas"] = pendiente_estado["sumas"]
+
+    # Confirmación: el estado se reemplaza de una vez; después solo queda limpiar
+    estado["years"] = years
+    if not pixel:
+        estado.update(sumas_aoi=sumas_aoi.tolist(), pendiente=float(pendiente), intercepto=float(intercepto))
+    almacen.guardar_estado(ESTADO, estado)
+    _deshacer_parcial(almacen, estado)
+    print(f"✅ {year}: {len(afectados)} de {x.shape[1]} píxeles re-segmentados")
+
+    resultado = almacen.abrir("fitted")
+    resultado.propiedades["reprocesados"] = int(len(afectados))
+    return resultado
@@ -0,0 +1,381 @@
+# --- Ingesta local de MOD13Q1 y CHIRPS: cubo anual 'greenness'/'precip' sin Earth Engine ---
+import re
+from pathlib import Path
+
+import numpy as np
+
+_PATRON_MODIS = re.compile(r"\.A(\d{4})(\d{3})")                  # MOD13Q1.A2001001.h10v08...
+_PATRON_FECHA = re.compile(r"(\d{4})[._-]?(\d{2})[._-]?(\d{2})")  # chirps-v2.0.2001.01.01.tif
+_EXTENSIONES_NETCDF = {".nc", ".nc4", ".cdf"}
+
+
+def _fecha_de_archivo(ruta):
+    """Fecha de un raster según su nombre: (año, día juliano) o (año, mes, día); None si no tiene."""
+    nombre = Path(ruta).name
+    coincidencia = _PATRON_MODIS.search(nombre) or _PATRON_FECHA.search(nombre)
+    return tuple(int(g) for g in coincidencia.groups()) if coincidencia else None
+
+
+def year_de_archivo(ruta):
+    """Año de un raster diario o de 16 días según su nombre (None si no tiene fecha)."""
+    fecha = _fecha_de_archivo(ruta)
+    return fecha[0] if fecha else None
+
+
+def cortes_del_year(archivos, year, aoi=None, variable=None):
+    """
+    Recorre uno a uno los cortes temporales de un año. GeoTIFF: un archivo por fecha y tile (la
+    fecha sale del nombre), ordenados por fecha. NetCDF: se recorre la dimensión 'time'. Si hay AOI
+    solo se lee la ventana que lo cubre y se saltan los rasters que no lo tocan. Produce tuplas
+    (arreglo 2D float64 con NaN donde no hay dato, transform, crs, fecha).
+    """
+    geotiffs = []
+    for ruta in archivos:
+        if Path(ruta).suffix.lower() in _EXTENSIONES_NETCDF:
+            yield from _cortes_netcdf(ruta, year, aoi, variable)
+        elif year_de_archivo(ruta) == year:
+            geotiffs.append((_fecha_de_archivo(ruta), ruta))
+    for fecha, ruta in sorted(geotiffs, key=lambda par: par[0]):
+        leido = _leer_geotiff(ruta, aoi)
+        if leido is not None:
+            yield leido + (fecha,)
+
+
+def _limites(aoi, crs):
+    """Límites (xmin, ymin, xmax, ymax) del AOI (GeoDataFrame o GeoSeries) en el CRS indicado."""
+    return aoi.to_crs(crs).total_bounds
+
+
+def _ventana_aoi(src, aoi):
+    """Ventana del raster abierto que cubre el AOI; None sin AOI o si el AOI no toca el raster."""
+    from rasterio.windows import Window
+
+    if aoi is None:
+        return None
+    xmin, ymin, xmax, ymax = _limites(aoi, src.crs)
+    f0, c0 = src.index(xmin, ymax)
+    f1, c1 = src.index(xmax, ymin)
+    if f1 < 0 or c1 < 0 or f0 >= src.height or c0 >= src.width:
+        return False
+    f0, c0 = max(f0, 0), max(c0, 0)
+    f1, c1 = min(f1, src.height - 1), min(c1, src.width - 1)
+    return Window(c0, f0, c1 - c0 + 1, f1 - f0 + 1)
+
+
+def _leer_geotiff(ruta, aoi=None):
+    """(arreglo, transform, crs) de la ventana del AOI; None si el AOI no toca el raster (otra tile)."""
+    import rasterio
+
+    with rasterio.open(ruta) as src:
+        ventana = _ventana_aoi(src, aoi)
+        if ventana is False:
+            return None
+        datos = src.read(1, window=ventana, masked=True).astype(np.float64).filled(np.nan)
+        transform = src.window_transform(ventana) if ventana is not None else src.transform
+        return datos, transform, src.crs
+
+
+def _cortes_netcdf(ruta, year, aoi=None, variable=None):
+    import xarray as xr
+    from rasterio.crs import CRS
+    from rasterio.transform import from_origin
+
+    with xr.open_dataset(ruta) as ds:
+        datos = ds[variable or next(iter(ds.data_vars))]
+        if year is not None:
+            datos = datos.isel(time=(datos["time"].dt.year == year).values)
+        lon = "longitude" if "longitude" in datos.dims else "lon"
+        lat = "latitude" if "latitude" in datos.dims else "lat"
+
+        # CHIRPS en NetCDF viene en coordenadas geográficas; se recorta a los límites del AOI
+        if aoi is not None:
+            xmin, ymin, xmax, ymax = _limites(aoi, "EPSG:4326")
+            datos = datos.isel({
+                lon: ((datos[lon] >= xmin) & (datos[lon] <= xmax)).values,
+                lat: ((datos[lat] >= ymin) & (datos[lat] <= ymax)).values,
+            })
+            if datos.sizes[lon] == 0 or datos.sizes[lat] == 0:
+                return  # el AOI no toca este archivo
+
+        # Las filas se ordenan de norte a sur, como en un GeoTIFF
+        invertir = datos[lat].values[0] < datos[lat].values[-1]
+        paso_x = float(abs(datos[lon].values[1] - datos[lon].values[0]))
+        paso_y = float(abs(datos[lat].values[1] - datos[lat].values[0]))
+        transform = from_origin(float(datos[lon].values.min()) - paso_x / 2,
+                                float(datos[lat].values.max()) + paso_y / 2, paso_x, paso_y)
+
+        for i in range(datos.sizes["time"]):
+            corte = datos.isel(time=i).values.astype(np.float64)
+            yield (corte[::-1] if invertir else corte), transform, CRS.from_epsg(4326), datos["time"].values[i]
+
+
+def _misma_malla(transform, crs, transform_ref, crs_ref):
+    """True si las dos rejillas comparten CRS, resolución y alineación de píxeles (como dos tiles MODIS)."""
+    if crs != crs_ref or not np.allclose([transform.a, transform.b, transform.d, transform.e],
+                                         [transform_ref.a, transform_ref.b, transform_ref.d, transform_ref.e]):
+        return False
+    columna = (transform.c - transform_ref.c) / transform_ref.a
+    fila = (transform.f - transform_ref.f) / transform_ref.e
+    return abs(columna - round(columna)) < 1e-3 and abs(fila - round(fila)) < 1e-3
+
+
+def _desplazamiento(transform, transform_ref):
+    """(fila, columna) de la esquina de `transform` en una rejilla de la misma malla."""
+    return (round((transform.f - transform_ref.f) / transform_ref.e),
+            round((transform.c - transform_ref.c) / transform_ref.a))
+
+
+def _union_rejillas(forma, transform, forma_otra, transform_otra):
+    """
+    Rejilla de la misma malla que cubre las dos. Devuelve (forma, transform, arriba, izquierda), donde
+    (arriba, izquierda) es la posición de la rejilla original dentro de la nueva.
+    """
+    from rasterio.transform import Affine
+
+    fila, columna = _desplazamiento(transform_otra, transform)
+    arriba, izquierda = max(-fila, 0), max(-columna, 0)
+    forma_union = (max(forma[0], fila + forma_otra[0]) + arriba, max(forma[1], columna + forma_otra[1]) + izquierda)
+    return forma_union, transform * Affine.translation(-izquierda, -arriba), arriba, izquierda
+
+
+def _ampliar(arreglo, forma, arriba, izquierda, relleno):
+    ampliado = np.full(forma, relleno, dtype=arreglo.dtype)
+    ampliado[arriba:arriba + arreglo.shape[0], izquierda:izquierda + arreglo.shape[1]] = arreglo
+    return ampliado
+
+
+def _acumular(cortes, operacion, transformar=None):
+    """
+    Máximo o suma por fechas de los cortes sin guardarlos. Los cortes de una misma fecha (las tiles
+    de MOD13Q1) se unen antes en un mosaico, y después se combinan las fechas; en memoria solo están
+    el corte actual, el mosaico de su fecha y los acumuladores. La rejilla es la del primer corte,
+    ampliada cuando llega otra tile de la misma malla; un corte con otro CRS o resolución se
+    remuestrea a ella. Devuelve (arreglo, transform, crs) o None si el año no tiene cortes.
+    """
+    acumulado = hay_dato = mosaico = None
+    transform_ref = crs_ref = fecha_actual = None
+
+    def combinar(mosaico):
+        validos = ~np.isnan(mosaico)
+        np.logical_or(hay_dato, validos, out=hay_dato)
+        if operacion == "max":
+            np.fmax(acumulado, mosaico, out=acumulado)
+        else:
+            np.add(acumulado, np.where(validos, mosaico, 0), out=acumulado)
+
+    for corte, transform, crs, fecha in cortes:
+        if transformar is not None:
+            corte = transformar(corte)
+        if acumulado is not None and fecha != fecha_actual:
+            combinar(mosaico)
+            mosaico = None
+        fecha_actual = fecha
+
+        if acumulado is None:
+            acumulado = np.full(corte.shape, -np.inf if operacion == "max" else 0.0)
+            hay_dato = np.zeros(corte.shape, dtype=bool)
+            transform_ref, crs_ref = transform, crs
+        elif not _misma_malla(transform, crs, transform_ref, crs_ref):
+            corte = llevar_a_rejilla(corte, transform, crs, acumulado.shape, transform_ref, crs_ref, "nearest")
+            transform = transform_ref
+        else:
+            forma, transform_union, arriba, izquierda = _union_rejillas(acumulado.shape, transform_ref,
+                                                                        corte.shape, transform)
+            if forma != acumulado.shape:
+                acumulado = _ampliar(acumulado, forma, arriba, izquierda, -np.inf if operacion == "max" else 0.0)
+                hay_dato = _ampliar(hay_dato, forma, arriba, izquierda, False)
+                if mosaico is not None:
+                    mosaico = _ampliar(mosaico, forma, arriba, izquierda, np.nan)
+                transform_ref = transform_union
+
+        # Se coloca el corte en el mosaico de su fecha (si dos tiles se solapan, gana la primera)
+        fila, columna = _desplazamiento(transform, transform_ref)
+        if mosaico is None and corte.shape == acumulado.shape and (fila, columna) == (0, 0):
+            mosaico = corte
+            continue
+        if mosaico is None:
+            mosaico = np.full(acumulado.shape, np.nan)
+        destino = mosaico[fila:fila + corte.shape[0], columna:columna + corte.shape[1]]
+        np.copyto(destino, corte, where=np.isnan(destino))
+
+    if acumulado is None:
+        return None
+    combinar(mosaico)
+    acumulado[~hay_dato] = np.nan
+    return acumulado, transform_ref, crs_ref
+
+
+def _enmascarar_relleno_modis(corte):
+    # MOD13Q1 usa -3000 como relleno; el rango válido de NDVI escalado es [-2000, 10000]
+    corte[(corte < -2000) | (corte > 10000)] = np.nan
+    return corte
+
+
+def annual_max_ndvi_local(archivos, year, aoi=None, variable=None):
+    """NDVI máximo anual (×0.0001) a partir de compuestos MOD13Q1 locales, corte a corte."""
+    resultado = _acumular(cortes_del_year(archivos, year, aoi, variable), "max", _enmascarar_relleno_modis)
+    if resultado is None:
+        return None
+    maximo, transform, crs = resultado
+    return maximo * 0.0001, transform, crs
+
+
+def annual_precip_local(archivos, year, aoi=None, variable=None):
+    """Precipitación acumulada anual a partir de rasters diarios CHIRPS locales, corte a corte."""
+    return _acumular(cortes_del_year(archivos, year, aoi, variable), "sum")
+
+
+def rejilla_referencia(archivos_ndvi, aoi=None):
+    """
+    Rejilla (forma, transform, crs) de los compuestos MOD13Q1, recortada al AOI. Con varias tiles es
+    la unión de las que tocan el AOI, en la malla de la primera (la misma que arma _acumular).
+    """
+    import rasterio
+
+    rejilla = None
+    for ruta in archivos_ndvi:
+        if Path(ruta).suffix.lower() in _EXTENSIONES_NETCDF:
+            primero = next(_cortes_netcdf(ruta, None, aoi), None)
+            if primero is None:
+                continue
+            forma, transform, crs = primero[0].shape, primero[1], primero[2]
+        else:
+            # Solo se leen los metadatos del GeoTIFF
+            with rasterio.open(ruta) as src:
+                ventana = _ventana_aoi(src, aoi)
+                if ventana is False:
+                    continue
+                forma = (src.height, src.width) if ventana is None else (ventana.height, ventana.width)
+                transform = src.transform if ventana is None else src.window_transform(ventana)
+                crs = src.crs
+        if rejilla is None:
+            rejilla = (forma, transform, crs)
+        elif _misma_malla(transform, crs, rejilla[1], rejilla[2]):
+            forma_union, transform_union, _, _ = _union_rejillas(rejilla[0], rejilla[1], forma, transform)
+            rejilla = (forma_union, transform_union, rejilla[2])
+    if rejilla is None:
+        raise ValueError("No hay archivos MOD13Q1 que toquen el AOI para definir la rejilla de referencia.")
+    return rejilla
+
+
+def llevar_a_rejilla(arreglo, transform, crs, forma, transform_ref, crs_ref, metodo="bilinear"):
+    """Remuestrea un arreglo a la rejilla de referencia (no hace nada si ya está en ella)."""
+    from rasterio.warp import Resampling, reproject
+
+    if arreglo.shape == tuple(forma) and transform == transform_ref and crs == crs_ref:
+        return arreglo
+    destino = np.full(forma, np.nan)
+    reproject(arreglo, destino, src_transform=transform, src_crs=crs, src_nodata=np.nan,
+              dst_transform=transform_ref, dst_crs=crs_ref, dst_nodata=np.nan,
+              resampling=getattr(Resampling, metodo))
+    return destino
+
+
+def alinear_pilas(pendientes, forma, transform_ref, crs_ref, metodo="bilinear"):
+    """
+    Remuestrea de una vez cortes que comparten rejilla de origen. `pendientes` es un dict
+    {(forma, transform, crs): [(clave, arreglo), ...]}; cada grupo se apila y se lleva a la
+    rejilla de referencia con un único reproject (las transformaciones de coordenadas se
+    calculan una sola vez por grupo y no por año). Produce (clave, arreglo remuestreado).
+    """
+    from rasterio.warp import Resampling, reproject
+
+    for (_, transform, crs), cortes in pendientes.items():
+        pila = np.stack([arreglo for _, arreglo in cortes])
+        destino = np.full((len(cortes),) + tuple(forma), np.nan)
+        reproject(pila, destino, src_transform=transform, src_crs=crs, src_nodata=np.nan,
+                  dst_transform=transform_ref, dst_crs=crs_ref, dst_nodata=np.nan,
+                  resampling=getattr(Resampling, metodo))
+        for (clave, _), valores in zip(cortes, destino):
+            yield clave, valores
+
+
+def mascara_aoi(aoi, forma, transform, crs):
+    """Máscara booleana (True dentro del AOI) sobre la rejilla indicada."""
+    from rasterio.features import geometry_mask
+
+    return geometry_mask(list(aoi.to_crs(crs).geometry), out_shape=forma, transform=transform, invert=True)
+
+
+def combinar_ndvi_precip_local(archivos_ndvi, archivos_precip, years, aoi=None, salida=None,
+                               variable_ndvi=None, variable_precip=None, almacen=None, nombre="coleccion"):
+    """
+    Equivalente local de combinar_ndvi_precip para todos los años: arma una ColeccionLocal
+    (años, ['greenness', 'precip'], filas, columnas) en la rejilla MOD13Q1 y recortada al AOI.
+
+    `aoi` es un GeoDataFrame/GeoSeries (o None). La lluvia se suma en su rejilla nativa (~5 km) y
+    los totales anuales se remuestrean juntos a la rejilla de NDVI al final, con un solo reproject
+    por rejilla de origen (alinear_pilas). Los años sin datos quedan en NaN.
+    Con `salida` (ruta .npy) el cubo se escribe en un memmap en lugar de en memoria; con `almacen`
+    (AlmacenCubos) se guarda como el producto `nombre` y se devuelve abierto desde el disco.
+    """
+    from utils.local import ColeccionLocal
+
+    forma, transform_ref, crs_ref = rejilla_referencia(archivos_ndvi, aoi)
+    georef = {"crs": crs_ref.to_wkt(), "transform": list(transform_ref)[:6]}
+    forma_cubo = (len(years), 2) + tuple(forma)
+    if almacen is not None:
+        cubo = almacen.crear(nombre, forma_cubo, ["greenness", "precip"], years, georef)
+    elif salida is None:
+        cubo = np.full(forma_cubo, np.nan, dtype=np.float32)
+    else:
+        cubo = np.lib.format.open_memmap(salida, mode="w+", dtype=np.float32, shape=forma_cubo)
+        cubo[:] = np.nan
+    dentro = None if aoi is None else mascara_aoi(aoi, forma, transform_ref, crs_ref)
+
+    # Lo que ya está en la rejilla se escribe de inmediato; el resto se agrupa por rejilla de origen
+    pendientes = {}
+    for i, year in enumerate(years):
+        cubo[i] = _bandas_del_year(archivos_ndvi, archivos_precip, year, aoi, forma, transform_ref, crs_ref,
+                                   dentro, variable_ndvi, variable_precip, pendientes=pendientes, indice=i)
+    for (i, banda), valores in alinear_pilas(pendientes, forma, transform_ref, crs_ref):
+        cubo[i, banda] = valores if dentro is None else np.where(dentro, valores, np.nan)
+
+    if almacen is not None:
+        cubo.flush()
+        return almacen.abrir(nombre)
+    if salida is not None:
+        cubo.flush()
+    return ColeccionLocal(cubo, years, ["greenness", "precip"], georef)
+
+
+def _bandas_del_year(archivos_ndvi, archivos_precip, year, aoi, forma, transform_ref, crs_ref, dentro=None,
+                     variable_ndvi=None, variable_precip=None, pendientes=None, indice=None):
+    """
+    Arreglo (2, filas, columnas) float32 con 'greenness' y 'precip' de un año en la rejilla de referencia.
+    Con `pendientes` (dict) las bandas fuera de la rejilla no se remuestrean aquí: quedan en NaN y se
+    agregan a pendientes[(forma, transform, crs)] como ((indice, banda), arreglo) para alinear_pilas.
+    """
+    bandas = np.full((2,) + tuple(forma), np.nan, dtype=np.float32)
+    for banda, resultado in enumerate((
+        annual_max_ndvi_local(archivos_ndvi, year, aoi, variable_ndvi),
+        annual_precip_local(archivos_precip, year, aoi, variable_precip),
+    )):
+        if resultado is None:
+            print(f"⚠️ Sin datos de {'NDVI' if banda == 0 else 'precipitación'} para {year}")
+            continue
+        arreglo, transform, crs = resultado
+        if pendientes is not None and not (arreglo.shape == tuple(forma) and transform == transform_ref
+                                           and crs == crs_ref):
+            pendientes.setdefault((arreglo.shape, transform, crs), []).append(((indice, banda), arreglo))
+            continue
+        valores = llevar_a_rejilla(arreglo, transform, crs, forma, transform_ref, crs_ref)
+        if dentro is not None:
+            valores = np.where(dentro, valores, np.nan)
+        bandas[banda] = valores
+    return bandas
+
+
+def combinar_year_local(archivos_ndvi, archivos_precip, year, aoi=None, variable_ndvi=None, variable_precip=None):
+    """
+    Compuesto de un solo año, equivalente local de combinar_ndvi_precip(year, aoi): ImagenLocal
+    ['greenness', 'precip'] en la misma rejilla que combinar_ndvi_precip_local.
+    """
+    from utils.local import ImagenLocal
+
+    forma, transform_ref, crs_ref = rejilla_referencia(archivos_ndvi, aoi)
+    dentro = None if aoi is None else mascara_aoi(aoi, forma, transform_ref, crs_ref)
+    datos = _bandas_del_year(archivos_ndvi, archivos_precip, year, aoi, forma, transform_ref, crs_ref,
+                             dentro, variable_ndvi, variable_precip)
+    georef = {"crs": crs_ref.to_wkt(), "transform": list(transform_ref)[:6]}
+    return ImagenLocal(datos, ["greenness", "precip"], {"year": int(year), "georef": georef})
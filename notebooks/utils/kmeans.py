@@ -0,0 +1,161 @@
+# --- K-means local por mini-lotes para pilas de vértices o fitted ---
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class KMeansLocal:
+    """Modelo k-means entrenado localmente: centros (k, variables) en float32 e inercia de validación."""
+
+    def __init__(self, centros, inercia, bandas=None):
+        self.centros = centros
+        self.inercia = inercia
+        self.bandas = bandas
+
+    @property
+    def num_clusters(self):
+        return self.centros.shape[0]
+
+
+def matriz_pixeles(imagen, bloque=262144):
+    """
+    Vista (píxeles, bandas) de una ImagenLocal (bandas, filas, columnas), de un cubo o de una matriz,
+    sin copiar los datos. Devuelve también la máscara de píxeles sin NaN, calculada por bloques.
+    """
+    from utils.local import ImagenLocal
+
+    datos = imagen.datos if isinstance(imagen, ImagenLocal) else np.asarray(imagen)
+    if datos.ndim == 3:
+        datos = datos.reshape(datos.shape[0], -1).T
+    validos = np.empty(datos.shape[0], dtype=bool)
+    for inicio in range(0, datos.shape[0], bloque):
+        validos[inicio:inicio + bloque] = ~np.isnan(datos[inicio:inicio + bloque]).any(axis=1)
+    return datos, validos
+
+
+def distancias_cuadradas(x, centros, normas_centros=None):
+    """Distancias euclídeas al cuadrado (filas, k) usando ||x||² - 2x·c + ||c||² (una multiplicación de matrices)."""
+    if normas_centros is None:
+        normas_centros = (centros * centros).sum(axis=1)
+    d = (x * x).sum(axis=1)[:, None] - 2 * (x @ centros.T) + normas_centros[None, :]
+    return np.maximum(d, 0, out=d)
+
+
+def asignar_clusters(datos, centros, bloque=262144):
+    """Índice del centro más cercano para cada fila, por bloques para acotar la memoria."""
+    centros = centros.astype(np.float32, copy=False)
+    normas = (centros * centros).sum(axis=1)
+    etiquetas = np.empty(datos.shape[0], dtype=np.int32)
+    for inicio in range(0, datos.shape[0], bloque):
+        x = np.asarray(datos[inicio:inicio + bloque], dtype=np.float32)
+        etiquetas[inicio:inicio + bloque] = distancias_cuadradas(x, centros, normas).argmin(axis=1)
+    return etiquetas
+
+
+def _kmeans_mas_mas(x, k, rng):
+    """Inicialización k-means++ sobre una muestra."""
+    centros = np.empty((k, x.shape[1]), dtype=np.float32)
+    centros[0] = x[rng.integers(len(x))]
+    minimas = distancias_cuadradas(x, centros[:1])[:, 0]
+    for i in range(1, k):
+        total = minimas.sum()
+        elegido = rng.choice(len(x), p=minimas / total) if total > 0 else rng.integers(len(x))
+        centros[i] = x[elegido]
+        np.minimum(minimas, distancias_cuadradas(x, centros[i:i + 1])[:, 0], out=minimas)
+    return centros
+
+
+def _entrenar_un_reinicio(datos, indices_validos, num_clusters, tamano_lote, iteraciones, tolerancia,
+                          paciencia, tamano_inicial, validacion, semilla):
+    rng = np.random.default_rng(semilla)
+    muestra = rng.choice(indices_validos, size=min(tamano_inicial, len(indices_validos)), replace=False)
+    centros = _kmeans_mas_mas(np.asarray(datos[np.sort(muestra)], dtype=np.float32), num_clusters, rng)
+    conteos = np.zeros(num_clusters, dtype=np.int64)
+    clases = np.arange(num_clusters)
+
+    # Inercia suavizada con media móvil exponencial, como MiniBatchKMeans: el ruido de cada lote
+    # impide que los centros dejen de moverse, así que se para tras `paciencia` lotes sin mejora
+    alfa = min(1.0, 2 * tamano_lote / (len(indices_validos) + 1))
+    inercia_suavizada = mejor_inercia = None
+    sin_mejora = 0
+
+    for _ in range(iteraciones):
+        lote = np.asarray(datos[np.sort(rng.choice(indices_validos, size=tamano_lote))], dtype=np.float32)
+        distancias = distancias_cuadradas(lote, centros)
+        etiquetas = distancias.argmin(axis=1)
+        inercia_lote = float(distancias[np.arange(len(lote)), etiquetas].mean())
+        anteriores = centros.copy()
+
+        # Actualización por mini-lote: cada centro se mueve con tasa 1/conteo acumulado
+        pertenencia = (etiquetas[:, None] == clases).astype(np.float32)
+        en_lote = pertenencia.sum(axis=0)
+        conteos += en_lote.astype(np.int64)
+        movidos = en_lote > 0
+        centros[movidos] += ((pertenencia.T @ lote)[movidos] - en_lote[movidos, None] * centros[movidos]) \
+            / conteos[movidos, None]
+
+        if np.abs(centros - anteriores).max() < tolerancia:
+            break
+        inercia_suavizada = inercia_lote if inercia_suavizada is None else \
+            (1 - alfa) * inercia_suavizada + alfa * inercia_lote
+        if mejor_inercia is None or inercia_suavizada < mejor_inercia:
+            mejor_inercia, sin_mejora = inercia_suavizada, 0
+        else:
+            sin_mejora += 1
+            if sin_mejora >= paciencia:
+                break
+
+    inercia = float(distancias_cuadradas(validacion, centros).min(axis=1).sum())
+    return centros, inercia
+
+
+def entrenar_kmeans_local(imagen, num_clusters=10, tamano_lote=4096, iteraciones=100, reinicios=3,
+                          tolerancia=1e-4, paciencia=10, tamano_inicial=20000, hilos=None, semilla=42):
+    """
+    Entrena k-means con inicialización k-means++ y actualizaciones por mini-lotes en float32.
+    `imagen` es una ImagenLocal (vertex_year_* o fittedResidual_*), un cubo (bandas, filas, columnas)
+    o una matriz (muestras, variables); los píxeles con NaN se ignoran. Cada reinicio termina tras
+    `iteraciones` lotes, cuando los centros se mueven menos de `tolerancia` o tras `paciencia` lotes
+    sin mejorar la inercia suavizada.
+
+    Los reinicios se ejecutan en hilos: el trabajo pesado son multiplicaciones de matrices que
+    liberan el GIL, y así todos comparten los datos sin copiarlos. Se conserva el reinicio con
+    menor inercia sobre una muestra común de validación.
+    """
+    from utils.local import ImagenLocal
+
+    datos, validos = matriz_pixeles(imagen)
+    indices_validos = np.flatnonzero(validos)
+    if len(indices_validos) < num_clusters:
+        raise ValueError(f"Hay {len(indices_validos)} píxeles válidos, menos que {num_clusters} clusters.")
+
+    rng = np.random.default_rng(semilla)
+    validacion = np.asarray(datos[np.sort(rng.choice(indices_validos, size=min(tamano_inicial, len(indices_validos)),
+                                                     replace=False))], dtype=np.float32)
+    semillas = rng.integers(2 ** 31, size=reinicios)
+    argumentos = (datos, indices_validos, num_clusters, tamano_lote, iteraciones, tolerancia, paciencia,
+                  tamano_inicial, validacion)
+
+    with ThreadPoolExecutor(max_workers=hilos or reinicios) as pool:
+        resultados = list(pool.map(lambda s: _entrenar_un_reinicio(*argumentos, s), semillas))
+
+    centros, inercia = min(resultados, key=lambda r: r[1])
+    bandas = imagen.bandNames() if isinstance(imagen, ImagenLocal) else None
+    return KMeansLocal(centros, inercia, bandas)
+
+
+def aplicar_clustering_local(imagen, modelo, bloque=262144):
+    """
+    Asigna cada píxel de una ImagenLocal al centro más cercano y devuelve una ImagenLocal 'cluster'
+    (uint8) con la misma numeración que aplicar_clustering: la clase 0 pasa a ser la última (10 con
+    10 clusters). Los píxeles con NaN quedan en 0, sin clase. La propiedad 'num_clusters' guarda k.
+    """
+    from utils.local import ImagenLocal
+
+    filas, columnas = imagen.datos.shape[-2:]
+    datos, validos = matriz_pixeles(imagen)
+    etiquetas = asignar_clusters(datos, modelo.centros, bloque)
+    etiquetas = np.where(etiquetas == 0, modelo.num_clusters, etiquetas)
+    etiquetas[~validos] = 0
+    return ImagenLocal(etiquetas.astype(np.uint8).reshape(1, filas, columnas), ['cluster'],
+                       dict(imagen.propiedades, num_clusters=modelo.num_clusters))
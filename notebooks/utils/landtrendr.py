@@ -0,0 +1,319 @@
+# --- Segmentación LandTrendr local y vectorizada con NumPy ---
+import math
+
+import numpy as np
+
+
+def segmentar_landtrendr(cubo, years=None, max_segments=6, spike_threshold=0.9, vertex_overshoot=3,
+                         prevent_recovery=True, recovery_threshold=0.25, pval=0.05,
+                         best_model_prop=0.75, min_obs=10, bloque_pixeles=50000):
+    """
+    Ejecuta LandTrendr sobre un cubo (años, filas, columnas) procesando todos los píxeles a la vez.
+    Devuelve un arreglo (4, años, filas, columnas) con las filas year/source/fitted/isVertex,
+    en el mismo orden que la banda 'LandTrendr' de Earth Engine.
+
+    Los años sin dato (NaN) se interpolan para la segmentación y se conservan como NaN en 'source'.
+    Los píxeles con menos de `min_obs` observaciones válidas quedan con 'fitted' en NaN.
+    """
+    cubo = np.asarray(cubo)
+    if cubo.ndim != 3:
+        raise ValueError(f"Se esperaba un cubo (años, filas, columnas) y llegó un arreglo de {cubo.ndim} dimensiones.")
+
+    num_years, filas, columnas = cubo.shape
+    # Sin años explícitos se asume una serie consecutiva desde 2001, como en data.parametros
+    years = np.arange(2001, 2001 + num_years) if years is None else np.asarray(years)
+    if len(years) != num_years:
+        raise ValueError(f"El cubo tiene {num_years} años y se recibieron {len(years)} etiquetas.")
+    x = years.astype(np.float64)
+
+    parametros = dict(max_segments=max_segments, spike_threshold=spike_threshold,
+                      vertex_overshoot=vertex_overshoot, prevent_recovery=prevent_recovery,
+                      recovery_threshold=recovery_threshold, pval=pval,
+                      best_model_prop=best_model_prop, min_obs=min_obs)
+
+    serie = cubo.reshape(num_years, -1)
+    num_pixeles = serie.shape[1]
+    salida = np.empty((4, num_years, num_pixeles), dtype=np.float32)
+    salida[0] = years[:, None]
+    salida[1] = serie
+
+    # Se procesa por bloques de píxeles para acotar la memoria de las matrices de diseño
+    for inicio in range(0, num_pixeles, bloque_pixeles):
+        fin = min(inicio + bloque_pixeles, num_pixeles)
+        y = serie[:, inicio:fin].T.astype(np.float64)
+        ajuste, vertices = _segmentar_bloque(y, x, **parametros)
+        salida[2, :, inicio:fin] = ajuste.T
+        salida[3, :, inicio:fin] = vertices.T
+
+    return salida.reshape(4, num_years, filas, columnas)
+
+
+def _segmentar_bloque(y, x, max_segments, spike_threshold, vertex_overshoot, prevent_recovery,
+                      recovery_threshold, pval, best_model_prop, min_obs):
+    num_pixeles, num_years = y.shape
+    ajuste = np.full((num_pixeles, num_years), np.nan)
+    vertices = np.zeros((num_pixeles, num_years), dtype=bool)
+
+    n_validos = (~np.isnan(y)).sum(axis=1)
+    suficientes = n_validos >= max(min_obs, 2)
+    if num_years < 2 or not suficientes.any():
+        return ajuste, vertices
+
+    serie = _suavizar_picos(_rellenar_huecos(y[suficientes], x), spike_threshold)
+    n = n_validos[suficientes]
+
+    n_vertices = min(max_segments + 1 + vertex_overshoot, num_years)
+    n_objetivo = min(max_segments + 1, n_vertices)
+    candidatos = _identificar_vertices(serie, x, n_vertices)
+    candidatos = _depurar_por_angulo(serie, x, candidatos, n_objetivo)
+
+    ajuste_ok, vertices_ok = _elegir_modelo(serie, x, n, candidatos, prevent_recovery,
+                                            recovery_threshold, pval, best_model_prop)
+    ajuste[suficientes] = ajuste_ok
+    vertices[suficientes] = vertices_ok
+    return ajuste, vertices
+
+
+def _rellenar_huecos(y, x):
+    """Interpola linealmente los años sin dato; en los extremos copia el valor válido más cercano."""
+    validos = ~np.isnan(y)
+    if validos.all():
+        return y
+    indices = np.arange(y.shape[1])
+    previo = np.maximum.accumulate(np.where(validos, indices, -1), axis=1)
+    siguiente = np.minimum.accumulate(np.where(validos, indices, y.shape[1])[:, ::-1], axis=1)[:, ::-1]
+    previo, siguiente = (np.where(previo >= 0, previo, siguiente),
+                         np.where(siguiente < y.shape[1], siguiente, previo))
+    relleno = _interpolar(np.nan_to_num(y), x, previo, siguiente)
+    return np.where(validos, y, relleno)
+
+
+def _suavizar_picos(y, umbral):
+    """Amortigua picos de un año (subida y bajada) cuya proporción supera el umbral."""
+    if umbral >= 1 or y.shape[1] < 3:
+        return y
+    y = y.copy()
+    filas = np.arange(y.shape[0])
+    for _ in range(y.shape[1]):
+        anterior, actual, siguiente = y[:, :-2], y[:, 1:-1], y[:, 2:]
+        d1, d2 = actual - anterior, siguiente - actual
+        mayor = np.maximum(np.abs(d1), np.abs(d2))
+        proporcion = 1 - np.divide(np.abs(siguiente - anterior), mayor,
+                                   out=np.ones_like(mayor), where=mayor > 0)
+        proporcion[(d1 * d2) >= 0] = 0
+        peor = proporcion.argmax(axis=1)
+        corregir = proporcion[filas, peor] > umbral
+        if not corregir.any():
+            break
+        f, t = filas[corregir], peor[corregir] + 1
+        y[f, t] = (y[f, t - 1] + y[f, t + 1]) / 2
+    return y
+
+
+def _vecinos(es_vertice):
+    """Índice del vértice anterior (o actual) y del siguiente para cada año."""
+    num_years = es_vertice.shape[1]
+    indices = np.arange(num_years)
+    previo = np.maximum.accumulate(np.where(es_vertice, indices, 0), axis=1)
+    siguiente = np.minimum.accumulate(np.where(es_vertice, indices, num_years - 1)[:, ::-1], axis=1)[:, ::-1]
+    return previo, siguiente
+
+
+def _interpolar(y, x, previo, siguiente):
+    y0 = np.take_along_axis(y, previo, axis=1)
+    y1 = np.take_along_axis(y, siguiente, axis=1)
+    x0, x1 = x[previo], x[siguiente]
+    peso = np.divide(x - x0, x1 - x0, out=np.zeros_like(x0), where=x1 > x0)
+    return y0 + (y1 - y0) * peso
+
+
+def _identificar_vertices(y, x, n_vertices):
+    """Agrega vértices uno a uno en el año con mayor desviación respecto a la línea entre vértices."""
+    filas = np.arange(y.shape[0])
+    es_vertice = np.zeros(y.shape, dtype=bool)
+    es_vertice[:, [0, -1]] = True
+    for _ in range(n_vertices - 2):
+        previo, siguiente = _vecinos(es_vertice)
+        desvio = np.abs(y - _interpolar(y, x, previo, siguiente))
+        desvio[es_vertice] = -1
+        es_vertice[filas, desvio.argmax(axis=1)] = True
+    return es_vertice
+
+
+def _depurar_por_angulo(y, x, es_vertice, n_objetivo):
+    """Elimina los vértices sobrantes con el menor cambio de ángulo (vertexCountOvershoot)."""
+    es_vertice = es_vertice.copy()
+    filas = np.arange(y.shape[0])
+    minimo = y.min(axis=1, keepdims=True)
+    rango = y.max(axis=1, keepdims=True) - minimo
+    ys = (y - minimo) / np.where(rango > 0, rango, 1)
+    xs = (x - x[0]) / (x[-1] - x[0])
+    interiores = np.arange(1, y.shape[1] - 1)
+
+    for _ in range(int(es_vertice.sum(axis=1).max()) - n_objetivo):
+        previo, siguiente = _vecinos(es_vertice)
+        izq, der = previo[:, :-2], siguiente[:, 2:]
+        centro = ys[:, 1:-1]
+        pendiente_izq = (centro - np.take_along_axis(ys, izq, axis=1)) / (xs[interiores] - xs[izq])
+        pendiente_der = (np.take_along_axis(ys, der, axis=1) - centro) / (xs[der] - xs[interiores])
+        angulo = np.abs(np.arctan(pendiente_der) - np.arctan(pendiente_izq))
+        angulo[~es_vertice[:, 1:-1]] = np.inf
+        es_vertice[filas, angulo.argmin(axis=1) + 1] = False
+    return es_vertice
+
+
+def _ajustar_segmentos(y, x, indices):
+    """
+    Ajusta por mínimos cuadrados una recta por tramos continua con vértices en `indices` (píxeles, k+1).
+    Devuelve los valores en los vértices y la serie ajustada.
+    """
+    num_pixeles, num_years = y.shape
+    k = indices.shape[1] - 1
+    xv = x[indices]
+    tramo = (indices[:, None, :] <= np.arange(num_years)[None, :, None]).sum(axis=2) - 1
+    tramo = np.clip(tramo, 0, k - 1)
+    x0 = np.take_along_axis(xv, tramo, axis=1)
+    x1 = np.take_along_axis(xv, tramo + 1, axis=1)
+    peso = (x - x0) / (x1 - x0)
+
+    # Base de funciones "sombrero": el coeficiente de cada vértice es el valor ajustado en él
+    base = np.zeros((num_pixeles, num_years, k + 1))
+    p, t = np.arange(num_pixeles)[:, None], np.arange(num_years)[None, :]
+    base[p, t, tramo] = 1 - peso
+    base[p, t, tramo + 1] = peso
+
+    normal = np.einsum('ptk,ptl->pkl', base, base)
+    derecha = np.einsum('ptk,pt->pk', base, y)
+    coeficientes = np.linalg.solve(normal, derecha[..., None])[..., 0]
+    return coeficientes, np.einsum('ptk,pk->pt', base, coeficientes)
+
+
+def _quitar_columna(indices, columna):
+    conservar = np.ones(indices.shape, dtype=bool)
+    conservar[np.arange(indices.shape[0]), columna] = False
+    return indices[conservar].reshape(indices.shape[0], -1)
+
+
+def _elegir_modelo(y, x, n, es_vertice, prevent_recovery, recovery_threshold, pval, best_model_prop):
+    """
+    Ajusta modelos desde el máximo de segmentos hasta uno, quitando cada vez el vértice que menos
+    aumenta el error, y elige el modelo con más vértices cuyo valor p no se aleje más de
+    (1 - best_model_prop) del mejor valor p.
+    """
+    num_pixeles, num_years = y.shape
+    filas = np.arange(num_pixeles)
+    rango = y.max(axis=1) - y.min(axis=1)
+    sst = ((y - y.mean(axis=1, keepdims=True)) ** 2).sum(axis=1)
+    indices = np.sort(np.argsort(~es_vertice, axis=1, kind='stable')[:, :int(es_vertice.sum(axis=1).min())], axis=1)
+
+    ajustes, mascaras, valores_p, permitidos = [], [], [], []
+    while True:
+        coeficientes, ajuste = _ajustar_segmentos(y, x, indices)
+        k = indices.shape[1] - 1
+        sse = ((y - ajuste) ** 2).sum(axis=1)
+        mascara = np.zeros((num_pixeles, num_years), dtype=bool)
+        mascara[filas[:, None], indices] = True
+
+        ajustes.append(ajuste)
+        mascaras.append(mascara)
+        valores_p.append(_valor_p_f(sst, sse, k, n))
+        permitidos.append(_recuperacion_permitida(coeficientes, x[indices], rango,
+                                                  prevent_recovery, recovery_threshold))
+        if k == 1:
+            break
+
+        errores = []
+        for columna in range(1, k):
+            _, ajuste_sin = _ajustar_segmentos(y, x, np.delete(indices, columna, axis=1))
+            errores.append(((y - ajuste_sin) ** 2).sum(axis=1))
+        indices = _quitar_columna(indices, np.argmin(np.stack(errores, axis=1), axis=1) + 1)
+
+    valores_p = np.stack(valores_p, axis=1)
+    validos = np.stack(permitidos, axis=1) & (valores_p <= pval)
+    p_validos = np.where(validos, valores_p, np.inf)
+    p_minimo = p_validos.min(axis=1, keepdims=True)
+    aceptables = validos & (p_validos <= p_minimo * (2 - best_model_prop))
+
+    # Los modelos están ordenados de más a menos segmentos: el primero aceptable es el elegido
+    elegido = aceptables.argmax(axis=1)
+    hay_modelo = aceptables.any(axis=1)
+    ajuste = np.stack(ajustes)[elegido, filas]
+    vertices = np.stack(mascaras)[elegido, filas]
+
+    # Sin modelo válido se devuelve la media de la serie con vértices solo en los extremos
+    ajuste[~hay_modelo] = y[~hay_modelo].mean(axis=1, keepdims=True)
+    vertices[~hay_modelo] = False
+    vertices[np.ix_(~hay_modelo, [0, num_years - 1])] = True
+    return ajuste, vertices
+
+
+def _recuperacion_permitida(coeficientes, xv, rango, prevent_recovery, recovery_threshold):
+    """
+    Igual que en EE, la recuperación es un cambio negativo del índice. Se descartan los modelos
+    con recuperaciones más rápidas que 1/recovery_threshold años o de un solo año.
+    """
+    delta = np.diff(coeficientes, axis=1)
+    duracion = np.diff(xv, axis=1)
+    recuperacion = delta < 0
+    tasa = -delta / np.where(rango > 0, rango, 1)[:, None] / duracion
+    descartar = recuperacion & (tasa > recovery_threshold)
+    if prevent_recovery:
+        descartar |= recuperacion & (duracion <= 1)
+    return ~descartar.any(axis=1)
+
+
+def _valor_p_f(sst, sse, k, n):
+    """Valor p del estadístico F del modelo de k segmentos frente a la media."""
+    gl1 = k
+    gl2 = n - k - 1
+    valido = (gl2 > 0) & (sse > 0)
+    f = np.divide((sst - sse) / gl1 * np.maximum(gl2, 1), np.where(valido, sse, 1))
+    f = np.maximum(f, 0)
+    p = np.where(sse > 0, 1.0, 0.0)
+    if valido.any():
+        gl2v = gl2[valido].astype(np.float64)
+        x = gl2v / (gl2v + gl1 * f[valido])
+        p[valido] = _beta_incompleta(gl2v / 2, np.full_like(gl2v, gl1 / 2), x)
+    p[gl2 <= 0] = 1.0
+    return p
+
+
+def _beta_incompleta(a, b, x):
+    """Función beta incompleta regularizada I_x(a, b) por fracción continua, vectorizada."""
+    resultado = np.where(x >= 1, 1.0, 0.0)
+    interior = (x > 0) & (x < 1)
+    if not interior.any():
+        return resultado
+    a, b, x = a[interior], b[interior], x[interior]
+
+    # Se usa la simetría I_x(a, b) = 1 - I_{1-x}(b, a) donde la fracción converge mejor
+    invertir = x > (a + 1) / (a + b + 2)
+    a, b, x = np.where(invertir, b, a), np.where(invertir, a, b), np.where(invertir, 1 - x, x)
+
+    lgamma = np.vectorize(math.lgamma, otypes=[np.float64])
+    frente = np.exp(a * np.log(x) + b * np.log1p(-x) - (lgamma(a) + lgamma(b) - lgamma(a + b))) / a
+    valor = frente * _fraccion_beta(a, b, x)
+    resultado[interior] = np.where(invertir, 1 - valor, valor)
+    return resultado
+
+
+def _fraccion_beta(a, b, x, iteraciones=200, tolerancia=1e-12):
+    minimo = 1e-300
+    qab, qap, qam = a + b, a + 1, a - 1
+    c = np.ones_like(x)
+    d = 1 - qab * x / qap
+    d = 1 / np.where(np.abs(d) < minimo, minimo, d)
+    h = d.copy()
+    for m in range(1, iteraciones + 1):
+        m2 = 2 * m
+        for aa in (m * (b - m) * x / ((qam + m2) * (a + m2)),
+                   -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))):
+            d = 1 + aa * d
+            d = 1 / np.where(np.abs(d) < minimo, minimo, d)
+            c = 1 + aa / c
+            c = np.where(np.abs(c) < minimo, minimo, c)
+            delta = d * c
+            h *= delta
+        if np.all(np.abs(delta - 1) < tolerancia):
+            break
+    return h
@@ -0,0 +1,139 @@
+# --- Equivalentes locales (NumPy) de las imágenes de Earth Engine ---
+import itertools
+
+import numpy as np
+
+
+class ImagenLocal:
+    """
+    Imagen multibanda en memoria: arreglo (bandas, filas, columnas) con nombres de banda.
+    Imita los métodos de ee.Image que usa el flujo (select, bandNames, toFloat).
+    """
+
+    def __init__(self, datos, bandas, propiedades=None):
+        if datos.shape[0] != len(bandas):
+            raise ValueError(f"Se esperaban {len(bandas)} bandas y el arreglo tiene {datos.shape[0]}.")
+        self.datos = datos
+        self.bandas = list(bandas)
+        self.propiedades = dict(propiedades or {})
+
+    def bandNames(self):
+        return list(self.bandas)
+
+    def banda(self, nombre):
+        """Devuelve la banda indicada como arreglo (filas, columnas) sin copiar."""
+        return self.datos[self.bandas.index(nombre)]
+
+    def select(self, bandas):
+        if isinstance(bandas, str):
+            bandas = [bandas]
+        indices = [self.bandas.index(b) for b in bandas]
+        # Una sola banda se toma como vista para no copiar el arreglo
+        if len(indices) == 1:
+            datos = self.datos[indices[0]:indices[0] + 1]
+        else:
+            datos = self.datos[indices]
+        return ImagenLocal(datos, bandas, self.propiedades)
+
+    def toFloat(self):
+        return ImagenLocal(self.datos.astype(np.float32, copy=False), self.bandas, self.propiedades)
+
+
+class ArregloLocal:
+    """
+    Banda de arreglos en memoria, equivalente a la banda 'LandTrendr' de EE.
+    Los primeros ejes son los del arreglo de cada píxel; los dos últimos son filas y columnas.
+    """
+
+    def __init__(self, datos, nombre='LandTrendr', georef=None):
+        self.datos = datos
+        self.nombre = nombre
+        self.georef = georef
+
+    @property
+    def ejes_arreglo(self):
+        return self.datos.ndim - 2
+
+    def select(self, nombre):
+        if nombre != self.nombre:
+            raise ValueError(f"La banda '{nombre}' no existe; solo está disponible '{self.nombre}'.")
+        return self
+
+    def arraySlice(self, axis=0, start=0, end=None, step=1):
+        indices = [slice(None)] * self.datos.ndim
+        indices[axis] = slice(start, end, step)
+        return ArregloLocal(self.datos[tuple(indices)], self.nombre, self.georef)
+
+    def arrayProject(self, axes):
+        # Los ejes que no se conservan deben tener longitud 1, igual que en EE
+        quitar = tuple(e for e in range(self.ejes_arreglo) if e not in axes)
+        for eje in quitar:
+            if self.datos.shape[eje] != 1:
+                raise ValueError(f"No se puede proyectar: el eje {eje} tiene longitud {self.datos.shape[eje]}.")
+        datos = np.squeeze(self.datos, axis=quitar)
+        # Reordena los ejes conservados según el orden pedido
+        orden = sorted(axes)
+        permutacion = [orden.index(e) for e in axes] + [len(axes), len(axes) + 1]
+        return ArregloLocal(np.transpose(datos, permutacion), self.nombre, self.georef)
+
+    def arrayFlatten(self, coordLabels, separator='_'):
+        if len(coordLabels) != self.ejes_arreglo:
+            raise ValueError(f"Se esperaban etiquetas para {self.ejes_arreglo} ejes.")
+        for eje, etiquetas in enumerate(coordLabels):
+            if len(etiquetas) != self.datos.shape[eje]:
+                raise ValueError(f"El eje {eje} tiene longitud {self.datos.shape[eje]} y hay {len(etiquetas)} etiquetas.")
+        nombres = [separator.join(partes) for partes in itertools.product(*coordLabels)]
+        filas, columnas = self.datos.shape[-2:]
+        return ImagenLocal(self.datos.reshape(len(nombres), filas, columnas), nombres, {'georef': self.georef})
+
+
+class ColeccionLocal:
+    """
+    Colección anual en memoria: arreglo (años, bandas, filas, columnas) con una imagen por año.
+    Es el equivalente local del ImageCollection que arma combinar_ndvi_precip.
+    `georef` es opcional: {'crs': WKT o código, 'transform': [a, b, c, d, e, f]} (transformación afín).
+    """
+
+    def __init__(self, datos, years, bandas, georef=None):
+        if datos.shape[:2] != (len(years), len(bandas)):
+            raise ValueError(f"El arreglo {datos.shape} no coincide con {len(years)} años y {len(bandas)} bandas.")
+        self.datos = datos
+        self.years = [int(y) for y in years]
+        self.bandas = list(bandas)
+        self.georef = georef
+
+    @property
+    def forma(self):
+        """Tamaño espacial (filas, columnas)."""
+        return self.datos.shape[-2:]
+
+    def bandNames(self):
+        return list(self.bandas)
+
+    def banda(self, nombre):
+        """Devuelve el cubo (años, filas, columnas) de una banda sin copiar."""
+        return self.datos[:, self.bandas.index(nombre)]
+
+    def select(self, bandas):
+        if isinstance(bandas, str):
+            bandas = [bandas]
+        indices = [self.bandas.index(b) for b in bandas]
+        if len(indices) == 1:
+            datos = self.datos[:, indices[0]:indices[0] + 1]
+        else:
+            datos = self.datos[:, indices]
+        return ColeccionLocal(datos, self.years, bandas, self.georef)
+
+    def imagen(self, year):
+        """Imagen de un año, equivalente a filter(ee.Filter.eq('year', year)).first()."""
+        return ImagenLocal(self.datos[self.years.index(int(year))], self.bandas, {'year': int(year)})
+
+    def ventana(self, filas, columnas):
+        """Recorte espacial (vista) con los slices de filas y columnas indicados."""
+        georef = None
+        if self.georef is not None:
+            # Desplaza el origen de la transformación afín a la esquina de la ventana
+            a, b, c, d, e, f = self.georef['transform'][:6]
+            f0, c0 = filas.start or 0, columnas.start or 0
+            georef = dict(self.georef, transform=[a, b, c + a * c0 + b * f0, d, e, f + d * c0 + e * f0])
+        return ColeccionLocal(self.datos[:, :, filas, columnas], self.years, self.bandas, georef)
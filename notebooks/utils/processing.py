@@ -1,4 +1,9 @@
+from utils.profiler import instrumentar
+
+@instrumentar
 def annual_precip(year, aoi):
+    import ee
+
     start = ee.Date.fromYMD(year, 1, 1)
     end = start.advance(1, 'year')
     precip = ee.ImageCollection('UCSB-CHG/CHIRPS/DAILY').filterDate(start, end).filterBounds(aoi).select('precipitation')
@@ -9,7 +14,10 @@ def annual_precip(year, aoi):
     ))
 
 
+@instrumentar
 def annual_max_ndvi(year, aoi):
+    import ee
+
     start = ee.Date.fromYMD(year, 1, 1)
     end = start.advance(1, 'year')
     ndvi = ee.ImageCollection('MODIS/061/MOD13Q1').filterDate(start, end).filterBounds(aoi).select('NDVI')
@@ -19,7 +27,10 @@ def annual_max_ndvi(year, aoi):
         ee.Image().set({'year': year, 'empty': True})
     ))
 
+@instrumentar
 def combinar_ndvi_precip(year, aoi):
+    import ee
+
     ndvi = annual_max_ndvi(year, aoi)  # devuelve banda 'greenness'
     precip = annual_precip(year, aoi)  # devuelve banda 'precip'
     return ee.Image(ndvi).addBands(precip).set({
@@ -27,11 +38,78 @@ def combinar_ndvi_precip(year, aoi):
         'system:time_start': ndvi.get('system:time_start')
     })
 
+@instrumentar
+def coleccion_ndvi_precip(years, aoi, remuestreo=None):
+    """
+    Colección NDVI + precipitación de todos los años, equivalente a
+    ee.ImageCollection([combinar_ndvi_precip(year, aoi) for year in years]) pero con un grafo de
+    tamaño fijo: MOD13Q1 y CHIRPS se filtran una sola vez para todo el periodo y cada año se arma
+    dentro de un único map sobre la lista de años. Un año sin imágenes queda enmascarado (con
+    'empty' = 1) sin un ee.Algorithms.If por año.
+    Con `remuestreo` (PlanRemuestreo de utils.helpers) 'greenness' queda en la rejilla de destino y
+    'precip' se suma en la rejilla nativa de CHIRPS y se interpola al leerla, sin reproject por imagen.
+    """
+    import ee
+
+    years = [int(year) for year in years]
+    inicio = ee.Date.fromYMD(min(years), 1, 1)
+    fin = ee.Date.fromYMD(max(years) + 1, 1, 1)
+    ndvi = ee.ImageCollection('MODIS/061/MOD13Q1').filterDate(inicio, fin).filterBounds(aoi).select('NDVI')
+    precip = ee.ImageCollection('UCSB-CHG/CHIRPS/DAILY').filterDate(inicio, fin).filterBounds(aoi).select('precipitation')
+
+    # Una imagen totalmente enmascarada por colección: max y sum la ignoran cuando hay datos y,
+    # si el año está vacío, el resultado queda enmascarado con las bandas correctas
+    vacia_ndvi = ee.ImageCollection([ee.Image.constant(0).toInt16().rename('NDVI').updateMask(0)])
+    vacia_precip = ee.ImageCollection([ee.Image.constant(0).toFloat().rename('precipitation').updateMask(0)])
+    if remuestreo is not None:
+        proyeccion_chirps = ee.Image(precip.merge(vacia_precip).first()).projection()
+
+    def por_year(year):
+        year = ee.Number(year)
+        del_year = ee.Filter.calendarRange(year, year, 'year')
+        ndvi_year = ndvi.filter(del_year)
+        greenness = ndvi_year.merge(vacia_ndvi).max().multiply(0.0001).rename('greenness')
+        lluvia = precip.filter(del_year).merge(vacia_precip).sum().rename('precip')
+        if remuestreo is not None:
+            greenness = remuestreo.aplicar(greenness)
+            lluvia = remuestreo.interpolar(lluvia, proyeccion_chirps)
+        return greenness.addBands(lluvia).clip(aoi).set({
+            'year': year,
+            'system:time_start': ee.Date.fromYMD(year, 1, 1).millis(),
+            'empty': ndvi_year.size().eq(0)
+        })
+
+    return ee.ImageCollection.fromImages(ee.List(years).map(por_year))
 
 
+@instrumentar
 def ejecutar_landtrendr(collection, max_segments=6, spike_threshold=0.9, vertex_overshoot=3,
                         prevent_recovery=True, recovery_threshold=0.25, pval=0.05,
-                        best_model_prop=0.75, min_obs=10):
+                        best_model_prop=0.75, min_obs=10, years=None, remuestreo=None):
+    import numpy as np
+    from utils.local import ColeccionLocal
+
+    # Una colección local de una banda equivale a un cubo (años, filas, columnas)
+    if isinstance(collection, ColeccionLocal):
+        if len(collection.bandas) != 1:
+            raise ValueError("LandTrendr local espera una sola banda; use select() antes.")
+        years = collection.years if years is None else years
+        georef = collection.georef
+        collection = collection.datos[:, 0]
+    else:
+        georef = None
+
+    # Un cubo NumPy (años, filas, columnas) se segmenta localmente, sin llamadas a EE
+    if isinstance(collection, np.ndarray):
+        from utils.landtrendr import segmentar_landtrendr
+        from utils.local import ArregloLocal
+        return ArregloLocal(segmentar_landtrendr(
+            collection, years=years, max_segments=max_segments, spike_threshold=spike_threshold,
+            vertex_overshoot=vertex_overshoot, prevent_recovery=prevent_recovery,
+            recovery_threshold=recovery_threshold, pval=pval,
+            best_model_prop=best_model_prop, min_obs=min_obs
+        ), georef=georef)
+
     import ee
     params = {
         'maxSegments': max_segments,
@@ -44,26 +122,54 @@ def ejecutar_landtrendr(collection, max_segments=6, spike_threshold=0.9, vertex_
         'minObservationsNeeded': min_obs,
         'timeSeries': collection
     }
-    lt = ee.Algorithms.TemporalSegmentation.LandTrendr(**params)
-    return lt.select('LandTrendr')
+    lt = ee.Algorithms.TemporalSegmentation.LandTrendr(**params).select('LandTrendr')
+    # La rejilla de destino se fija una vez sobre el resultado, no en cada imagen de entrada
+    return lt if remuestreo is None else remuestreo.aplicar(lt)
 
 
-def extraer_fitted_stack(lt_output, start_year, num_years):
+@instrumentar
+def extraer_fitted_stack(lt_output, start_year, num_years, almacen=None, nombre="fitted"):
     """
     A partir del resultado LandTrendr, extrae la banda 'fitted' y la aplana por año.
     Devuelve una imagen con una banda por año.
+    Con un resultado local y un `almacen` (AlmacenCubos), la imagen se guarda como `nombre`.
     """
     fitted = lt_output.arraySlice(0, 2, 3)
     year_labels = [str(start_year + i) for i in range(num_years)]
-    return fitted.arrayFlatten([['fittedResidual'], year_labels]).toFloat()
+    fitted_stack = fitted.arrayFlatten([['fittedResidual'], year_labels]).toFloat()
+    if almacen is not None:
+        return almacen.guardar(nombre, fitted_stack)
+    return fitted_stack
+
+@instrumentar
+def calcular_residuos(imagenes, aoi, modo="global", bloque_pixeles=250000, almacen=None, remuestreo=None,
+                      obtener_info=None):
+    """
+    Agrega la banda 'residual' (NDVI observado - NDVI esperado por la lluvia) a cada imagen.
+    modo="global" ajusta una sola recta con las medias del AOI; modo="pixel" ajusta una recta por píxel.
+    Con `remuestreo` (PlanRemuestreo) las medias del AOI se reducen en su rejilla en vez de a 250 m.
+    `obtener_info` resuelve la tabla de medias (por defecto info_en_cache, un getInfo con caché); en
+    AOIs grandes puede ser una exportación, p. ej. utils.export.info_por_exportacion.
+    """
+    from utils.local import ColeccionLocal
+
+    # Una colección local se resuelve con NumPy; 'aoi' es entonces una máscara booleana o None
+    if isinstance(imagenes, ColeccionLocal):
+        return calcular_residuos_local(imagenes, aoi, modo=modo, bloque_pixeles=bloque_pixeles, almacen=almacen)
+
+    import ee
+
+    if modo == "pixel":
+        # Ajuste por píxel en el servidor: linearFit espera las bandas (x, y) y devuelve 'scale' y 'offset'
+        ajuste = imagenes.select(['precip', 'greenness']).reduce(ee.Reducer.linearFit())
+        return _agregar_residual_ee(imagenes, ajuste.select('scale'), ajuste.select('offset'))
 
-def calcular_residuos(imagenes, aoi):
     def extraer_valores(imagen):
         stats = imagen.reduceRegion(
             reducer=ee.Reducer.mean(),
             geometry=aoi.geometry(),
-            scale=250,
-            maxPixels=1e13
+            maxPixels=1e13,
+            **(remuestreo.argumentos() if remuestreo is not None else {'scale': 250})
         )
         return ee.Feature(None, {
             'greenness': stats.get('greenness'),
@@ -71,8 +177,11 @@ def calcular_residuos(imagenes, aoi):
             'year': ee.Date(imagen.get('system:time_start')).get('year')
         })
 
-    # Ejecutar en Earth Engine y traer los datos
-    features = imagenes.map(extraer_valores).getInfo()
+    # Ejecutar en Earth Engine y traer los datos (o reutilizarlos de la caché en disco)
+    if obtener_info is None:
+        from utils.cache import info_en_cache
+        obtener_info = info_en_cache
+    features = obtener_info(imagenes.map(extraer_valores))
     valores = []
     for f in features['features']:
         props = f['properties']
@@ -83,15 +192,12 @@ def calcular_residuos(imagenes, aoi):
                 'year': props['year']
             })
 
-    df = pd.DataFrame(valores).dropna()
-
-    if df.empty:
-        raise ValueError("No hay datos válidos con 'greenness' y 'precip'.")
+    pendiente, intercepto = ajustar_ndvi_precip(valores)
+    return _agregar_residual_ee(imagenes, pendiente, intercepto)
 
-    x = df['precip'].values
-    y = df['ndvi'].values
-    pendiente, intercepto = np.polyfit(x, y, 1)
 
+def _agregar_residual_ee(imagenes, pendiente, intercepto):
+    # pendiente e intercepto pueden ser números (ajuste global) o imágenes (ajuste por píxel)
     def agregar_residual(imagen):
         predicho = imagen.expression(
             'b * p + a',
@@ -103,3 +209,106 @@ def calcular_residuos(imagenes, aoi):
     return imagenes.map(agregar_residual)
 
 
+@instrumentar
+def ajustar_ndvi_precip(valores):
+    """
+    Ajusta la recta NDVI ~ precipitación sobre las medias anuales del AOI.
+    `valores` es una lista de diccionarios con 'ndvi', 'precip' y 'year'.
+    """
+    import numpy as np
+    import pandas as pd
+
+    df = pd.DataFrame(valores).dropna()
+
+    if df.empty:
+        raise ValueError("No hay datos válidos con 'greenness' y 'precip'.")
+
+    x = df['precip'].values
+    y = df['ndvi'].values
+    pendiente, intercepto = np.polyfit(x, y, 1)
+    return pendiente, intercepto
+
+
+@instrumentar
+def sumas_anuales_local(coleccion, mascara=None):
+    """
+    Suma y conteo de píxeles válidos de 'greenness' y 'precip' por año dentro de la máscara.
+    Devuelve un arreglo (2 bandas, [suma, conteo], años) que se puede acumular tesela a tesela.
+    """
+    import numpy as np
+
+    sumas = np.zeros((2, 2, len(coleccion.years)))
+    for i, banda in enumerate(('greenness', 'precip')):
+        cubo = coleccion.banda(banda)
+        if mascara is not None:
+            cubo = np.where(mascara, cubo, np.nan)
+        sumas[i, 0] = np.nansum(cubo, axis=(1, 2), dtype=np.float64)
+        sumas[i, 1] = (~np.isnan(cubo)).sum(axis=(1, 2))
+    return sumas
+
+
+@instrumentar
+def valores_desde_sumas(years, sumas):
+    """Convierte las sumas de sumas_anuales_local en las medias anuales que usa ajustar_ndvi_precip."""
+    valores = []
+    for j, year in enumerate(years):
+        if sumas[0, 1, j] > 0 and sumas[1, 1, j] > 0:
+            valores.append({
+                'ndvi': sumas[0, 0, j] / sumas[0, 1, j],
+                'precip': sumas[1, 0, j] / sumas[1, 1, j],
+                'year': year
+            })
+    return valores
+
+
+@instrumentar
+def agregar_residual_local(coleccion, pendiente, intercepto, mascara=None, almacen=None, nombre="residuos"):
+    """Agrega la banda 'residual' (NDVI observado - NDVI esperado por la lluvia) a una colección local."""
+    import numpy as np
+
+    predicho = pendiente * coleccion.banda('precip') + intercepto
+    residual = (coleccion.banda('greenness') - predicho).astype(np.float32)
+    return _con_residual(coleccion, residual, mascara, almacen, nombre)
+
+
+def _con_residual(coleccion, residual, mascara=None, almacen=None, nombre="residuos"):
+    import numpy as np
+    from utils.local import ColeccionLocal
+
+    # Fuera del AOI no hay residual, igual que con clip en EE
+    if mascara is not None:
+        residual = np.where(mascara, residual, np.nan)
+    bandas = coleccion.bandas + ['residual']
+
+    if almacen is None:
+        datos = np.concatenate([coleccion.datos, residual[:, None].astype(coleccion.datos.dtype)], axis=1)
+        return ColeccionLocal(datos, coleccion.years, bandas, coleccion.georef)
+
+    # En el almacén se escribe año a año, sin armar el cubo completo en memoria
+    forma = (len(coleccion.years), len(bandas)) + tuple(coleccion.forma)
+    datos = almacen.crear(nombre, forma, bandas, coleccion.years, coleccion.georef,
+                          dtype=coleccion.datos.dtype, relleno=None)
+    for i in range(forma[0]):
+        datos[i, :-1] = coleccion.datos[i]
+        datos[i, -1] = residual[i]
+    datos.flush()
+    del datos
+    return almacen.abrir(nombre)
+
+
+@instrumentar
+def calcular_residuos_local(coleccion, mascara=None, modo="global", bloque_pixeles=250000,
+                            almacen=None, nombre="residuos"):
+    """
+    Equivalente local de calcular_residuos sobre una ColeccionLocal.
+    Con modo="pixel" la recta se ajusta en cada píxel (ver utils.regression.ajustar_por_pixel).
+    Con `almacen` (AlmacenCubos) el resultado se guarda como `nombre` y se devuelve abierto desde el disco.
+    """
+    if modo == "pixel":
+        from utils.regression import ajustar_por_pixel
+        _, residual = ajustar_por_pixel(coleccion, mascara, bloque_pixeles)
+        return _con_residual(coleccion, residual, mascara, almacen, nombre)
+
+    valores = valores_desde_sumas(coleccion.years, sumas_anuales_local(coleccion, mascara))
+    pendiente, intercepto = ajustar_ndvi_precip(valores)
+    return agregar_residual_local(coleccion, pendiente, intercepto, mascara, almacen, nombre)
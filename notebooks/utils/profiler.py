@@ -0,0 +1,168 @@
+# --- Instrumentación del flujo: tiempos, bytes y llamadas por función ---
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+_perfil = None              # Perfil activo (None = instrumentación apagada)
+_hilo = threading.local()   # Pila de llamadas instrumentadas de cada hilo
+
+
+class Perfil:
+    """
+    Mediciones de una ejecución. Cada nodo es una pila de llamadas (p. ej.
+    display.mostrar_landtrendr_fitted;display.mostrar_paneles_ee) con número de llamadas,
+    tiempo total, tiempo propio (sin las funciones instrumentadas que llama) y bytes de datos.
+    """
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.duracion = None
+        self.nodos = defaultdict(lambda: {"llamadas": 0, "total": 0.0, "propio": 0.0, "bytes": 0})
+        self.contadores = Counter()
+        self._candado = threading.Lock()
+
+    def registrar(self, ruta, total, propio, num_bytes):
+        with self._candado:
+            nodo = self.nodos[ruta]
+            nodo["llamadas"] += 1
+            nodo["total"] += total
+            nodo["propio"] += propio
+            nodo["bytes"] += num_bytes
+
+    def contar(self, nombre, n=1):
+        with self._candado:
+            self.contadores[nombre] += n
+
+    def funciones(self):
+        """Totales por función, ordenados por tiempo total. Las llamadas recursivas no se cuentan dos veces."""
+        resumen = defaultdict(lambda: {"llamadas": 0, "total": 0.0, "propio": 0.0, "bytes": 0})
+        for ruta, nodo in self.nodos.items():
+            fila = resumen[ruta[-1]]
+            fila["llamadas"] += nodo["llamadas"]
+            fila["propio"] += nodo["propio"]
+            fila["bytes"] += nodo["bytes"]
+            if ruta[-1] not in ruta[:-1]:
+                fila["total"] += nodo["total"]
+        return sorted(({"funcion": f, **v} for f, v in resumen.items()), key=lambda f: -f["total"])
+
+    def a_dict(self):
+        duracion = self.duracion if self.duracion is not None else time.perf_counter() - self.inicio
+        return {
+            "duracion": duracion,
+            "funciones": self.funciones(),
+            "pilas": [{"ruta": ";".join(ruta), **nodo} for ruta, nodo in sorted(self.nodos.items())],
+            "contadores": dict(self.contadores),
+        }
+
+    def guardar_json(self, ruta):
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(self.a_dict(), f, ensure_ascii=False, indent=2)
+
+    def pilas_plegadas(self):
+        """Formato 'pila;plegada microsegundos' de flamegraph.pl y speedscope (tiempo propio de cada pila)."""
+        return "\n".join(f"{';'.join(ruta)} {int(round(nodo['propio'] * 1e6))}"
+                         for ruta, nodo in sorted(self.nodos.items()))
+
+    def guardar_pilas(self, ruta):
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write(self.pilas_plegadas() + "\n")
+
+    def imprimir(self, n=15):
+        """Tabla con las funciones que más tiempo consumen y un árbol de llamadas con su porcentaje."""
+        datos = self.a_dict()
+        duracion = max(datos["duracion"], 1e-12)
+        print(f"⏱️ Duración total: {duracion:.2f} s")
+        print(f"{'función':45} {'llamadas':>8} {'total s':>9} {'propio s':>9} {'MB':>8}")
+        for fila in datos["funciones"][:n]:
+            print(f"{fila['funcion']:45} {fila['llamadas']:>8} {fila['total']:>9.3f} "
+                  f"{fila['propio']:>9.3f} {fila['bytes'] / 1024 ** 2:>8.2f}")
+        print()
+        for ruta, nodo in sorted(self.nodos.items()):
+            barra = "█" * int(round(30 * nodo["total"] / duracion))
+            print(f"{'  ' * (len(ruta) - 1)}{ruta[-1]:<{50 - 2 * len(ruta)}} {100 * nodo['total'] / duracion:5.1f}% {barra}")
+        for nombre, valor in sorted(self.contadores.items()):
+            print(f"  {nombre}: {valor}")
+
+
+def _tamano(resultado):
+    """Bytes de datos de un resultado: bytes, arreglos NumPy u objetos locales con `datos`."""
+    if isinstance(resultado, (bytes, bytearray, memoryview)):
+        return len(resultado)
+    datos = getattr(resultado, "datos", resultado)
+    return int(getattr(datos, "nbytes", 0) or 0)
+
+
+def instrumentar(funcion):
+    """
+    Decorador para las funciones públicas del flujo. Con la instrumentación apagada solo añade
+    una comprobación; con un perfil activo mide tiempo, bytes del resultado y llamadas.
+    """
+    nombre = f"{funcion.__module__.rsplit('.', 1)[-1]}.{funcion.__name__}"
+
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        perfil = _perfil
+        if perfil is None:
+            return funcion(*args, **kwargs)
+
+        pila = getattr(_hilo, "pila", None)
+        if pila is None:
+            pila = _hilo.pila = []
+        marco = [nombre, 0.0, 0]  # [nombre, tiempo de las llamadas hijas, bytes añadidos a mano]
+        pila.append(marco)
+        inicio = time.perf_counter()
+        resultado = None
+        try:
+            resultado = funcion(*args, **kwargs)
+            return resultado
+        finally:
+            total = time.perf_counter() - inicio
+            pila.pop()
+            if pila:
+                pila[-1][1] += total
+            ruta = tuple(m[0] for m in pila) + (nombre,)
+            perfil.registrar(ruta, total, total - marco[1], marco[2] + _tamano(resultado))
+
+    return envoltura
+
+
+def sumar_bytes(n):
+    """Suma bytes a la función instrumentada en curso (p. ej. el JSON de un getInfo)."""
+    pila = getattr(_hilo, "pila", None)
+    if _perfil is not None and pila:
+        pila[-1][2] += n
+
+
+def contar(nombre, n=1):
+    """Incrementa un contador del perfil activo (p. ej. aciertos de la caché)."""
+    if _perfil is not None:
+        _perfil.contar(nombre, n)
+
+
+@contextmanager
+def perfilar(json_salida=None, pilas_salida=None, imprimir=False):
+    """
+    Activa la instrumentación dentro del bloque:
+
+        with perfilar("perfil.json", "perfil.folded", imprimir=True) as perfil:
+            fitted = extraer_fitted_stack(ejecutar_landtrendr(coleccion), 2001, 20)
+
+    Al salir se guardan el informe JSON y las pilas plegadas (flame graph) si se indicaron rutas.
+    """
+    global _perfil
+    anterior = _perfil
+    perfil = _perfil = Perfil()
+    try:
+        yield perfil
+    finally:
+        perfil.duracion = time.perf_counter() - perfil.inicio
+        _perfil = anterior
+        if json_salida is not None:
+            perfil.guardar_json(json_salida)
+        if pilas_salida is not None:
+            perfil.guardar_pilas(pilas_salida)
+        if imprimir:
+            perfil.imprimir()
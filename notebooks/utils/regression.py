@@ -0,0 +1,69 @@
+# --- Regresión NDVI ~ precipitación por píxel, en forma cerrada y vectorizada ---
+import numpy as np
+
+# Sumas suficientes de la regresión, en el orden en que se guardan
+SUMAS = ('n', 'sx', 'sy', 'sxx', 'sxy', 'syy')
+
+
+def sumas_regresion(x, y):
+    """
+    Sumas suficientes (n, Σx, Σy, Σx², Σxy, Σy²) por píxel de series (años, píxeles).
+    Los años con NaN en x o en y no cuentan. Devuelve un arreglo (6, píxeles) en float64.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    validos = ~np.isnan(x) & ~np.isnan(y)
+    x = np.where(validos, x, 0)
+    y = np.where(validos, y, 0)
+    return np.stack([validos.sum(axis=0), x.sum(axis=0), y.sum(axis=0),
+                     (x * x).sum(axis=0), (x * y).sum(axis=0), (y * y).sum(axis=0)]).astype(np.float64)
+
+
+def coeficientes_desde_sumas(sumas):
+    """
+    Pendiente, intercepto y r² por píxel a partir de las sumas suficientes.
+    Los píxeles con menos de dos años válidos o sin variación de lluvia quedan en NaN.
+    """
+    n, sx, sy, sxx, sxy, syy = sumas
+    var_x = n * sxx - sx ** 2
+    var_y = n * syy - sy ** 2
+    cov = n * sxy - sx * sy
+    valido = (n >= 2) & (var_x > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pendiente = np.where(valido, cov / var_x, np.nan)
+        intercepto = np.where(valido, (sy - pendiente * sx) / n, np.nan)
+        r2 = np.where(valido & (var_y > 0), cov ** 2 / (var_x * var_y), np.nan)
+    return pendiente, intercepto, r2
+
+
+def ajustar_por_pixel(coleccion, mascara=None, bloque_pixeles=250000):
+    """
+    Ajusta NDVI ~ precipitación en cada píxel de una ColeccionLocal y calcula los residuos.
+    Se procesa por bloques de píxeles para acotar la memoria en AOIs grandes.
+
+    Devuelve una ImagenLocal con 'pendiente', 'intercepto' y 'r2', y el cubo de residuos
+    (años, filas, columnas) en float32.
+    """
+    from utils.local import ImagenLocal
+
+    num_years = len(coleccion.years)
+    filas, columnas = coleccion.forma
+    x = coleccion.banda('precip').reshape(num_years, -1)
+    y = coleccion.banda('greenness').reshape(num_years, -1)
+    plano = None if mascara is None else np.asarray(mascara).reshape(-1)
+
+    coeficientes = np.empty((3, x.shape[1]), dtype=np.float32)
+    residual = np.empty((num_years, x.shape[1]), dtype=np.float32)
+    for inicio in range(0, x.shape[1], bloque_pixeles):
+        fin = min(inicio + bloque_pixeles, x.shape[1])
+        xb = x[:, inicio:fin].astype(np.float64)
+        yb = y[:, inicio:fin].astype(np.float64)
+        pendiente, intercepto, r2 = coeficientes_desde_sumas(sumas_regresion(xb, yb))
+        if plano is not None:
+            fuera = ~plano[inicio:fin]
+            pendiente[fuera] = intercepto[fuera] = r2[fuera] = np.nan
+        coeficientes[:, inicio:fin] = pendiente, intercepto, r2
+        residual[:, inicio:fin] = yb - (pendiente * xb + intercepto)
+
+    imagen = ImagenLocal(coeficientes.reshape(3, filas, columnas), ['pendiente', 'intercepto', 'r2'])
+    return imagen, residual.reshape(num_years, filas, columnas)
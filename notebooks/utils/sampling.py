@@ -0,0 +1,117 @@
+# --- Muestreo de entrenamiento: dentro de la geometría real, estratificado y en una sola pasada ---
+import numpy as np
+
+
+def estratos_cobertura(aoi, year=2001):
+    """Clase MODIS LC_Type1 (MCD12Q1) del año indicado como banda 'estrato'."""
+    import ee
+
+    cobertura = ee.ImageCollection('MODIS/061/MCD12Q1').filter(ee.Filter.calendarRange(year, year, 'year')).first()
+    return cobertura.select('LC_Type1').rename('estrato').clip(aoi)
+
+
+def estratos_residuo(imagen, aoi, num_estratos=4, scale=250):
+    """
+    Estratos por magnitud preliminar del cambio: máximo |residuo| de cada píxel en el periodo,
+    cortado en cuantiles del AOI (0 = menor magnitud). `imagen` es una imagen con una banda por año
+    (fitted o residuos) o la colección con la banda 'residual'.
+    """
+    import ee
+    from utils.cache import info_en_cache
+
+    if isinstance(imagen, ee.ImageCollection):
+        imagen = imagen.select('residual').toBands()
+    magnitud = imagen.abs().reduce(ee.Reducer.max()).rename('magnitud')
+
+    percentiles = [round(100 * i / num_estratos) for i in range(1, num_estratos)]
+    cortes = info_en_cache(magnitud.reduceRegion(
+        reducer=ee.Reducer.percentile(percentiles),
+        geometry=aoi.geometry(),
+        scale=scale,
+        maxPixels=1e13
+    ))
+    estrato = ee.Image(0)
+    for p in percentiles:
+        corte = cortes.get(f'magnitud_p{p}')
+        if corte is not None:
+            estrato = estrato.add(magnitud.gt(corte))
+    return estrato.rename('estrato').toInt().updateMask(magnitud.mask()).clip(aoi)
+
+
+def estratos_magnitud_local(imagen, num_estratos=4, mascara=None, bloque=262144):
+    """
+    Versión local de estratos_residuo para una ImagenLocal o un cubo (años, filas, columnas).
+    Devuelve un arreglo (filas, columnas) int16 con -1 donde no hay dato o fuera de la máscara.
+    """
+    from utils.kmeans import matriz_pixeles
+
+    filas, columnas = np.asarray(imagen.datos if hasattr(imagen, 'datos') else imagen).shape[-2:]
+    datos, validos = matriz_pixeles(imagen, bloque)
+    if mascara is not None:
+        validos &= np.asarray(mascara).reshape(-1)
+
+    magnitud = np.full(datos.shape[0], np.nan, dtype=np.float32)
+    for inicio in range(0, datos.shape[0], bloque):
+        fin = min(inicio + bloque, datos.shape[0])
+        ok = validos[inicio:fin]
+        magnitud[inicio:fin][ok] = np.abs(datos[inicio:fin][ok]).max(axis=1)
+
+    estratos = np.full(datos.shape[0], -1, dtype=np.int16)
+    if validos.any():
+        cortes = np.quantile(magnitud[validos], np.arange(1, num_estratos) / num_estratos)
+        estratos[validos] = np.searchsorted(cortes, magnitud[validos], side='right')
+    return estratos.reshape(filas, columnas)
+
+
+def muestreo_reservorio(imagen, num_pixeles=5000, mascara=None, estratos=None, bloque=262144, semilla=42):
+    """
+    Muestra aleatoria sin reemplazo de píxeles en una sola pasada y con memoria constante.
+    Cada píxel válido recibe una clave aleatoria y en cada estrato se conservan las filas con las
+    `num_pixeles` claves más pequeñas (un reservorio por estrato), así que los datos se leen por
+    bloques una sola vez y sirven cubos en memmap. Solo cuentan los píxeles sin NaN, dentro de
+    `mascara` y con estrato >= 0.
+
+    Devuelve (muestras (n, bandas) float32, estrato de cada muestra).
+    """
+    from utils.kmeans import matriz_pixeles
+
+    datos, validos = matriz_pixeles(imagen, bloque)
+    plano_mascara = None if mascara is None else np.asarray(mascara).reshape(-1)
+    plano_estratos = None if estratos is None else np.asarray(estratos).reshape(-1)
+    rng = np.random.default_rng(semilla)
+    reservorios = {}  # estrato -> (claves, filas)
+
+    for inicio in range(0, datos.shape[0], bloque):
+        fin = min(inicio + bloque, datos.shape[0])
+        ok = validos[inicio:fin].copy()
+        if plano_mascara is not None:
+            ok &= plano_mascara[inicio:fin]
+        estrato_bloque = np.zeros(fin - inicio, dtype=np.int64) if plano_estratos is None else plano_estratos[inicio:fin]
+        ok &= estrato_bloque >= 0
+        posiciones = np.flatnonzero(ok)
+        claves = rng.random(len(posiciones))
+
+        for estrato in np.unique(estrato_bloque[posiciones]):
+            seleccion = estrato_bloque[posiciones] == estrato
+            claves_e, posiciones_e = claves[seleccion], posiciones[seleccion]
+            previas, filas_previas = reservorios.get(estrato, (np.empty(0), None))
+            # Con el reservorio lleno solo entran las claves menores que la mayor guardada
+            if len(previas) >= num_pixeles:
+                entran = claves_e < previas.max()
+                claves_e, posiciones_e = claves_e[entran], posiciones_e[entran]
+                if len(claves_e) == 0:
+                    continue
+            filas_nuevas = np.asarray(datos[inicio:fin][posiciones_e], dtype=np.float32)
+            claves_e = np.concatenate([previas, claves_e])
+            filas_e = filas_nuevas if filas_previas is None else np.concatenate([filas_previas, filas_nuevas])
+            if len(claves_e) > num_pixeles:
+                quedan = np.argpartition(claves_e, num_pixeles)[:num_pixeles]
+                claves_e, filas_e = claves_e[quedan], filas_e[quedan]
+            reservorios[estrato] = (claves_e, filas_e)
+
+    if not reservorios:
+        raise ValueError("No hay píxeles válidos para muestrear.")
+    orden = sorted(reservorios)
+    muestras = np.concatenate([reservorios[e][1] for e in orden])
+    etiquetas = np.concatenate([np.full(len(reservorios[e][0]), e) for e in orden])
+    return muestras, etiquetas
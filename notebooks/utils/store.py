@@ -0,0 +1,179 @@
+# --- Almacén en disco de cubos locales: .npy abiertos con memmap + metadatos JSON ---
+import io
+import json
+from pathlib import Path
+
+import numpy as np
+
+
+class AlmacenCubos:
+    """
+    Carpeta con los productos intermedios del flujo (colección combinada, residuos, fitted, vértices).
+    Cada producto es un .npy que se abre con memmap, así que se lee de forma perezosa y los cortes
+    no copian datos, y un .json con años, bandas y georreferencia. El año es el primer eje: cada año
+    ocupa un bloque contiguo en disco y leerlo es una sola lectura secuencial.
+    """
+
+    def __init__(self, directorio):
+        self.directorio = Path(directorio)
+        self.directorio.mkdir(parents=True, exist_ok=True)
+
+    def _rutas(self, nombre):
+        return self.directorio / f"{nombre}.npy", self.directorio / f"{nombre}.json"
+
+    def existe(self, nombre):
+        return all(ruta.exists() for ruta in self._rutas(nombre))
+
+    def nombres(self):
+        return sorted(r.stem for r in self.directorio.glob("*.json") if self.existe(r.stem))
+
+    def metadatos(self, nombre):
+        with open(self._rutas(nombre)[1], encoding="utf-8") as f:
+            return json.load(f)
+
+    def crear(self, nombre, forma, bandas, years=None, georef=None, dtype=np.float32, relleno=np.nan):
+        """
+        Crea un producto vacío y devuelve su memmap para escribirlo por partes.
+        Con `years` es una colección (años, bandas, filas, columnas); sin ellos, una imagen (bandas, filas, columnas).
+        """
+        ruta_datos, ruta_meta = self._rutas(nombre)
+        datos = np.lib.format.open_memmap(ruta_datos, mode="w+", dtype=dtype, shape=tuple(forma))
+        if relleno is not None:
+            # Se rellena año a año (o banda a banda) para no tocar todo el archivo de una vez
+            for i in range(datos.shape[0]):
+                datos[i] = relleno
+
+        metadatos = {
+            "tipo": "coleccion" if years is not None else "imagen",
+            "forma": list(datos.shape),
+            "dtype": np.dtype(dtype).str,
+            "bandas": list(bandas),
+            "years": None if years is None else [int(y) for y in years],
+            "georef": georef,
+        }
+        with open(ruta_meta, "w", encoding="utf-8") as f:
+            json.dump(metadatos, f, ensure_ascii=False, indent=2)
+        return datos
+
+    def guardar(self, nombre, objeto):
+        """Guarda una ColeccionLocal o ImagenLocal copiando un año (o banda) a la vez y la devuelve abierta."""
+        from utils.local import ColeccionLocal
+
+        if isinstance(objeto, ColeccionLocal):
+            datos = self.crear(nombre, objeto.datos.shape, objeto.bandas, objeto.years, objeto.georef,
+                               dtype=objeto.datos.dtype, relleno=None)
+        else:
+            datos = self.crear(nombre, objeto.datos.shape, objeto.bandas, georef=objeto.propiedades.get("georef"),
+                               dtype=objeto.datos.dtype, relleno=None)
+        for i in range(datos.shape[0]):
+            datos[i] = objeto.datos[i]
+        datos.flush()
+        del datos
+        return self.abrir(nombre)
+
+    def agregar(self, nombre, datos, year=None, banda=None):
+        """
+        Agrega al final del primer eje un año (colección, datos (bandas, filas, columnas)) o una banda
+        (imagen, datos (filas, columnas)). Como el primer eje es el más externo, basta con reescribir
+        la cabecera del .npy y añadir los bytes al final, sin copiar lo que ya estaba.
+        """
+        ruta_datos, ruta_meta = self._rutas(nombre)
+        metadatos = self.metadatos(nombre)
+        dtype = np.dtype(metadatos["dtype"])
+        forma = [metadatos["forma"][0] + 1] + metadatos["forma"][1:]
+        bloque = np.ascontiguousarray(datos, dtype=dtype)
+        if list(bloque.shape) != forma[1:]:
+            raise ValueError(f"Se esperaba un bloque {tuple(forma[1:])} y se recibió {bloque.shape}")
+
+        with open(ruta_datos, "r+b") as f:
+            cabecera = self._cabecera(f, nombre, dtype, forma)
+            f.seek(0, io.SEEK_END)
+            f.write(bloque.tobytes())
+            f.seek(0)
+            f.write(cabecera)
+
+        metadatos["forma"] = forma
+        if metadatos["tipo"] == "coleccion":
+            metadatos["years"].append(int(year))
+        else:
+            metadatos["bandas"].append(banda)
+        with open(ruta_meta, "w", encoding="utf-8") as f:
+            json.dump(metadatos, f, ensure_ascii=False, indent=2)
+
+    def truncar(self, nombre, longitud):
+        """
+        Deja solo los primeros `longitud` elementos del primer eje (años o bandas): lo contrario de
+        agregar, para deshacer un agregado que quedó a medias. Solo reescribe la cabecera y corta el archivo.
+        """
+        ruta_datos, ruta_meta = self._rutas(nombre)
+        metadatos = self.metadatos(nombre)
+        if longitud >= metadatos["forma"][0]:
+            return
+        dtype = np.dtype(metadatos["dtype"])
+        forma = [longitud] + metadatos["forma"][1:]
+        with open(ruta_datos, "r+b") as f:
+            cabecera = self._cabecera(f, nombre, dtype, forma)
+            f.seek(0)
+            f.write(cabecera)
+            f.truncate(len(cabecera) + int(np.prod(forma)) * dtype.itemsize)
+
+        metadatos["forma"] = forma
+        if metadatos["tipo"] == "coleccion":
+            metadatos["years"] = metadatos["years"][:longitud]
+        else:
+            metadatos["bandas"] = metadatos["bandas"][:longitud]
+        with open(ruta_meta, "w", encoding="utf-8") as f:
+            json.dump(metadatos, f, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def _cabecera(f, nombre, dtype, forma):
+        """Cabecera .npy para la nueva forma, del mismo largo que la actual (los datos no se mueven)."""
+        version = np.lib.format.read_magic(f)
+        lector = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        lector(f)
+        inicio_datos = f.tell()
+        cabecera = io.BytesIO()
+        escritor = np.lib.format.write_array_header_1_0 if version == (1, 0) else np.lib.format.write_array_header_2_0
+        escritor(cabecera, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False,
+                            "shape": tuple(forma)})
+        if len(cabecera.getvalue()) != inicio_datos:
+            raise ValueError(f"La cabecera de '{nombre}' no admite cambiar de forma en el sitio")
+        return cabecera.getvalue()
+
+    def borrar(self, nombre):
+        """Elimina un producto (si existe)."""
+        for ruta in self._rutas(nombre):
+            ruta.unlink(missing_ok=True)
+
+    def guardar_estado(self, nombre, estado):
+        """
+        Guarda un diccionario JSON auxiliar (p. ej. el estado de la actualización incremental). Se escribe
+        a un temporal y se renombra, así que un corte a mitad deja el estado anterior completo.
+        """
+        ruta = self.directorio / f"{nombre}.estado.json"
+        temporal = ruta.with_suffix(".tmp")
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(estado, f, ensure_ascii=False, indent=2)
+        temporal.replace(ruta)
+
+    def borrar_estado(self, nombre):
+        (self.directorio / f"{nombre}.estado.json").unlink(missing_ok=True)
+
+    def leer_estado(self, nombre):
+        ruta = self.directorio / f"{nombre}.estado.json"
+        if not ruta.exists():
+            return None
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+
+    def abrir(self, nombre, modo="r"):
+        """Abre un producto sin cargarlo en memoria (modo 'r' solo lectura, 'r+' lectura y escritura)."""
+        from utils.local import ColeccionLocal, ImagenLocal
+
+        if not self.existe(nombre):
+            raise FileNotFoundError(f"El producto '{nombre}' no existe en {self.directorio}")
+        metadatos = self.metadatos(nombre)
+        datos = np.load(self._rutas(nombre)[0], mmap_mode=modo)
+        if metadatos["tipo"] == "coleccion":
+            return ColeccionLocal(datos, metadatos["years"], metadatos["bandas"], metadatos["georef"])
+        return ImagenLocal(datos, metadatos["bandas"], {"georef": metadatos["georef"]})
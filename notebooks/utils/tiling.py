@@ -0,0 +1,101 @@
+# --- Ejecución por teselas y en paralelo de la cadena residuos -> LandTrendr -> fitted ---
+import os
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+
+def dividir_en_teselas(filas, columnas, tamano_tesela=256):
+    """Genera los pares (slice_filas, slice_columnas) que cubren el raster por bloques."""
+    for f0 in range(0, filas, tamano_tesela):
+        for c0 in range(0, columnas, tamano_tesela):
+            yield slice(f0, min(f0 + tamano_tesela, filas)), slice(c0, min(c0 + tamano_tesela, columnas))
+
+
+def ejecutar_por_teselas(coleccion, mascara=None, tamano_tesela=256, procesos=None, salida=None,
+                         modo="global", almacen=None, nombre="fitted", **parametros_landtrendr):
+    """
+    Ejecuta calcular_residuos -> ejecutar_landtrendr -> extraer_fitted_stack por teselas.
+
+    `coleccion` es una ColeccionLocal con 'greenness' y 'precip' (sus datos pueden ser un np.memmap).
+    La recta NDVI ~ precipitación se ajusta con las medias de todo el AOI, igual que calcular_residuos,
+    y luego cada tesela se segmenta en un proceso aparte. Con modo="pixel" cada tesela ajusta
+    su propia recta por píxel y no hace falta la primera pasada. Si se indica `salida` (ruta .npy), las
+    bandas fitted se escriben en un memmap para que la memoria dependa del tamaño de tesela y no del AOI;
+    con `almacen` (AlmacenCubos) se escriben como el producto `nombre`.
+
+    Devuelve una ImagenLocal con las bandas fittedResidual_{year}.
+    """
+    from utils.local import ImagenLocal
+    from utils.processing import ajustar_ndvi_precip, sumas_anuales_local, valores_desde_sumas
+
+    filas, columnas = coleccion.forma
+    teselas = list(dividir_en_teselas(filas, columnas, tamano_tesela))
+
+    # Primera pasada: medias anuales del AOI acumuladas tesela a tesela
+    pendiente = intercepto = None
+    if modo == "global":
+        sumas = np.zeros((2, 2, len(coleccion.years)))
+        for fs, cs in teselas:
+            sumas += sumas_anuales_local(coleccion.ventana(fs, cs), None if mascara is None else mascara[fs, cs])
+        pendiente, intercepto = ajustar_ndvi_precip(valores_desde_sumas(coleccion.years, sumas))
+
+    forma_salida = (len(coleccion.years), filas, columnas)
+    nombres = [f'fittedResidual_{year}' for year in coleccion.years]
+    if almacen is not None:
+        fitted = almacen.crear(nombre, forma_salida, nombres, georef=coleccion.georef)
+    elif salida is None:
+        fitted = np.empty(forma_salida, dtype=np.float32)
+    else:
+        fitted = np.lib.format.open_memmap(salida, mode='w+', dtype=np.float32, shape=forma_salida)
+
+    def tarea(fs, cs):
+        datos = np.ascontiguousarray(coleccion.datos[:, :, fs, cs])
+        submascara = None if mascara is None else np.ascontiguousarray(mascara[fs, cs])
+        return (datos, coleccion.years, coleccion.bandas, submascara,
+                pendiente, intercepto, parametros_landtrendr)
+
+    procesos = procesos or os.cpu_count() or 1
+    if procesos == 1:
+        for fs, cs in teselas:
+            fitted[:, fs, cs] = _procesar_tesela(*tarea(fs, cs))
+    else:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            pendientes = {}
+            for fs, cs in teselas:
+                # Se limita el número de teselas en vuelo para acotar la memoria del proceso principal
+                if len(pendientes) >= 2 * procesos:
+                    _escribir_terminadas(pendientes, fitted, FIRST_COMPLETED)
+                pendientes[pool.submit(_procesar_tesela, *tarea(fs, cs))] = (fs, cs)
+            _escribir_terminadas(pendientes, fitted, ALL_COMPLETED)
+
+    if almacen is not None:
+        fitted.flush()
+        del fitted
+        return almacen.abrir(nombre)
+    if salida is not None:
+        fitted.flush()
+    return ImagenLocal(fitted, nombres, {'pendiente': pendiente, 'intercepto': intercepto, 'georef': coleccion.georef})
+
+
+def _escribir_terminadas(pendientes, fitted, modo):
+    terminadas, _ = wait(pendientes, return_when=modo)
+    for futuro in terminadas:
+        fs, cs = pendientes.pop(futuro)
+        fitted[:, fs, cs] = futuro.result()
+
+
+def _procesar_tesela(datos, years, bandas, mascara, pendiente, intercepto, parametros_landtrendr):
+    """Residuos, LandTrendr y extracción de fitted sobre una sola tesela (se ejecuta en un proceso hijo)."""
+    from utils.local import ColeccionLocal
+    from utils.processing import (agregar_residual_local, calcular_residuos_local, ejecutar_landtrendr,
+                                  extraer_fitted_stack)
+
+    coleccion = ColeccionLocal(datos, years, bandas)
+    # Sin coeficientes globales, la recta se ajusta por píxel dentro de la tesela
+    if pendiente is None:
+        coleccion = calcular_residuos_local(coleccion, mascara, modo="pixel")
+    else:
+        coleccion = agregar_residual_local(coleccion, pendiente, intercepto, mascara)
+    lt = ejecutar_landtrendr(coleccion.select('residual'), **parametros_landtrendr)
+    return extraer_fitted_stack(lt, years[0], len(years)).datos